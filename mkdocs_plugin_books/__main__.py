@@ -1,8 +1,4 @@
-import click
-
-@click.command()
-def main():
-    click.echo("Hello, world!")
+from .cli import main
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,137 @@
+""" Persistent index of the assets converted for a book. """
+
+import json
+import logging
+import sqlite3
+from hashlib import sha256
+from pathlib import Path
+
+from .transformers import get_pdf_page_sizes
+
+log = logging.getLogger("mkdocs")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    output TEXT PRIMARY KEY,
+    source TEXT,
+    hash TEXT,
+    converter TEXT,
+    params TEXT,
+    width REAL,
+    height REAL,
+    size INTEGER,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    page TEXT NOT NULL,
+    output TEXT NOT NULL,
+    PRIMARY KEY (page, output)
+);
+CREATE INDEX IF NOT EXISTS refs_output ON refs (output);
+"""
+
+
+class AssetIndex:
+    """SQLite index of the assets of a book.
+
+    Each converted file is recorded with its provenance (source path or
+    URL, converter and parameters), the hash of its content, its PDF page
+    size and the pages referencing it. Unused files are discarded by
+    reference counting, a file still referenced by a page is never removed.
+
+    Files are identified by their name in the assets directory, the
+    renderer may refer to them with a full path or a bare name.
+    """
+
+    def __init__(self, path: Path, assets_path: Path):
+        self.assets_path = Path(assets_path)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def update_page(self, page: str, assets: dict):
+        """Record the assets referenced by a page, replacing the previous ones."""
+        self.db.execute("DELETE FROM refs WHERE page = ?", (page,))
+        for asset, meta in assets.items():
+            output = Path(asset).name
+            self._update_asset(output, meta)
+            self.db.execute(
+                "INSERT OR IGNORE INTO refs (page, output) VALUES (?, ?)", (page, output)
+            )
+
+    def _update_asset(self, output: str, meta: dict):
+        path = self.assets_path / output
+        if not path.exists():
+            return
+        stat = path.stat()
+        source = meta.get("source", meta.get("url"))
+        provenance = (
+            str(source) if source else None,
+            meta.get("type"),
+            json.dumps(
+                {k: v for k, v in meta.items() if k not in ("type", "source", "url")},
+                default=str,
+            ),
+        )
+
+        row = self.db.execute(
+            "SELECT size, mtime FROM assets WHERE output = ?", (output,)
+        ).fetchone()
+        if row == (stat.st_size, stat.st_mtime):
+            self.db.execute(
+                "UPDATE assets SET source = ?, converter = ?, params = ? WHERE output = ?",
+                (*provenance, output),
+            )
+            return
+
+        # New or converted again, content hash and page size are updated
+        width = height = None
+        if path.suffix == ".pdf":
+            width, height = get_pdf_page_sizes(path) or (None, None)
+        digest = sha256(path.read_bytes()).hexdigest()
+        self.db.execute(
+            "INSERT OR REPLACE INTO assets "
+            "(output, source, converter, params, hash, width, height, size, mtime) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (output, *provenance, digest, width, height, stat.st_size, stat.st_mtime),
+        )
+
+    def retain_pages(self, pages):
+        """Forget references from pages no longer part of the book."""
+        pages = set(pages)
+        known = [row[0] for row in self.db.execute("SELECT DISTINCT page FROM refs")]
+        for page in known:
+            if page not in pages:
+                self.db.execute("DELETE FROM refs WHERE page = ?", (page,))
+
+    def get(self, output: str):
+        row = self.db.execute(
+            "SELECT output, source, hash, converter, params, width, height "
+            "FROM assets WHERE output = ?",
+            (Path(output).name,),
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ("output", "source", "hash", "converter", "params", "width", "height")
+        asset = dict(zip(keys, row))
+        asset["params"] = json.loads(asset["params"] or "{}")
+        return asset
+
+    def collect_garbage(self):
+        """Remove the files and records no page refers to anymore."""
+        used = {
+            row[0] for row in self.db.execute("SELECT DISTINCT output FROM refs")
+        }
+        self.db.execute(
+            "DELETE FROM assets WHERE output NOT IN (SELECT output FROM refs)"
+        )
+        removed = []
+        for file in self.assets_path.iterdir():
+            if file.is_file() and file.name not in used:
+                log.info("Removing unused asset %s", file)
+                file.unlink()
+                removed.append(file)
+        return removed
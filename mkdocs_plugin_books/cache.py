@@ -0,0 +1,93 @@
+""" Persistent cache of rendered pages. """
+
+import json
+import logging
+import pickle
+from hashlib import sha256
+from pathlib import Path
+
+log = logging.getLogger("mkdocs")
+
+
+class PageCache:
+    """Store the LaTeX of rendered pages along with their metadata
+    (acronyms, glossary, solutions, assets...) so unchanged pages can
+    be replayed without being parsed again.
+
+    Entries are keyed on everything that changes the output of a page:
+    its HTML, the render parameters, the templates and the plugin version.
+    Entries are always stored but only replayed when `replay` is set.
+
+    On dirty builds MkDocs does not render unmodified pages, their HTML
+    is unknown. An index keeps the last entry of each page for this case.
+
+    Entries of pages removed or modified since are deleted on save, only
+    the entries keyed during the build are kept.
+    """
+
+    def __init__(self, directory: Path, salt: str = "", replay: bool = True):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.salt = salt
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.touched = set()
+
+        self.index_path = self.directory / "index.json"
+        try:
+            self.index = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            self.index = {}
+
+    def key(self, page: dict) -> str:
+        """Key of a page, from the index if its HTML is unknown."""
+        digest = sha256(self.salt.encode())
+        for name in ("file_path", "base_level", "numbered", "drop_title"):
+            digest.update(f"\0{name}={page[name]}".encode())
+        identifier = digest.hexdigest()
+
+        if page["html"] is None:
+            key = self.index.get(identifier)
+        else:
+            digest.update(page["html"].encode())
+            self.index[identifier] = key = digest.hexdigest()
+        if key:
+            self.touched.add(key)
+        return key
+
+    def get(self, key: str, assets_path: Path):
+        """Return the cached (latex, state) of a page, or None if missing.
+        An entry referencing an asset that no longer exists is a miss."""
+        try:
+            path = self.directory / f"{key}.pickle"
+            result = pickle.loads(path.read_bytes()) if self.replay and key else None
+        except (OSError, pickle.PickleError, EOFError):
+            result = None
+
+        if result and all(
+            (assets_path / Path(asset).name).exists() for asset in result[1]["assets_map"]
+        ):
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, result: tuple):
+        (self.directory / f"{key}.pickle").write_bytes(pickle.dumps(result))
+
+    def save(self):
+        """Save the index, entries not keyed by this build are deleted."""
+        self.index = {
+            identifier: key
+            for identifier, key in self.index.items()
+            if key in self.touched
+        }
+        self.index_path.write_text(json.dumps(self.index, indent=1))
+        for path in self.directory.glob("*.pickle"):
+            if path.stem not in self.touched:
+                path.unlink(missing_ok=True)
+
+    def report(self, name: str):
+        log.info("LaTeX cache for '%s': %d hits, %d misses", name, self.hits, self.misses)
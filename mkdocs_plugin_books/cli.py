@@ -0,0 +1,253 @@
+""" Command line interface of mkdocs-books.
+
+Books can be rendered again from a snapshot saved during a MkDocs build
+(see the `snapshot` option of the plugin). Iterating on templates or on
+the renderer no longer requires running every Markdown extension over
+the whole site.
+"""
+
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import click
+
+from .compiler import compile_books, get_format_name
+from .config import BookConfig
+from .parsers import PARSERS, get_parser, parse_html
+from .plugin import Book, Books
+from .renderer import LaTeXRenderer
+from .text import escape_latex_chars, escape_text, escape_texts, postprocess_latex
+from .snapshot import load_nav, read_snapshot
+
+log = logging.getLogger("mkdocs")
+
+
+def load_book_config(data: dict) -> BookConfig:
+    config = BookConfig()
+    config.load_dict(data)
+    errors, warnings = config.validate()
+    for key, error in errors:
+        raise click.ClickException(f"Invalid book option '{key}': {error}")
+    config.directory = Path(data["directory"])
+    return config
+
+
+@click.group()
+@click.option("--verbose", "-v", is_flag=True, help="Enable debug messages.")
+def main(verbose):
+    """Generate LaTeX books from MkDocs documentation."""
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        format="%(levelname)-8s -  %(message)s",
+    )
+
+
+@main.command()
+@click.argument("snapshot", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--jobs", "-j", type=int, help="Number of processes rendering pages.")
+@click.option(
+    "--book", "-b", "titles", multiple=True, help="Only render the book with this title."
+)
+@click.option(
+    "--pages",
+    "-p",
+    "patterns",
+    multiple=True,
+    help="Only include pages whose source path matches this glob pattern.",
+)
+@click.option("--dirty", is_flag=True, help="Replay unchanged pages from the cache.")
+@click.option("--split", is_flag=True, help="Also write the parts for a split compilation.")
+@click.option("--format", "fmt", is_flag=True, help="Start from the format of the class.")
+@click.option("--offline", is_flag=True, help="Only use remote images fetched before.")
+def render(snapshot, jobs, titles, patterns, dirty, split, fmt, offline):
+    """Render books from a SNAPSHOT of the page HTML."""
+    data = read_snapshot(snapshot)
+
+    plugin = Books()
+    errors, warnings = plugin.load_config({
+        "jobs": jobs,
+        "compile": {"split": split, "format": fmt},
+        "convert": {"offline": offline},
+    })
+    for key, error in errors:
+        raise click.ClickException(f"Invalid option '{key}': {error}")
+    plugin.project_dir = Path(data["project_dir"])
+    plugin.dirty = dirty
+
+    known = [book["config"]["title"] for book in data["books"]]
+    for title in titles:
+        if title not in known:
+            raise click.ClickException(
+                f"Book '{title}' not found in snapshot, available: {', '.join(known)}"
+            )
+
+    books = []
+    for book in data["books"]:
+        if titles and book["config"]["title"] not in titles:
+            continue
+        section = load_nav(book["nav"], data["pages"], patterns)
+        if section is None:
+            log.warning("No page of '%s' matches %s", book["config"]["title"], patterns)
+            continue
+        books.append(Book(section, load_book_config(book["config"]), plugin))
+
+    plugin._build_books(books)
+
+
+@main.command(name="compile")
+@click.argument(
+    "directories", nargs=-1, required=True,
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+)
+@click.option("--engine", "-e", default="lualatex", show_default=True)
+@click.option("--jobs", "-j", default=2, show_default=True,
+              help="Maximum number of engines running concurrently.")
+@click.option("--max-runs", default=5, show_default=True, type=click.IntRange(min=1))
+@click.option("--split/--full", default=False,
+              help="Compile the chapters in parallel, or the full book at once.")
+@click.option("--format", "fmt", is_flag=True,
+              help="Books were generated to start from the format of the class.")
+def compile_(directories, engine, jobs, max_runs, split, fmt):
+    """Compile generated book DIRECTORIES into PDF."""
+    fmt = get_format_name(engine) if fmt else None
+    if not compile_books(list(directories), engine, jobs, max_runs, split, fmt):
+        raise click.ClickException("Some books failed to compile")
+
+
+@main.group()
+def bench():
+    """Benchmarks of the renderer."""
+
+
+def best_of(repeat: int, func, *args) -> float:
+    """Shortest run of a function, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@bench.command()
+@click.argument("snapshot", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--repeat", "-r", default=5, show_default=True)
+def parsers(snapshot, repeat):
+    """Compare the HTML parsers on the pages of a SNAPSHOT.
+
+    Pages are parsed, then rendered, with each installed parser. The
+    LaTeX rendered must be the same whatever the parser."""
+    data = read_snapshot(snapshot)
+    pages = [
+        {"html": page["html"], "file_path": Path(page["abs_src_path"])}
+        for page in data["pages"].values()
+    ]
+    config = BookConfig()
+    if data["books"]:
+        config = load_book_config(data["books"][0]["config"])
+
+    def parse_pages(parser):
+        for page in pages:
+            parse_html(page["html"], parser)
+
+    def render_pages(renderer, output_path, outputs):
+        outputs.clear()
+        for page in pages:
+            renderer.reset_state()
+            outputs.append(renderer.render(output_path=output_path, **page))
+
+    results = {}
+    with TemporaryDirectory() as tmp:
+        for parser in PARSERS:
+            if get_parser(parser) != parser:
+                click.echo(f"{parser:12} not installed")
+                continue
+            config.parser = parser
+            renderer = LaTeXRenderer(Path(tmp), config)
+            outputs = results[parser] = []
+            parse = best_of(repeat, parse_pages, parser)
+            render = best_of(repeat, render_pages, renderer, Path(tmp), outputs)
+            click.echo(
+                f"{parser:12} parse {parse * 1000:8.1f} ms"
+                f"  render {render * 1000:8.1f} ms  ({len(pages)} pages)"
+            )
+
+    reference, *others = results.values()
+    if any(outputs != reference for outputs in others):
+        raise click.ClickException("The parsers render different LaTeX")
+
+
+# Text nodes of a typical page, see bench text
+SAMPLE_TEXTS = [
+    "The ",
+    "printf",
+    " function writes to the standard output, see ",
+    "Section 3.2",
+    ". Les composants semi-conducteurs sont dopés à 50 % avec du bore "
+    "et du phosphore (cf. l'exemple #4 et le fichier config_file.h).\n",
+    "\n",
+    "A path such as C:\\Users\\~name costs $5 & {more}.",
+]
+
+
+@bench.command(name="text")
+@click.option("--size", default=1.0, show_default=True, help="Megabytes of text.")
+@click.option("--repeat", "-r", default=5, show_default=True)
+def text_(size, repeat):
+    """Cost per megabyte of the text processing of the pages."""
+    length = sum(map(len, SAMPLE_TEXTS))
+    texts = SAMPLE_TEXTS * max(1, int(size * 2**20 / length))
+    latex = "".join(escape_texts(texts))
+    size = sum(map(len, texts)) / 2**20
+
+    benchmarks = {
+        "escape_latex_chars": lambda: [escape_latex_chars(t) for t in texts],
+        "escape_text": lambda: [escape_text(t) for t in texts],
+        "escape_texts": lambda: escape_texts(texts),
+        "postprocess_latex": lambda: postprocess_latex(latex),
+    }
+    for name, func in benchmarks.items():
+        seconds = best_of(repeat, func)
+        click.echo(f"{name:20} {seconds * 1000 / size:8.1f} ms/MB")
+
+
+# Libraries only imported by the conversions needing them
+LAZY_MODULES = ["IPython", "PIL", "cairosvg", "pillow_avif", "pypdf", "requests"]
+
+# Imports the plugin, once MkDocs is imported as it would be by a build
+IMPORT_SCRIPT = """
+import json, sys, time
+import mkdocs.config.defaults, mkdocs.plugins, mkdocs.structure.files, mkdocs.structure.nav
+start = time.perf_counter()
+import mkdocs_plugin_books.plugin
+print(json.dumps([time.perf_counter() - start, sorted(sys.modules)]))
+"""
+
+
+@bench.command()
+@click.option("--repeat", "-r", default=5, show_default=True)
+@click.option("--budget", default=250, show_default=True, help="Milliseconds.")
+def imports(repeat, budget):
+    """Import time of the plugin, fails above the budget or if a library
+    of the conversions is imported with the plugin."""
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, check=True
+        ).stdout
+        seconds, modules = json.loads(output)
+        timings.append(seconds)
+
+    milliseconds = min(timings) * 1000
+    click.echo(f"plugin import {milliseconds:8.1f} ms (budget {budget} ms)")
+
+    imported = [name for name in LAZY_MODULES if name in modules]
+    if imported:
+        raise click.ClickException(f"Imported with the plugin: {', '.join(imported)}")
+    if milliseconds > budget:
+        raise click.ClickException("Plugin import time above the budget")
@@ -0,0 +1,525 @@
+""" Compilation of the generated books into PDF.
+
+Each book is compiled in its own directory, auxiliary files are kept
+between builds so a warm rebuild only needs a single engine pass.
+Glossaries, index and bibliography tools are only run again when their
+input files changed, which is tracked by content hash rather than by
+modification time.
+
+Drafts can be compiled one chapter at a time: the book is then generated
+with a standalone wrapper per top-level chapter (see `split.tex`), the
+wrappers are compiled concurrently and merged into the final PDF. Each
+part is seeded with the counters reached by the previous part and with
+the labels of the other parts, seeds are refined until they are stable.
+"""
+
+import json
+import logging
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from hashlib import sha256
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
+
+from .helpers import copy_if_changed, write_if_changed
+
+if TYPE_CHECKING:
+    import pypdf
+
+log = logging.getLogger("mkdocs")
+
+STATE_FILE = ".mkbooks-compile.json"
+
+# List of the parts of a book generated for a split compilation
+PARTS_FILE = "main-parts.json"
+
+# Counters carried from a part to the next one, besides the page
+COUNTERS = ("part", "chapter", "exercisecounter")
+
+CLASS_FILE = Path(__file__).parent / "templates" / "mkbook.cls"
+
+# Only the class is dumped in the format, book metadata follows endofdump
+FORMAT_SOURCE = (
+    "\\documentclass{mkbook}\n"
+    "\\csname endofdump\\endcsname\n"
+    "\\begin{document}\n"
+    "\\end{document}\n"
+)
+
+# Auxiliary files merged from all parts into the part printing them
+MERGED_FILES = {"front": ("toc",), "back": ("lof", "lot", "glo", "acn", "idx")}
+
+RE_COUNTERS = re.compile(r"^%mkbook-counters(.*)$", re.M)
+
+# Entries of the lists written to the aux file, see PartCompiler.entries
+RE_WRITEFILE = re.compile(r"^\\@writefile\{(toc|lof|lot)\}\{(.*)\}$", re.M)
+
+RE_RERUN = re.compile(
+    r"Rerun to get|Label\(s\) may have changed|Rerun LaTeX|Please rerun LaTeX"
+)
+
+# TeX errors, with -file-line-error they are prefixed by file:line:
+RE_ERROR = re.compile(r"^(!|[^:\s]+:\d+: )")
+
+
+def file_digest(path: Path) -> Optional[str]:
+    if not path.exists():
+        return None
+    return sha256(path.read_bytes()).hexdigest()
+
+
+def bibtex_digest(aux: Path) -> Optional[str]:
+    """Only citations and bibliography commands of the aux file
+    are relevant to BibTeX."""
+    if not aux.exists():
+        return None
+    lines = [
+        line
+        for line in aux.read_text(errors="replace").splitlines()
+        if line.startswith(("\\citation", "\\bibdata", "\\bibstyle"))
+    ]
+    if not any(line.startswith("\\bibdata") for line in lines):
+        return None
+    return sha256("\n".join(lines).encode()).hexdigest()
+
+
+def _output(command: List[str]) -> str:
+    try:
+        return subprocess.run(
+            command, capture_output=True, stdin=subprocess.DEVNULL, check=True
+        ).stdout.decode(errors="replace")
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def get_format_name(engine: str) -> Optional[str]:
+    """Name of the format of the mkbook class for an engine. It changes
+    with the class, the engine version and the formats of the TeX
+    installation, which are dumped again whenever packages are updated."""
+    if shutil.which(engine) is None:
+        return None
+    digest = sha256(CLASS_FILE.read_bytes())
+    digest.update(_output([engine, "--version"]).encode())
+    for var in ("TEXMFSYSVAR", "TEXMFVAR"):
+        root = _output(["kpsewhich", f"-var-value={var}"]).strip()
+        for fmt in sorted(Path(root).glob(f"web2c/*/{engine}.fmt")) if root else []:
+            digest.update(f"{fmt}:{fmt.stat().st_mtime_ns}".encode())
+    return f"mkbook-{digest.hexdigest()[:16]}"
+
+
+def build_format(directory: Path, engine: str, name: str) -> bool:
+    """Dump the preamble of the class into `name`.fmt with mylatexformat.
+    Return False if the format cannot be dumped, it is not tried again
+    until the class or the installation changes."""
+    fmt = directory / f"{name}.fmt"
+    if fmt.exists():
+        return True
+    if (directory / f"{name}.log").exists():
+        return False
+
+    start = time.monotonic()
+    copy_if_changed(CLASS_FILE, directory / "mkbook.cls")
+    write_if_changed(directory / "mkbook-format.tex", FORMAT_SOURCE)
+    completed = subprocess.run(
+        [
+            engine,
+            "-ini",
+            f"-jobname={name}",
+            "-interaction=nonstopmode",
+            f"&{engine}",
+            "mylatexformat.ltx",
+            "mkbook-format.tex",
+        ],
+        cwd=directory,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        stdin=subprocess.DEVNULL,
+        check=False,
+    )
+    if completed.returncode != 0 or not fmt.exists():
+        log.warning("Cannot dump the format %s, see %s.log", name, directory / name)
+        return False
+
+    for old in directory.glob("mkbook-*.fmt"):
+        if old != fmt:
+            old.unlink()
+    log.info("Format %s dumped in %.1f seconds", name, time.monotonic() - start)
+    return True
+
+
+def dump_format(directories: List[Path], engine: str, name: str) -> bool:
+    """Dump the format `name` once and copy it into the directories of
+    the books. Return False if it cannot be dumped."""
+    first = Path(directories[0])
+    first.mkdir(parents=True, exist_ok=True)
+    if not build_format(first, engine, name):
+        return False
+    for directory in directories[1:]:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        copy_if_changed(first / f"{name}.fmt", Path(directory) / f"{name}.fmt")
+    return True
+
+
+class BookCompiler:
+    """Compile a LaTeX book with the minimal number of reruns."""
+
+    def __init__(self, directory: Path, engine: str = "lualatex", max_runs: int = 5,
+                 main: str = "main.tex", engines: Optional[threading.Semaphore] = None,
+                 fmt: Optional[str] = None):
+        self.directory = Path(directory)
+        self.engine = engine
+        self.max_runs = max_runs
+        self.main = main
+        self.jobname = Path(main).stem
+        self.engines = engines
+        self.fmt = fmt
+        self.engine_runs = 0
+
+        self.state_path = self.directory / f".{self.jobname}{STATE_FILE}"
+        try:
+            self.state = json.loads(self.state_path.read_text())
+        except (OSError, ValueError):
+            self.state = {}
+
+    def _path(self, ext: str) -> Path:
+        return self.directory / f"{self.jobname}.{ext}"
+
+    def _run(self, command: List[str]) -> bool:
+        log.debug("Running %s in %s", " ".join(command), self.directory)
+        completed = subprocess.run(
+            command,
+            cwd=self.directory,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            check=False,
+        )
+        if completed.returncode != 0:
+            log.error("%s failed with return code %s", command[0], completed.returncode)
+            for line in completed.stdout.decode(errors="replace").splitlines():
+                if RE_ERROR.match(line):
+                    log.error("%s: %s", command[0], line)
+            return False
+        return True
+
+    def run_engine(self) -> bool:
+        self.engine_runs += 1
+        with self.engines or nullcontext():
+            return self._run(
+                [
+                    self.engine,
+                    *([f"-fmt={self.fmt}"] if self.fmt else []),
+                    "-interaction=nonstopmode",
+                    "-halt-on-error",
+                    "-file-line-error",
+                    "-shell-escape",
+                    self.main,
+                ]
+            )
+
+    def _tools(self):
+        """Auxiliary tools with the digest of their inputs."""
+        glossaries = "".join(file_digest(self._path(ext)) or "" for ext in ("glo", "acn"))
+        yield "makeglossaries", glossaries or None, ["makeglossaries", self.jobname]
+        yield "makeindex", file_digest(self._path("idx")), ["makeindex", self.jobname]
+        yield "biber", file_digest(self._path("bcf")), ["biber", self.jobname]
+        yield "bibtex", bibtex_digest(self._path("aux")), ["bibtex", self.jobname]
+
+    def run_tools(self) -> bool:
+        """Run tools whose inputs changed, return True if any was run."""
+        ran = False
+        for name, digest, command in self._tools():
+            if digest is None or self.state.get(name) == digest:
+                continue
+            if shutil.which(command[0]) is None:
+                log.warning("%s not found, skipping", command[0])
+                continue
+            # A failed tool is run again by the next build
+            if self._run(command):
+                self.state[name] = digest
+            ran = True
+        return ran
+
+    def needs_rerun(self) -> bool:
+        log_file = self._path("log")
+        if not log_file.exists():
+            return False
+        return bool(RE_RERUN.search(log_file.read_text(errors="replace")))
+
+    def merge_inputs(self) -> bool:
+        """Hook to update the inputs of the engine between runs,
+        return True if they changed."""
+        return False
+
+    def compile(self) -> bool:
+        start = time.monotonic()
+        self.merge_inputs()
+        ok = self.run_engine()
+        runs = 1
+        while ok and runs < self.max_runs:
+            merged = self.merge_inputs()
+            ran = self.run_tools()
+            if not (merged or ran or self.needs_rerun()):
+                break
+            ok = self.run_engine()
+            runs += 1
+
+        self.state_path.write_text(json.dumps(self.state, indent=1))
+        self.duration = time.monotonic() - start
+        return ok
+
+
+
+class PartCompiler(BookCompiler):
+    """Compile a part of a split book. The front and back parts print
+    the lists (contents, figures, glossaries...) of the whole book, their
+    auxiliary files are merged from all parts after each engine run."""
+
+    def __init__(self, directory: Path, part: str, parts: List[str], **kwargs):
+        super().__init__(directory, main=f"{part}.tex", **kwargs)
+        self.parts = parts
+        self.part = part.rsplit("-", 1)[-1]
+        self.merged = MERGED_FILES.get(self.part, ())
+        self.own = {}
+        self.written = {}
+
+    def _tools(self):
+        # Glossaries and index are only printed in the back part
+        if self.part == "back":
+            yield from super()._tools()
+
+    def merge_inputs(self) -> bool:
+        changed = False
+        for ext in self.merged:
+            path = self._path(ext)
+            content = path.read_text(errors="replace") if path.exists() else ""
+            # Not touched by the engine since merged, own entries are kept
+            if content != self.written.get(ext):
+                self.own[ext] = content
+            merged = "".join(
+                self.own[ext] if part == self.jobname else self.entries(part, ext)
+                for part in self.parts
+            )
+            changed |= merged != self.written.get(ext)
+            path.write_text(merged)
+            self.written[ext] = merged
+        return changed
+
+    def compile(self) -> bool:
+        ok = super().compile()
+        # Only the entries of the part are left for the next build
+        for ext, content in self.own.items():
+            self._path(ext).write_text(content)
+        return ok
+
+    def read(self, part: str, ext: str) -> str:
+        path = self.directory / f"{part}.{ext}"
+        return path.read_text(errors="replace") if path.exists() else ""
+
+    def entries(self, part: str, ext: str) -> str:
+        """Entries of another part for one of the merged files. Parts not
+        printing the contents or the lists of figures and tables never
+        open their file, their entries are taken from their aux file."""
+        if ext not in ("toc", "lof", "lot"):
+            return self.read(part, ext)
+        return "".join(
+            f"{match.group(2)}\n"
+            for match in RE_WRITEFILE.finditer(self.read(part, "aux"))
+            if match.group(1) == ext
+        )
+
+    def labels(self) -> List[str]:
+        aux = self.read(self.jobname, "aux")
+        return [line for line in aux.splitlines() if line.startswith("\\newlabel{")]
+
+    def counters(self) -> dict:
+        """Counters reached at the end of the part."""
+        match = RE_COUNTERS.search(self.read(self.jobname, "aux"))
+        if match is None:
+            return {}
+        return dict(item.split("=", 1) for item in match.group(1).split())
+
+    def pages(self) -> int:
+        import pypdf
+
+        pdf = self._path("pdf")
+        return len(pypdf.PdfReader(pdf).pages) if pdf.exists() else 0
+
+
+class SplitCompiler:
+    """Compile the parts of a book concurrently and merge them.
+
+    Chapters are compiled first, then the front and back parts which
+    collect their lists. Parts are compiled again, in a new round, while
+    their seed (counters and labels of the other parts) is not stable.
+    """
+
+    def __init__(self, directory: Path, engine: str = "lualatex", max_runs: int = 5,
+                 engines: Optional[threading.Semaphore] = None, fmt: Optional[str] = None):
+        self.directory = Path(directory)
+        self.engine = engine
+        self.max_runs = max_runs
+        parts = json.loads((self.directory / PARTS_FILE).read_text())
+        self.compilers = [
+            PartCompiler(self.directory, part, parts, engine=engine,
+                         max_runs=max_runs, engines=engines, fmt=fmt)
+            for part in parts
+        ]
+
+    @property
+    def engine_runs(self) -> int:
+        return sum(compiler.engine_runs for compiler in self.compilers)
+
+    def write_seeds(self, compilers: List[PartCompiler]) -> List[PartCompiler]:
+        """Write the seed of the given parts, return those whose seed changed."""
+        changed = []
+        page = 1
+        previous = None
+        for compiler in self.compilers:
+            counters = {}
+            if previous is not None:
+                counters = {"page": page, **previous.counters()}
+            if compiler in compilers:
+                labels = [
+                    line
+                    for other in self.compilers
+                    if other is not compiler
+                    for line in other.labels()
+                ]
+                seed = "\n".join([
+                    "% Seed of the part, generated by mkdocs-books",
+                    "\\makeatletter", *labels, "\\makeatother",
+                    "\\def\\mkbookcounters{%s}" % "".join(
+                        f"\\setcounter{{{name}}}{{{value}}}"
+                        for name, value in counters.items()
+                    ),
+                    "",
+                ])
+                if write_if_changed(self.directory / f"{compiler.jobname}-seed.tex", seed):
+                    changed.append(compiler)
+            # The main matter starts again from page 1
+            page = 1 if compiler.part == "front" else page + compiler.pages()
+            previous = compiler
+        return changed
+
+    def compile(self) -> bool:
+        start = time.monotonic()
+        chapters = [c for c in self.compilers if c.part not in MERGED_FILES]
+        lists = [c for c in self.compilers if c.part in MERGED_FILES]
+
+        def compile_parts(compilers):
+            return all(list(pool.map(lambda compiler: compiler.compile(), compilers)))
+
+        with ThreadPoolExecutor(len(self.compilers)) as pool:
+            # Seeds from the previous build are usually right already
+            self.write_seeds(self.compilers)
+            pending = chapters
+            for _ in range(self.max_runs):
+                ok = compile_parts(pending)
+                if ok:
+                    # Front and back parts depend on all chapters
+                    self.write_seeds(lists)
+                    ok = compile_parts(lists)
+                pending = self.write_seeds(chapters)
+                if not ok or not pending:
+                    break
+
+        if ok:
+            self.merge()
+        self.duration = time.monotonic() - start
+        return ok
+
+    def merge(self):
+        """Merge the PDF of the parts, outlines and page labels are kept."""
+        import pypdf
+
+        writer = pypdf.PdfWriter()
+        for compiler in self.compilers:
+            reader = pypdf.PdfReader(compiler._path("pdf"))
+            offset = len(writer.pages)
+            writer.append(reader, import_outline=True)
+            labels = get_page_labels(reader)
+            ends = [index for index, _ in labels[1:]] + [len(reader.pages)]
+            for (index, label), end in zip(labels, ends):
+                if end <= index:
+                    continue
+                style, prefix = label.get("/S"), label.get("/P")
+                writer.set_page_label(
+                    offset + index,
+                    offset + end - 1,
+                    style,
+                    "" if style is None and prefix is None else prefix,
+                    label.get("/St", 0),
+                )
+
+        output = self.directory / "main.pdf"
+        temp = output.with_suffix(".pdf.tmp")
+        with open(temp, "wb") as fp:
+            writer.write(fp)
+        temp.replace(output)
+
+
+def get_page_labels(reader: "pypdf.PdfReader") -> List[tuple]:
+    """Page label ranges of a PDF as (first page index, label dict)."""
+    labels = []
+
+    def walk(node):
+        node = node.get_object()
+        nums = node.get("/Nums", [])
+        for i in range(0, len(nums), 2):
+            labels.append((int(nums[i]), nums[i + 1].get_object()))
+        for kid in node.get("/Kids", []):
+            walk(kid)
+
+    root = reader.trailer["/Root"]
+    if "/PageLabels" in root:
+        walk(root["/PageLabels"])
+    return sorted(labels, key=lambda item: item[0])
+
+
+def compile_books(directories: List[Path], engine: str = "lualatex",
+                  jobs: int = 2, max_runs: int = 5, split: bool = False,
+                  fmt: Optional[str] = None) -> bool:
+    """Compile several books concurrently, at most `jobs` engines
+    run at the same time. Return True if all books compiled.
+
+    With `split`, books generated with their parts are compiled one
+    chapter at a time, otherwise the full book is compiled at once.
+    Books generated with the format `fmt` get it dumped once and copied
+    into their directory, the default format of the engine is used if
+    it cannot be dumped."""
+    if shutil.which(engine) is None:
+        log.error("LaTeX engine '%s' not found, cannot compile the books", engine)
+        return False
+
+    if fmt and directories and not dump_format(directories, engine, fmt):
+        fmt = engine
+
+    engines = threading.BoundedSemaphore(max(1, jobs))
+
+    def run(directory):
+        directory = Path(directory)
+        if split and (directory / PARTS_FILE).exists():
+            compiler = SplitCompiler(directory, engine, max_runs, engines, fmt)
+        else:
+            if split:
+                log.warning("No parts generated in %s, compiling the full book", directory)
+            compiler = BookCompiler(directory, engine, max_runs, engines=engines, fmt=fmt)
+        ok = compiler.compile()
+        log.info(
+            "Compiled '%s' in %.1f seconds (%d %s runs)%s",
+            compiler.directory.resolve().name,
+            compiler.duration,
+            compiler.engine_runs,
+            engine,
+            "" if ok else " with errors",
+        )
+        return ok
+
+    with ThreadPoolExecutor(max(1, len(directories))) as pool:
+        return all(list(pool.map(run, directories)))
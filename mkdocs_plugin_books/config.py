@@ -1,6 +1,19 @@
 from .helpers import to_kebab_case
 from mkdocs.config import base, config_options as c
-from mkdocs.config.base import Config
+from mkdocs.config.base import Config, ValidationError
+
+
+class PositiveInt(c.Type):
+    """An integer of at least 1."""
+
+    def __init__(self, default: int):
+        super().__init__(int, default=default)
+
+    def run_validation(self, value):
+        value = super().run_validation(value)
+        if value < 1:
+            raise ValidationError(f"Expected a positive integer, got {value}")
+        return value
 
 
 class CoverConfig(base.Config):
@@ -16,9 +29,60 @@ class DebugConfig(base.Config):
     clean_assets = c.Type(bool, default=True)
     """ Clean assets folder before generation (regenerate images). """
 
+    trace = c.Type(bool, default=False)
+    """ Export a timing trace (trace.json) in Chrome trace-event format. """
+
+
+class ServeConfig(base.Config):
+    enabled = c.Type(bool, default=False)
+    """ Generate LaTeX in the background during mkdocs serve. """
+
+    debounce = c.Type(float, default=1.0)
+    """ Seconds to wait for further changes before rendering. """
+
+    jobs = c.Type(int, default=1)
+    """ Number of processes rendering pages during serve. """
+
+
+class CompileConfig(base.Config):
+    enabled = c.Type(bool, default=False)
+    """ Compile the generated books into PDF. """
+
+    engine = c.Type(str, default="lualatex")
+    """ LaTeX engine used to compile the books. """
+
+    jobs = c.Type(int, default=2)
+    """ Maximum number of LaTeX engines running concurrently. """
+
+    max_runs = PositiveInt(default=5)
+    """ Maximum number of engine passes per book. """
+
+    split = c.Type(bool, default=False)
+    """ Compile the chapters in parallel and merge them, for drafts. """
+
+    format = c.Type(bool, default=False)
+    """ Start the books from a format dumped from the mkbook class. """
+
+
+class ConvertConfig(base.Config):
+    jobs = c.Optional(c.Type(int))
+    """ Concurrent conversions of images and SVG (defaults to `jobs`). """
+
+    container_jobs = c.Optional(c.Type(int))
+    """ Concurrent Mermaid and draw.io containers (defaults to `jobs`). """
+
+    network_jobs = c.Type(int, default=8)
+    """ Concurrent downloads of remote images. """
+
+    max_download_size = c.Type(int, default=50 * 1024 * 1024)
+    """ Largest remote image downloaded, in bytes (0 for no limit). """
+
+    offline = c.Type(bool, default=False)
+    """ Never fetch remote images, use those fetched by previous builds. """
+
 
 class BookConfig(base.Config):
-    debug = DebugConfig()
+    debug = c.SubConfig(DebugConfig)
     """ Debugging options for developpers. """
 
     directory = c.Optional(c.Dir())
@@ -49,6 +113,22 @@ class BookConfig(base.Config):
     """ Email displayed in the cover. """
 
     mermaid_config = c.Type(str, default="")
+
+    highlight = c.Choice(("minted", "pygments"), default="minted")
+    """ Highlight code with minted while compiling or Pygments while rendering. """
+
+    highlight_style = c.Type(str, default="trac")
+    """ Pygments style of the code highlighted while rendering. """
+
+    image_dpi = c.Type(int, default=300)
+    """ Resolution of raster images at their printed width (0 keeps them as is). """
+
+    render_engine = c.Choice(("visitor", "passes"), default="visitor")
+    """ Render pages in a single traversal, or pass by pass (for comparison). """
+
+    parser = c.Choice(("auto", "lxml", "html.parser"), default="auto")
+    """ HTML parser of the pages, auto uses lxml when installed. """
+
     folder = c.Dir(default=None)
 
     frontmatter = c.ListOfItems(c.Type(str), default=[])
@@ -78,6 +158,22 @@ class BooksConfig(base.Config):
     books = c.ListOfItems(c.SubConfig(BookConfig), default=[])
     """ List of books to generate. """
 
+    jobs = c.Optional(c.Type(int))
+    """ Number of processes rendering pages (defaults to CPU count). """
+
+    serve = c.SubConfig(ServeConfig)
+    """ Incremental generation during mkdocs serve. """
+
+    compile = c.SubConfig(CompileConfig)
+    """ Compilation of the books into PDF. """
+
+    convert = c.SubConfig(ConvertConfig)
+    """ Conversion of the assets into PDF. """
+
+    snapshot = c.Optional(c.Type(str))
+    """ Save the page HTML and nav of the books to this archive (.json.gz),
+    the books can then be rendered again with the mkdocs-books command. """
+
 
     # @classmethod
     # def propagate(cls, data: Any) -> Any:
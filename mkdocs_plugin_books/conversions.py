@@ -0,0 +1,118 @@
+""" Asset conversions running in the background.
+
+Pages are rendered in worker processes which cannot share futures with
+the parent. Renderers only record the conversions a page needs in its
+state, the parent submits them to a ConversionPool as soon as the page
+is rendered, so assets are converted while the next pages are parsed.
+"""
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+
+from .remote import RemoteImages
+from .transformers import (
+    drawio2pdf_batch,
+    image2pdf,
+    image2raster,
+    mermaid2pdf_batch,
+    svg2pdf,
+)
+
+log = logging.getLogger("mkdocs")
+
+# Converters a page state can refer to by name, remote images are
+# fetched with the RemoteImages of the pool
+CONVERTERS = {
+    "image2pdf": image2pdf,
+    "image2raster": image2raster,
+    "svg2pdf": svg2pdf,
+}
+
+# Converters holding the GIL run in processes
+PROCESS_CONVERTERS = {"image2raster"}
+
+
+class ConversionPool:
+    """Run asset conversions in thread pools and return futures.
+
+    CPU bound converters (cairosvg, PIL, Ghostscript) and converters
+    running containers (mermaid-cli, draw.io) have separate limits.
+    Raster images are resampled in worker processes.
+    Identical conversions share a single future, whether they are in
+    flight or done. Remote images are fetched concurrently, as soon as
+    the pages referring to them are rendered.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 1,
+        container_jobs: int = 1,
+        remote: RemoteImages = None,
+        network_jobs: int = 8,
+    ):
+        self.container_jobs = max(1, container_jobs)
+
+        # Forking a multithreaded process (mkdocs serve) is unsafe
+        context = None
+        if threading.current_thread() is not threading.main_thread():
+            context = multiprocessing.get_context("spawn")
+
+        self.executors = {
+            "process": ProcessPoolExecutor(max(1, jobs), mp_context=context),
+            "cpu": ThreadPoolExecutor(max(1, jobs), thread_name_prefix="convert"),
+            "container": ThreadPoolExecutor(1, thread_name_prefix="container"),
+            "network": ThreadPoolExecutor(
+                max(1, network_jobs), thread_name_prefix="fetch"
+            ),
+        }
+        self.converters = dict(CONVERTERS)
+        if remote:
+            self.converters["fetch_image"] = remote.fetch
+        self.remote = remote
+        self.futures = {}
+        self.lock = Lock()
+
+    def submit(self, converter: str, *args, key=None) -> Future:
+        """Convert with one of the CONVERTERS, unless the same conversion
+        was already submitted. Conversions are identified by `key`, their
+        output, or by their arguments."""
+        key = (converter, key or args)
+        with self.lock:
+            if key not in self.futures:
+                bound = "network" if converter == "fetch_image" else "cpu"
+                if converter in PROCESS_CONVERTERS:
+                    bound = "process"
+                self.futures[key] = self.executors[bound].submit(
+                    self.converters[converter], *args
+                )
+            return self.futures[key]
+
+    def result(self, converter: str, *args, key=None):
+        """Wait for a conversion, exceptions of the converter are raised."""
+        return self.submit(converter, *args, key=key).result()
+
+    def submit_batches(self, mermaid: list, drawio: list) -> Future:
+        """Convert Mermaid diagrams then draw.io figures in at most
+        `container_jobs` concurrent containers. The future returns the
+        jobs which could not be converted."""
+
+        def convert():
+            failed = mermaid2pdf_batch(mermaid, self.container_jobs)
+            return failed + drawio2pdf_batch(drawio, self.container_jobs)
+
+        return self.executors["container"].submit(convert)
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(cancel_futures=True)
+        if self.remote:
+            self.remote.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,145 @@
+""" Content digests keying the converted assets.
+
+Converted assets are named after the digest of their source content,
+the converter and its parameters. An edited source gets a new asset,
+identical sources share one whatever their path.
+
+Hashing large sources on every build is avoided by a side index of
+(path, size, mtime, inode) to digest. A stale stat only costs a rehash,
+mtimes reset by CI caches never serve a wrong digest.
+
+The hash only depends on the size of the content, never on the packages
+installed, so a content gets the same digest and assets the same names
+on every machine.
+"""
+
+import sqlite3
+from hashlib import blake2b, sha256
+from pathlib import Path
+from threading import Lock
+
+# Sources from this size are hashed with BLAKE2b, faster than SHA-256
+FAST_HASH_SIZE = 4 * 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+DROP TABLE IF EXISTS digests;
+CREATE TABLE IF NOT EXISTS file_digests (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime INTEGER,
+    inode INTEGER,
+    algorithm TEXT,
+    digest TEXT
+);
+"""
+
+
+def _hasher(size: int):
+    if size < FAST_HASH_SIZE:
+        return sha256()
+    return blake2b(digest_size=32)
+
+
+def get_digest(content: bytes) -> str:
+    """Digest of a content.
+
+    >>> get_digest(b"mkbook")[:16]
+    'a5c622d7a8320ecd'
+    """
+    hasher = _hasher(len(content))
+    hasher.update(content)
+    return hasher.hexdigest()
+
+
+def _file_digest(path: Path, size: int) -> str:
+    hasher = _hasher(size)
+    with open(path, "rb") as fp:
+        while chunk := fp.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class DigestIndex:
+    """SQLite index of the digests of source files. It is shared by the
+    renderer processes and the conversion threads."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.lock = Lock()
+
+    def get(self, path: Path) -> str:
+        path = Path(path).resolve()
+        stat = path.stat()
+        algorithm = _hasher(stat.st_size).name
+        key = (stat.st_size, stat.st_mtime_ns, stat.st_ino, algorithm)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT size, mtime, inode, algorithm, digest FROM file_digests "
+                "WHERE path = ?",
+                (str(path),),
+            ).fetchone()
+        if row and row[:4] == key:
+            return row[4]
+
+        digest = _file_digest(path, stat.st_size)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO file_digests "
+                "(path, size, mtime, inode, algorithm, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(path), *key, digest),
+            )
+            self.db.commit()
+        return digest
+
+    def close(self):
+        self.db.close()
+
+
+# Index of the current process, see open_digest_index
+_index = None
+
+
+def open_digest_index(path: Path):
+    """Use an index for the digests of the files of this process. The
+    index used until then is closed, unless it is the same."""
+    global _index
+    if _index is not None:
+        if _index.path == Path(path):
+            return
+        _index.close()
+    _index = DigestIndex(path)
+
+
+def close_digest_index():
+    """Close the index of this process, files are hashed again."""
+    global _index
+    if _index is not None:
+        _index.close()
+        _index = None
+
+
+def get_file_digest(path: Path) -> str:
+    """Digest of the content of a file."""
+    if _index is not None:
+        return _index.get(path)
+    return _file_digest(path, Path(path).stat().st_size)
+
+
+def get_asset_filename(
+    converter: str, digest: str, output_path: Path, suffix: str, **params
+) -> Path:
+    """Name of the asset converted from a source of the given digest.
+
+    >>> get_asset_filename("image2pdf", "0" * 64, Path("assets"), ".pdf").suffix
+    '.pdf'
+    """
+    key = "\0".join(
+        [converter, digest, *(f"{k}={v}" for k, v in sorted(params.items()))]
+    )
+    return output_path / (sha256(key.encode()).hexdigest() + suffix)
@@ -0,0 +1,186 @@
+""" Structural index of the elements of a page.
+
+Render passes look up elements by tag and class, ancestors (is a text
+inside code?), depths and the heading of tabbed sets. Each lookup used
+to traverse the soup. The index is built in a single traversal once the
+page is parsed and is kept up to date by the renderer when elements are
+replaced, extracted or unwrapped.
+
+Elements are numbered in document order. The descendants of an element
+are numbered from its own number to the `end` of its subtree, so the
+elements of a subtree are a range of each bucket. Unwrapping an element
+moves its children up without changing their order, the ranges stay
+valid until the page is rendered.
+"""
+
+from bisect import bisect_right
+from heapq import merge
+
+from bs4 import PageElement, Tag
+
+HEADINGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+
+# Ancestor flags
+IN_CODE = 1
+IN_MERMAID = 2
+
+
+class ElementIndex:
+    """Index of the elements of a soup by tag and class.
+
+    >>> from bs4 import BeautifulSoup
+    >>> soup = BeautifulSoup("<p>a <em>b</em></p><p class='x'><em>c</em></p>",
+    ...                      "html.parser")
+    >>> index = ElementIndex(soup)
+    >>> index.find_all(soup.p, ["em"])
+    [<em>b</em>]
+    >>> index.find_all(soup, ["p"], classes=False)
+    [<p>a <em>b</em></p>]
+    >>> index.extract(soup.em)
+    >>> index.find_all(soup, ["em"])
+    [<em>c</em>]
+    """
+
+    def __init__(self, soup: Tag = None):
+        self.nodes = []
+        self.position = {}  # Node id to number, nodes are held by self.nodes
+        self.end = []
+        self.depth = []
+        self.flags = []
+        self.heading = []
+        self.removed = bytearray()
+        self.tags = {}
+        self.classes = {}
+        if soup is not None:
+            self._add(soup, 0, 0, 0)
+
+    def _add(self, node: PageElement, depth: int, flags: int, heading: int):
+        i = len(self.nodes)
+        self.nodes.append(node)
+        self.position[id(node)] = i
+        self.end.append(i)
+        self.depth.append(depth)
+        self.flags.append(flags)
+        self.heading.append(heading)
+        self.removed.append(0)
+        self.tags.setdefault(node.name, []).append(i)
+        if not isinstance(node, Tag):
+            return
+
+        classes = node.get("class", ())
+        for cls in classes:
+            bucket = self.classes.setdefault((node.name, cls), [])
+            if not bucket or bucket[-1] != i:
+                bucket.append(i)
+
+        if node.name == "code":
+            flags |= IN_CODE
+        elif node.name == "pre" and "mermaid" in classes:
+            flags |= IN_MERMAID
+
+        # Nearest heading, the element itself or its previous siblings
+        # then those of its ancestors, see get_heading_level
+        for child in node.children:
+            if child.name in HEADINGS:
+                heading = int(child.name[1:])
+            self._add(child, depth + 1, flags, heading)
+        self.end[i] = len(self.nodes) - 1
+
+    def find_all(
+        self, root: Tag, names: list, classes=None, attribute: str = None
+    ) -> list:
+        """Elements below root in document order, as root.find_all would
+        return them. Names of None are text nodes, `classes` are any of
+        the classes or False for elements without class."""
+        start = self.position.get(id(root))
+        if start is None or self.removed[start]:
+            return self._find_all(root, names, classes, attribute)
+
+        if classes:
+            buckets = [self.classes.get((n, c), ()) for n in names for c in classes]
+        else:
+            buckets = [self.tags.get(n, ()) for n in names]
+
+        stop = self.end[start]
+        ranges = []
+        for bucket in buckets:
+            lo = bisect_right(bucket, start)
+            hi = bisect_right(bucket, stop, lo)
+            if lo < hi:
+                ranges.append(bucket[lo:hi])
+        positions = ranges[0] if len(ranges) == 1 else merge(*ranges)
+
+        elements = []
+        last = None
+        for i in positions:
+            if i == last or self.removed[i]:
+                continue
+            last = i
+            node = self.nodes[i]
+            if classes is False and "class" in node.attrs:
+                continue
+            if attribute and not node.has_attr(attribute):
+                continue
+            elements.append(node)
+        return elements
+
+    def _find_all(self, root, names, classes, attribute):
+        # Elements created while rendering are not indexed
+        if names == [None]:
+            return root.find_all(string=True)
+        attrs = {attribute: True} if attribute else {}
+        return root.find_all(names, class_=classes, attrs=attrs)
+
+    def find_all_dfs(self, root: Tag, names: list) -> list:
+        """Elements below root, the deepest first."""
+        elements = self.find_all(root, names)
+        return sorted(elements, key=self.get_depth, reverse=True)
+
+    def get_depth(self, node: PageElement) -> int:
+        i = self.position.get(id(node))
+        if i is None:
+            depth = 0
+            while node.parent is not None:
+                node = node.parent
+                depth += 1
+            return depth
+        return self.depth[i]
+
+    def in_code(self, node: PageElement) -> bool:
+        i = self.position.get(id(node))
+        if i is None:
+            return node.find_parent("code") is not None
+        return bool(self.flags[i] & IN_CODE)
+
+    def in_mermaid(self, node: PageElement) -> bool:
+        i = self.position.get(id(node))
+        if i is None:
+            return node.find_parent("pre", class_="mermaid") is not None
+        return bool(self.flags[i] & IN_MERMAID)
+
+    def get_heading_level(self, node: PageElement):
+        """Level of the section of a node, None before the first heading."""
+        i = self.position.get(id(node))
+        if i is None:
+            return None
+        return self.heading[i] or None
+
+    def remove(self, node: PageElement):
+        """Forget a node and its descendants, once replaced or extracted."""
+        i = self.position.get(id(node))
+        if i is not None:
+            end = self.end[i]
+            self.removed[i : end + 1] = b"\x01" * (end + 1 - i)
+
+    def extract(self, node: PageElement):
+        self.remove(node)
+        node.extract()
+
+    def unwrap(self, node: Tag):
+        """Unwrap a tag, its descendants move up one level."""
+        i = self.position.get(id(node))
+        if i is not None:
+            self.removed[i] = 1
+            for j in range(i + 1, self.end[i] + 1):
+                self.depth[j] -= 1
+        node.unwrap()
@@ -1,48 +1,125 @@
 import glob
 import urllib.parse
+from functools import lru_cache
+from hashlib import sha256
 from pathlib import Path
+from threading import Lock
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
-from .helpers import optimize_list, escape_latex_chars
+from .helpers import optimize_list
+from .text import escape_latex_chars
+from .tracing import tracer
 
 TEMPLATE_DIR = Path(__file__).parent / 'templates'
 
+# Trivial templates rendered without Jinja, used only while their source
+# is the one given here. Identical renders are memoized.
+FAST_TEMPLATES = {
+    'strong': (r'\textbf{\VAR{text}}', lambda text='': f'\\textbf{{{text}}}'),
+    'italic': (r'\emph{\VAR{text}}', lambda text='': f'\\emph{{{text}}}'),
+    'codeinlinett': (r'\texttt{\VAR{text}}', lambda text='': f'\\texttt{{{text}}}'),
+    'ref': (
+        r'\VAR{text} (\emph{c.f.} \ref{\VAR{ref}})',
+        lambda text='', ref='': f'{text} (\\emph{{c.f.}} \\ref{{{ref}}})',
+    ),
+    'acronym': (r'\gls{\VAR{text}}', lambda text='': f'\\gls{{{text}}}'),
+}
+
+# Templates compiled in this process with the digest of their source,
+# by template directory
+_templates = {}
+_templates_lock = Lock()
+
+
+def get_templates_digest(template_dir=TEMPLATE_DIR):
+    """Hash of the template set, changes whenever a template is edited."""
+    digest = sha256()
+    for filename in sorted(Path(template_dir).glob('**/*')):
+        if filename.is_file():
+            digest.update(str(filename.relative_to(template_dir)).encode())
+            digest.update(filename.read_bytes())
+    return digest.hexdigest()
+
+
+def load_templates(template_dir=TEMPLATE_DIR, cache_dir=None):
+    """Compile the templates of a directory, once per process. They are
+    compiled again once edited, for instance while serving.
+
+    Compiled templates are saved as bytecode in `cache_dir`, by default
+    the cache directory of Jinja shared by all the processes of the user.
+    Jinja checks the hash of their source before loading them. Returns
+    the environment, the templates by name and the fast paths usable
+    with these templates.
+    """
+    key = str(template_dir)
+    digest = get_templates_digest(template_dir)
+    with _templates_lock:
+        if key in _templates and _templates[key][0] == digest:
+            return _templates[key][1:]
+
+        if cache_dir is not None:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            cache_dir = str(cache_dir)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
 
-class LaTeXFormatter:
-    def __init__(self, template_dir=TEMPLATE_DIR):
         # Easier to use LaTeX syntax for templates
-        self.env = Environment(
+        env = Environment(
             block_start_string=r'\BLOCK{',
             block_end_string=r'}',
             variable_start_string=r'\VAR{',
             variable_end_string=r'}',
             comment_start_string=r'\COMMENT{',
             comment_end_string=r'}',
-            loader=FileSystemLoader(template_dir))
+            loader=FileSystemLoader(template_dir),
+            bytecode_cache=bytecode_cache)
 
         # Load all templates
-        templates = []
+        filenames = []
         for ext in ('.tex', '.cls'):
-            templates += glob.glob(f'{template_dir}/**/*{ext}', recursive=True)
-        templates = [Path(template).relative_to(template_dir) for template in templates]
+            filenames += glob.glob(f'{template_dir}/**/*{ext}', recursive=True)
+        filenames = [Path(filename).relative_to(template_dir) for filename in filenames]
 
-        self.templates = {
-            str(filename.with_suffix('')).replace('/', '_'): self.env.get_template(str(filename))
-            for filename in templates
+        templates = {
+            str(filename.with_suffix('')).replace('/', '_'): env.get_template(str(filename))
+            for filename in filenames
         }
 
+        fast = {}
+        for name, (source, render) in FAST_TEMPLATES.items():
+            if name not in templates:
+                continue
+            filename = templates[name].filename
+            if Path(filename).read_text().removesuffix('\n') == source:
+                fast[name] = lru_cache(maxsize=4096)(render)
+
+        _templates[key] = digest, env, templates, fast
+        return env, templates, fast
+
+
+class LaTeXFormatter:
+    """Render the LaTeX templates, called by their name.
+
+    >>> formatter = LaTeXFormatter()
+    >>> print(formatter.ref('Intro', ref='intro'))
+    Intro (\\emph{c.f.} \\ref{intro})
+    >>> all(formatter.fast_templates[name]('a_b') == formatter[name](text='a_b')
+    ...     for name in FAST_TEMPLATES)
+    True
+    """
+
+    def __init__(self, template_dir=TEMPLATE_DIR, cache_dir=None):
+        self.env, self.templates, self.fast_templates = load_templates(
+            template_dir, cache_dir)
+
     def __getattr__(self, method):
         """Proxy method calls to the corresponding template
-        that are note specifically defined in the class. """
-        template = self.templates.get(method)
-        mangled = f'handle_{method}'
-        if mangled in self.__dict__:
-            template = self.__dict__[mangled]
-        if method in self.templates:
-            template = self.templates[method]
-        else:
+        that are note specifically defined in the class.
+        The render function is kept as an attribute of the formatter,
+        it is only created on the first call. """
+        if method not in self.templates:
             raise AttributeError(f"Object has no template for '{method}'")
+        template = self.templates[method]
 
         def render_template(*args, **kwargs):
             """Render the template with the given arguments.
@@ -53,11 +130,20 @@ class LaTeXFormatter:
                                  f"{len(args)}, use keyword arguments instead")
             if args:
                 kwargs['text'] = args[0]
-            return template.render(**kwargs)
-        return render_template
+            with tracer.span(method, 'template'):
+                return template.render(**kwargs)
+
+        render = self.fast_templates.get(method, render_template)
+        self.__dict__[method] = render
+        return render
 
     def __getitem__(self, key):
-        return self.templates[key].render
+        template = self.templates[key]
+
+        def render_template(*args, **kwargs):
+            with tracer.span(key, 'template'):
+                return template.render(*args, **kwargs)
+        return render_template
 
     def handle_codeblock(self, code, language='text',
                          filename=None, lineno=False, highlight=None):
@@ -1,8 +1,21 @@
 
+import os
 import re
-from typing import List
+import tempfile
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import List, Union
 from unidecode import unidecode
 
+
+def get_version():
+    """Installed version of the plugin."""
+    try:
+        return version("mkdocs-books")
+    except PackageNotFoundError:
+        return "unknown"
+
+
 def optimize_list(numbers: List[int]):
     """Optimize a list of numbers to a list of ranges.
 
@@ -47,23 +60,34 @@ def to_kebab_case(name):
     return name.lower()
 
 
-def escape_latex_chars(text):
-    """Escape LaTeX special characters.
-
-    >>> escape_latex_chars("Hello & {World}")
-    'Hello \\& \\{World\\}'
+def write_if_changed(path: Path, content: Union[str, bytes]) -> bool:
+    """Write a file only if its content changed, so its modification
+    time is preserved for tools such as latexmk or make. The file is
+    written to a temporary file then renamed, readers never see a
+    partially written file. Return True if the file was written.
     """
+    path = Path(path)
+    if isinstance(content, str):
+        content = content.encode()
+
+    try:
+        if path.stat().st_size == len(content) and path.read_bytes() == content:
+            return False
+    except FileNotFoundError:
+        pass
+
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(content)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return True
+
 
-    mapping = [
-        ("&", r"\&"),
-        ("%", r"\%"),
-        ("#", r"\#"),
-        ("$", r"\$"),
-        ("_", r"\_"),
-        ("^", r"\^"),
-        ("{", r"\{"),
-        ("}", r"\}"),
-        ("~", r"\textasciitilde{}"),
-        ("\\", r"\textbackslash{}"),
-    ]
-    return "".join([c if c not in dict(mapping) else dict(mapping)[c] for c in text])
+def copy_if_changed(source: Path, destination: Path) -> bool:
+    """Copy a file unless the destination already has the same content."""
+    return write_if_changed(destination, Path(source).read_bytes())
@@ -0,0 +1,41 @@
+""" Highlighting of code with Pygments while rendering.
+
+With minted, each code block spawns a Pygments process while compiling.
+Here code is tokenized once in-process into colored verbatim typeset by
+fvextra. Lexers and formatters are reused across blocks and highlighted
+code is cached by language, style and code.
+"""
+
+from functools import lru_cache
+
+from pygments import highlight as pygmentize
+from pygments.formatters import LatexFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+
+@lru_cache(maxsize=None)
+def get_lexer(language: str):
+    try:
+        return get_lexer_by_name(language)
+    except ClassNotFound:
+        return get_lexer_by_name("text")
+
+
+@lru_cache(maxsize=None)
+def get_formatter(style: str):
+    return LatexFormatter(style=style, nowrap=True)
+
+
+@lru_cache(maxsize=4096)
+def highlight_code(code: str, language: str = "text", style: str = "default") -> str:
+    r"""Highlight code as \PY commands for a Verbatim environment.
+
+    >>> highlight_code("x = 1\n", "python")
+    '\\PY{n}{x} \\PY{o}{=} \\PY{l+m+mi}{1}\n'
+    """
+    return pygmentize(code, get_lexer(language or "text"), get_formatter(style))
+
+
+def get_style_defs(style: str = "default") -> str:
+    """LaTeX definitions of the \\PY commands for a style."""
+    return get_formatter(style).get_style_defs()
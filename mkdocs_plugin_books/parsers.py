@@ -0,0 +1,48 @@
+""" HTML parsers of the pages.
+
+Pages are parsed into a BeautifulSoup tree whatever the parser: the
+tree builders of BeautifulSoup adapt each parser to the same tree API
+(find_all, replace_with, unwrap, extract, get_text...), the renderer
+does not depend on the parser. lxml parses several times faster than
+the builtin html.parser, it is used when installed.
+
+lxml parses documents, pages are fragments: the html, head and body
+elements it adds are unwrapped so both parsers give the same tree.
+"""
+
+import logging
+from importlib.util import find_spec
+
+from bs4 import BeautifulSoup
+
+log = logging.getLogger("mkdocs")
+
+PARSERS = ("lxml", "html.parser")
+
+
+def get_parser(name: str = "auto") -> str:
+    """Parser to use for a `parser` option, the fastest installed for auto.
+
+    >>> get_parser("html.parser")
+    'html.parser'
+    """
+    if name == "auto":
+        return next(p for p in PARSERS if p == "html.parser" or find_spec(p))
+    if name != "html.parser" and not find_spec(name):
+        log.warning("Parser %s is not installed, falling back to html.parser", name)
+        return "html.parser"
+    return name
+
+
+def parse_html(html: str, parser: str = "html.parser") -> BeautifulSoup:
+    """Parse the HTML of a page.
+
+    >>> parse_html("<p>Hello <em>world</em></p>")
+    <p>Hello <em>world</em></p>
+    """
+    soup = BeautifulSoup(html, parser)
+    if parser == "lxml" and (document := soup.find("html", recursive=False)):
+        for el in document.find_all(["head", "body"], recursive=False):
+            el.unwrap()
+        document.unwrap()
+    return soup
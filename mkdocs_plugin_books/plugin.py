@@ -1,8 +1,11 @@
-import shutil
-import yaml
+import json
+import multiprocessing
+import os
+import threading
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from pathlib import Path, PosixPath
+from pathlib import Path
 from typing import List
 
 from mkdocs.structure import StructureItem
@@ -11,20 +14,47 @@ from mkdocs.utils import log
 from mkdocs.plugins import BasePlugin
 from mkdocs.config.defaults import MkDocsConfig
 from mkdocs.structure.nav import Navigation
-from mkdocs.structure.files import Files
+from mkdocs.structure.files import File, Files
+from .assets import AssetIndex
+from .cache import PageCache
+from .compiler import COUNTERS, PARTS_FILE, compile_books, dump_format, get_format_name
 from .config import BooksConfig, BookConfig
-from .renderer import LaTeXRenderer
+from .conversions import ConversionPool
+from .digests import close_digest_index, get_file_digest, open_digest_index
+from .formatters import get_templates_digest
+from .helpers import copy_if_changed, get_version, to_kebab_case, write_if_changed
+from .highlighting import get_style_defs
+from .parsers import get_parser
+from .remote import RemoteImages
+from .renderer import LINKS_FILE, LaTeXRenderer, load_wikimap
+from .serve import BackgroundBuilder
+from .snapshot import config_to_dict, dump_nav, write_snapshot
+from .tracing import tracer
 
-from IPython import embed
 
+# Renderer of the current worker process, see _init_worker
+_renderer = None
 
-def path_representer(dumper, data, current=Path(".")):
-    # Path relative to the project directory
-    data = data.resolve().relative_to(current.resolve())
-    return dumper.represent_scalar("tag:yaml.org,2002:str", str(data))
 
+def _init_worker(output_path: Path, config: BookConfig, wikimap: dict):
+    global _renderer
+    _renderer = LaTeXRenderer(output_path, config, wikimap=wikimap)
+    open_digest_index(output_path / ".cache" / "digests.db")
+    tracer.enabled = config.debug.trace
 
-yaml.add_representer(PosixPath, path_representer)
+
+def _render_page(page: dict):
+    """Render a single page with the renderer of the current process.
+
+    The renderer starts from a blank state so the page metadata
+    (acronyms, glossary, solutions, assets...) can be returned along
+    with the LaTeX and merged by the parent in nav order. Trace events
+    recorded in the worker are sent back as well.
+    """
+    _renderer.reset_state()
+    with tracer.span(str(page["file_path"]), "page"):
+        latex = _renderer.render(**page)
+    return (latex, _renderer.get_state()), tracer.pop_events()
 
 
 class Books(BasePlugin[BooksConfig]):
@@ -38,6 +68,12 @@ class Books(BasePlugin[BooksConfig]):
         self.project_dir = None
         self.build_dir = None
         self.saved_nav = None
+        self.mkdocs_config = None
+        self.files = None
+        self.render_memo = {}
+        self.previous_memo = {}
+        self.builder = None
+        self.format = None
 
     def on_startup(self, command: str, dirty: bool):
         # Save the command to check if latex has to be generated
@@ -51,8 +87,9 @@ class Books(BasePlugin[BooksConfig]):
         if not Path(self.config.output_dir).is_absolute():
             self.config.output_dir = self.project_dir / self.config.output_dir
 
-        # Disable plugin if serve command is used
-        self.config.enabled &= not self.is_serve
+        # Disable plugin if serve command is used, unless LaTeX is
+        # generated in the background
+        self.config.enabled &= not self.is_serve or self.config.serve.enabled
 
         # Need to postpone the nav processing until pages are processed
         # nav isn't ready yet and not available later in process
@@ -62,12 +99,29 @@ class Books(BasePlugin[BooksConfig]):
         if not self.config.enabled:
             return
 
+        self.mkdocs_config = config
+        self.files = files
+
+        # Unmodified pages are not read on dirty builds, their title
+        # would fall back to the filename and break the nav lookup
+        if self.dirty:
+            for page in self.saved_nav.pages:
+                if page.markdown is None:
+                    page.read_source(config)
+
         # Add default book if none is provided
         if not self.config.books:
-            self.config.books.append(BookConfig())
-            book = self.config.books[0]
-            book.root = self.saved_nav.pages[0].title
-            book.title = config.site_name
+            # Validated as the configured books, to fill in its subconfigs
+            book = BookConfig()
+            book.load_dict({
+                "root": self.saved_nav.pages[0].title,
+                "title": config.site_name,
+                "folder": to_kebab_case(config.site_name),
+            })
+            errors, _ = book.validate()
+            for key, error in errors:
+                raise ValueError(f"Invalid option '{key}' of the default book: {error}")
+            self.config.books.append(book)
             book.author = config.site_author
             book.year = datetime.now().year
             book.subtitle = config.site_description
@@ -104,9 +158,88 @@ class Books(BasePlugin[BooksConfig]):
             book = Book(section, book_config, self)
             books.append(book)
 
-        # Build each book
+        if self.config.snapshot:
+            self._save_snapshot(books)
+
+        if not self.is_serve:
+            self._build_books(books)
+            return
+
+        # Live reload is not slowed down by the generation of the books
+        if self.builder is None:
+            self.builder = BackgroundBuilder(self.config.serve.debounce)
+        self.builder.debounce = self.config.serve.debounce
+        # The next rebuild reassigns the plugin attributes while this one
+        # runs, the build only uses those captured here and in its books
+        options = self.config
+        self.builder.submit(lambda: self._build_books(books, options))
+
+    def on_shutdown(self):
+        if self.builder is not None:
+            self.builder.stop()
+            self.builder = None
+        close_digest_index()
+
+    def _build_books(self, books: List["Book"], config: BooksConfig = None):
+        # Pages rendered during this build are shared across books. When
+        # serving, pages of the previous build whose HTML did not change
+        # are reused so only the modified pages are rendered again.
+        config = config or self.config
+        self.previous_memo = self.render_memo if self.is_serve else {}
+        self.render_memo = {}
+
+        # Generated books start from the precompiled class preamble. It
+        # is dumped first, whether the books are compiled or not, as
+        # manual runs of the engine load the format named by main.tex
+        self.format = None
+        if config.compile.format and books:
+            name = get_format_name(config.compile.engine)
+            directories = [book.config.directory for book in books]
+            if name and dump_format(directories, config.compile.engine, name):
+                self.format = name
+
+        # Loaded once, the workers rendering the pages are given them
+        wikimap = load_wikimap()
         for book in books:
-            book.build()
+            book.build(wikimap)
+
+        if config.compile.enabled:
+            compile_books(
+                [book.config.directory for book in books],
+                engine=config.compile.engine,
+                jobs=config.compile.jobs,
+                max_runs=config.compile.max_runs,
+                split=config.compile.split,
+                fmt=self.format,
+            )
+
+    def _save_snapshot(self, books: List["Book"]):
+        path = self.project_dir / self.config.snapshot
+        log.info("Saving snapshot of the books to %s", path)
+        pages = {}
+        snapshot = []
+        for book in books:
+            for file in book.files:
+                if file.page.content is None:
+                    book._render_markdown(file)
+            snapshot.append(
+                {"config": config_to_dict(book.config), "nav": dump_nav(book.section, pages)}
+            )
+        write_snapshot(path, self.project_dir, snapshot, pages)
+
+    def get_jobs(self, config: BooksConfig = None):
+        """Number of processes rendering pages."""
+        config = config or self.config
+        if self.is_serve:
+            return config.serve.jobs
+        return config.jobs or os.cpu_count() or 1
+
+    def get_conversion_jobs(self, config: BooksConfig = None):
+        """Number of concurrent conversions of assets, and of
+        converter containers."""
+        config = config or self.config
+        jobs = self.get_jobs(config)
+        return config.convert.jobs or jobs, config.convert.container_jobs or jobs
 
     def _find_item(self, item: StructureItem, cb: callable):
         if cb(item):
@@ -140,6 +273,12 @@ class Book:
         self.section = section
         self.config = config
 
+        # State of the build creating the book, the plugin moves on to
+        # the next build while books are generated in the background
+        self.options = plugin.config
+        self.mkdocs_config = plugin.mkdocs_config
+        self.site_files = plugin.files
+
         self.files = self._fetch_files(self.section)
 
         self._propagate_meta(self.section, config.base_level)
@@ -148,6 +287,10 @@ class Book:
         self.mainmatter = []
         self._sort_by_part(self.section)
 
+        # Output files written and rewritten during the build
+        self.written = 0
+        self.rewritten = 0
+
     def _fetch_files(self, item: StructureItem):
         files = []
         if item.is_page:
@@ -205,72 +348,305 @@ class Book:
 
         return "\n".join(latex)
 
-    def build(self):
-        self.config.directory.mkdir(exist_ok=True)
-        renderer = LaTeXRenderer(self.config.directory, self.config)
+    def build(self, wikimap: dict = None):
+        self.wikimap = load_wikimap() if wikimap is None else wikimap
+        tracer.enabled = self.config.debug.trace
+        tracer.pop_events()
 
-        # Build all files
-        for file in self.files:
-            self._build_file(file, renderer)
+        with tracer.span(self.config.title, "book"):
+            self._build()
 
-        # Remove unused objets (list build/assets directors and remove those that are not in assets_map keys)
-        assets_map = renderer.get_assets_map()
-        if self.config.debug.clean_assets:
-            for file in (self.config.directory / "assets/").iterdir():
-                if file not in assets_map and file.is_file():
-                    log.info("Removing unused asset %s", file)
-                    file.unlink()
+        if tracer.enabled:
+            tracer.export(self.config.directory / "trace.json")
+            log.info("LaTeX '%s' trace:\n%s", self.config.title, tracer.summary())
+            tracer.enabled = False
 
-        (self.config.directory / "assets_map.yml").write_text(
-            yaml.dump(assets_map, default_flow_style=False, allow_unicode=True)
+    def _build(self):
+        self.config.directory.mkdir(exist_ok=True)
+        convert = self.options.convert
+        remote = RemoteImages(
+            self.config.directory / ".cache" / "urls.json",
+            offline=convert.offline,
+            max_size=convert.max_download_size,
+            connections=convert.network_jobs,
+        )
+        pool = ConversionPool(
+            *self.plugin.get_conversion_jobs(self.options), remote, convert.network_jobs
         )
+        open_digest_index(self.config.directory / ".cache" / "digests.db")
+        renderer = LaTeXRenderer(self.config.directory, self.config, pool, self.wikimap)
+
+        assets = AssetIndex(self.config.directory / "assets.db", renderer.output_path)
+
+        # Build all files, metadata is merged in nav order
+        pages = [self._prepare_file(file) for file in self.files]
+        with pool:
+            # Assets are converted while the next pages are rendered
+            results = self._render_pages(pages, renderer.submit_conversions)
+
+            # Diagrams of all pages are converted in a few converter sessions
+            renderer.convert_pending([state for _, state in results])
+
+            for file, (latex, state) in zip(self.files, results):
+                latex = renderer.merge_state(state, latex)
+                self._write(self.config.directory / file.page.tex_path, latex)
+                assets.update_page(file.src_path, state["assets_map"])
+
+        # Remove the assets no page of the book refers to anymore
+        assets.retain_pages(file.src_path for file in self.files)
+        if self.config.debug.clean_assets:
+            assets.collect_garbage()
+        assets.close()
 
         # Build index page
-        self._get_latex(self.frontmatter, renderer)
+        metadata = {
+            "title": self.config.title,
+            "author": self.config.author,
+            "subtitle": self.config.subtitle,
+            "email": self.config.email,
+            "year": self.config.year,
+            "frontmatter": self._get_latex(self.frontmatter, renderer),
+            "format": self.plugin.format,
+            "pygments": self.config.highlight == "pygments",
+        }
         index = renderer.formatter.template(
-            title=self.config.title,
-            author=self.config.author,
-            subtitle=self.config.subtitle,
-            email=self.config.email,
-            year=self.config.year,
-            frontmatter=self._get_latex(self.frontmatter, renderer),
-            mainmatter=self._get_latex(self.mainmatter, renderer),
+            **metadata, mainmatter=self._get_latex(self.mainmatter, renderer)
         )
-        (self.config.directory / "main.tex").write_text(index)
+        self._write(self.config.directory / "main.tex", index)
+
+        if self.options.compile.split:
+            self._write_parts(renderer, metadata)
 
-        (self.config.directory / "acronyms.tex").write_text(renderer.get_list_acronyms())
-        (self.config.directory / "glossary.tex").write_text(renderer.get_list_glossary())
-        (self.config.directory / "solutions.tex").write_text(renderer.get_list_solutions())
-        (self.config.directory / "cover.tex").write_text(self.render_cover(renderer))
+        self._write(self.config.directory / "acronyms.tex", renderer.get_list_acronyms())
+        self._write(self.config.directory / "glossary.tex", renderer.get_list_glossary())
+        self._write(self.config.directory / "solutions.tex", renderer.get_list_solutions())
+        self._write(self.config.directory / "cover.tex", self.render_cover(renderer))
+        if self.config.highlight == "pygments":
+            self._write(
+                self.config.directory / "pygments.tex",
+                get_style_defs(self.config.highlight_style),
+            )
 
         # Copy class file
-        shutil.copy2(
+        self._copy(
             Path(__file__).parent / "templates/mkbook.cls",
             self.config.directory / "mkbook.cls",
         )
 
         self._copy_assets()
 
-    def _build_file(self, file: Path, renderer: LaTeXRenderer):
+        log.info(
+            "LaTeX '%s': %d of %d files rewritten",
+            self.config.title,
+            self.rewritten,
+            self.written,
+        )
+
+    def _split_chapters(self, items: List[StructureItem]):
+        """Group the main matter by top-level chapter, a part
+        heading is kept with the chapter following it."""
+        chapters = [[]]
+        for item in items:
+            if item.level <= 0 and any(i.is_page for i in chapters[-1]):
+                chapters.append([])
+            chapters[-1].append(item)
+        return chapters
+
+    def _write_parts(self, renderer: LaTeXRenderer, metadata: dict):
+        """Write a standalone wrapper per top-level chapter, plus
+        the front and back matters, for a split compilation."""
+        parts = [("front", "front", [])]
+        for i, chapter in enumerate(self._split_chapters(self.mainmatter), 1):
+            parts.append((f"{i:02}", "main", chapter))
+        parts.append(("back", "back", []))
+
+        jobs = []
+        for name, part, items in parts:
+            job = f"main-{name}"
+            wrapper = renderer.formatter.split(
+                **metadata,
+                mainmatter=self._get_latex(items, renderer),
+                part=part,
+                seed=f"{job}-seed",
+                counters=COUNTERS,
+            )
+            self._write(self.config.directory / f"{job}.tex", wrapper)
+
+            # Seeds are refined by the compiler, see compiler.SplitCompiler
+            seed = self.config.directory / f"{job}-seed.tex"
+            if not seed.exists():
+                self._write(seed, "\\def\\mkbookcounters{}\n")
+            jobs.append(job)
+
+        self._write(self.config.directory / PARTS_FILE, json.dumps(jobs, indent=1))
+
+    def _write(self, path: Path, content: str):
+        """Write an output file, left untouched if its content is
+        the same so latexmk does not consider it dirty."""
+        self.written += 1
+        self.rewritten += write_if_changed(path, content)
+
+    def _copy(self, source: Path, destination: Path):
+        self.written += 1
+        self.rewritten += copy_if_changed(source, destination)
+
+    def _prepare_file(self, file: Path):
+        """Collect the arguments needed to render a page, they
+        must be picklable to be sent to a worker process."""
         log.info("Processing LaTeX '%s' ...", file.src_path)
         path = self.config.directory / file.page.tex_path
         path.parent.mkdir(parents=True, exist_ok=True)
 
         html = file.page.content
 
-        if self.config.debug.save_html:
-            path.with_suffix(".html").write_text(html)
-
-        latex = renderer.render(
-            html,
-            self.config.directory,
-            Path(file.abs_src_path),
-            base_level=file.page.level,
-            numbered=file.page.numbered,
-            drop_title=file.page.drop_title,
+        if self.config.debug.save_html and html is not None:
+            write_if_changed(path.with_suffix(".html"), html)
+
+        return {
+            "html": html,
+            "output_path": self.config.directory,
+            "file_path": Path(file.abs_src_path),
+            "base_level": file.page.level,
+            "numbered": file.page.numbered,
+            "drop_title": file.page.drop_title,
+        }
+
+    def _render_pages(self, pages: List[dict], submit=None):
+        """Render pages, unchanged pages are replayed from the cache
+        on dirty builds. Results are in the same order as the pages.
+        The state of each page is given to `submit` once rendered."""
+        mermaid_config = self.config.mermaid_config
+        if mermaid_config:
+            mermaid_config = self.plugin.project_dir / mermaid_config
+        cache = PageCache(
+            self.config.directory / ".cache" / "pages",
+            # Options changing the rendering of pages are part of the key
+            salt="\0".join([
+                get_version(),
+                get_templates_digest(),
+                self.config.highlight,
+                self.config.highlight_style,
+                str(self.config.image_dpi),
+                self.config.render_engine,
+                get_parser(self.config.parser),
+                # Files read by the renderer
+                self._get_input_digest(LINKS_FILE),
+                str(mermaid_config),
+                self._get_input_digest(mermaid_config),
+            ]),
+            replay=self.plugin.dirty,
+        )
+        assets_path = self.config.directory / "assets"
+
+        # Pages already rendered for another book, or by the previous
+        # build when serving, are reused as is
+        memo = {**self.plugin.previous_memo, **self.plugin.render_memo}
+        keys = [cache.key(page) for page in pages]
+        results = [
+            self._import_result(*memo[key]) if key in memo else None for key in keys
+        ]
+        shared = [i for i, result in enumerate(results) if result is not None]
+        imported = [i for i in shared if memo[keys[i]][1] != assets_path]
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                results[i] = cache.get(key, assets_path)
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        # Unmodified pages of a dirty build are not rendered by MkDocs
+        for i in missing:
+            if pages[i]["html"] is None:
+                pages[i]["html"] = self._render_markdown(self.files[i])
+                keys[i] = cache.key(pages[i])
+
+        rendered = self._render_pool([pages[i] for i in missing])
+        for i, result in zip(missing, rendered):
+            results[i] = result
+            if submit:
+                submit(result[1])
+
+        for i in missing + imported:
+            cache.set(keys[i], results[i])
+
+        for key, result in zip(keys, results):
+            self.plugin.render_memo.setdefault(key, (result, assets_path))
+
+        cache.save()
+        cache.report(self.config.title)
+        if shared:
+            log.info("Reused %d pages already rendered", len(shared))
+        return results
+
+    def _get_input_digest(self, path: Path) -> str:
+        """Digest of a file read while rendering, empty if not
+        configured or missing."""
+        if not path:
+            return ""
+        try:
+            return get_file_digest(path)
+        except OSError:
+            return ""
+
+    def _import_result(self, result: tuple, assets_path: Path):
+        """Reuse a page rendered for another book, its assets are
+        copied into the assets directory of this book. None if one of
+        its assets is missing (failed conversion, collected since the
+        previous build...), the page is then rendered again."""
+        latex, state = result
+        target = self.config.directory / "assets"
+
+        assets_map = {}
+        for asset, meta in state["assets_map"].items():
+            asset = Path(asset)
+            if not (target / asset.name).exists():
+                try:
+                    copy_if_changed(assets_path / asset.name, target / asset.name)
+                except OSError:
+                    return None
+            assets_map[target / asset.name if asset.is_absolute() else asset] = meta
+        return latex, {**state, "assets_map": assets_map}
+
+    def _render_markdown(self, file: File):
+        """HTML of a page MkDocs did not render (dirty builds). The page
+        goes through the page events of the plugins as in a full build,
+        so its LaTeX and the entry cached for it are the same."""
+        config = self.mkdocs_config
+        files = self.site_files
+        page = config.plugins.on_pre_page(file.page, config=config, files=files)
+        page.read_source(config)
+        page.markdown = config.plugins.on_page_markdown(
+            page.markdown, page=page, config=config, files=files
         )
+        page.render(config, files)
+        page.content = config.plugins.on_page_content(
+            page.content, page=page, config=config, files=files
+        )
+        return page.content
+
+    def _render_pool(self, pages: List[dict]):
+        """Render pages in worker processes, results are yielded
+        in the same order as the pages."""
+        jobs = min(self.plugin.get_jobs(self.options), len(pages))
+        initargs = (self.config.directory, self.config, self.wikimap)
+
+        if jobs <= 1:
+            _init_worker(*initargs)
+            for result, events in map(_render_page, pages):
+                tracer.events.extend(events)
+                yield result
+            return
+
+        # Forking a multithreaded process (mkdocs serve) is unsafe
+        context = None
+        if threading.current_thread() is not threading.main_thread():
+            context = multiprocessing.get_context("spawn")
 
-        path.write_text(latex)
+        log.info("Rendering %d pages with %d processes", len(pages), jobs)
+        with ProcessPoolExecutor(
+            jobs, mp_context=context, initializer=_init_worker, initargs=initargs
+        ) as pool:
+            for result, events in pool.map(_render_page, pages):
+                tracer.events.extend(events)
+                yield result
 
     def _copy_assets(self):
         """Optional assets can be copied to the LaTeX build directory
@@ -282,7 +658,7 @@ class Book:
                 log.warning("Pattern %s does not exist", src_pattern)
                 continue
             for src in src_pattern.parent.glob(src_pattern.name):
-                dest = dest_dir
+                dest = dest_dir / src.name if dest_dir.is_dir() else dest_dir
                 log.info("Copying %s to %s", src, dest)
                 dest.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(src, dest)
+                self._copy(src, dest)
@@ -0,0 +1,173 @@
+""" Remote images (figures, CDN twemoji) fetched into the assets. """
+
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+
+from .digests import get_asset_filename
+from .tracing import tracer
+from .transformers import get_pillow_extensions, open_image, svg2pdf
+
+log = logging.getLogger("mkdocs")
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RemoteImages:
+    """Fetch remote images and convert them to PDF.
+
+    Connections are reused across images with a pooled session. A
+    persistent index maps each URL to its asset along with the validators
+    of the response (ETag, Last-Modified) so known images are only
+    revalidated. In offline mode images are served from the index and the
+    network is never used. requests is only imported to fetch an image.
+    """
+
+    def __init__(
+        self,
+        index_path: Path,
+        offline: bool = False,
+        max_size: int = 0,
+        connections: int = 10,
+    ):
+        self.index_path = Path(index_path)
+        self.offline = offline
+        self.max_size = max_size
+        self.connections = connections
+        self.session = None
+        self.lock = Lock()
+        try:
+            self.index = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            self.index = {}
+
+    def get_session(self):
+        """Session shared by the fetches, created by the first one."""
+        with self.lock:
+            if self.session is None:
+                import requests
+
+                self.session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.connections, pool_maxsize=self.connections
+                )
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            return self.session
+
+    def save(self):
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            self.index_path.write_text(json.dumps(self.index, indent=1))
+
+    def close(self):
+        self.save()
+        if self.session is not None:
+            self.session.close()
+
+    @tracer.traced("asset")
+    def fetch(self, url: str, output_path: Path) -> Path:
+        """Fetch an image from an URL and store it in the output path
+        as PDF. An image already fetched is only downloaded again if
+        the server reports it changed. In offline mode None is returned
+        for an image never fetched. Images are named after the digest
+        of their content, servers without validators always send them
+        again but an unchanged image is not converted again."""
+        entry = self.index.get(url)
+        known = None
+        if entry and (output_path / entry["filename"]).exists():
+            known = output_path / entry["filename"]
+
+        if self.offline:
+            if known is None:
+                log.warning("Image not available offline: %s", url)
+            return known
+
+        headers = {}
+        if known and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if known and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        session = self.get_session()
+        with session.get(url, headers=headers, timeout=10, stream=True) as response:
+            if response.status_code == 304 and known:
+                return known
+            if response.status_code != 200:
+                raise ValueError(f"Failed to fetch image: {response.status_code}")
+
+            mime_type = response.headers["Content-Type"].split(";")[0].strip()
+            etag = response.headers.get("ETag")
+            extension = mimetypes.guess_extension(mime_type)
+            if not extension:
+                raise ValueError(f"Unknown mime type: {mime_type}")
+            if extension != ".svg" and extension not in get_pillow_extensions():
+                raise ValueError(
+                    f"Unsupported image type: {extension}, cannot be converted to PDF"
+                )
+
+            log.info("Fetching %s", url)
+            fd, download = tempfile.mkstemp(dir=output_path, suffix=".part")
+            os.close(fd)
+            download = Path(download)
+            try:
+                digest = self._download(response, download)
+                filename = get_asset_filename(
+                    "fetch_image", digest, output_path, extension + ".pdf"
+                )
+                if not filename.exists():
+                    filename = self._convert(download, extension, filename)
+                if filename is None:
+                    raise ValueError(f"Image not converted to PDF: {url}")
+            finally:
+                download.unlink(missing_ok=True)
+
+        with self.lock:
+            self.index[url] = {
+                "filename": filename.name,
+                "etag": etag,
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        return filename
+
+    def _download(self, response, path: Path) -> str:
+        """Stream a response to a file, at most `max_size` bytes.
+        Return the digest of the content."""
+        length = int(response.headers.get("Content-Length") or 0)
+        if self.max_size and length > self.max_size:
+            raise ValueError(f"Image larger than {self.max_size} bytes: {response.url}")
+
+        size = 0
+        digest = sha256()
+        with open(path, "wb") as fp:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+                if self.max_size and size > self.max_size:
+                    raise ValueError(
+                        f"Image larger than {self.max_size} bytes: {response.url}"
+                    )
+                digest.update(chunk)
+                fp.write(chunk)
+        return digest.hexdigest()
+
+    def _convert(self, download: Path, extension: str, filename: Path) -> Path:
+        # SVG case
+        if extension == ".svg":
+            return svg2pdf(download.read_text(), filename.parent)
+
+        # Written aside then renamed, a failed conversion leaves no file
+        fd, temporary = tempfile.mkstemp(dir=filename.parent, prefix=f".{filename.name}.")
+        os.close(fd)
+        temporary = Path(temporary)
+        try:
+            with open_image(download) as image:
+                image.convert("RGB").save(temporary, "PDF")
+            os.replace(temporary, filename)
+        finally:
+            temporary.unlink(missing_ok=True)
+        return filename
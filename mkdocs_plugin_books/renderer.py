@@ -1,22 +1,32 @@
 import logging
 import re
 from hashlib import sha256
-from html import unescape
 from pathlib import Path
 from typing import Union
 from urllib.parse import quote, urlparse, urlunparse
 
 import yaml
-from bs4 import BeautifulSoup, NavigableString, PageElement, Tag
-from .helpers import escape_latex_chars
+from bs4 import NavigableString, PageElement, Tag
+from .elements import ElementIndex
+from .helpers import optimize_list
 from .formatters import LaTeXFormatter
+from .highlighting import highlight_code
+from .parsers import get_parser, parse_html
+from .text import (
+    escape_latex_chars,
+    escape_text,
+    escape_texts,
+    postprocess_latex,
+    replace_litterals,
+)
+from .tracing import tracer
 from .transformers import (
-    drawio2pdf,
-    fetch_image,
+    get_drawio_job,
+    get_mermaid_job,
     get_pdf_page_sizes,
-    image2pdf,
-    mermaid2pdf,
-    svg2pdf,
+    get_printed_width,
+    get_raster_job,
+    get_svg_pdf_name,
 )
 
 log = logging.getLogger("mkdocs")
@@ -62,27 +72,108 @@ def get_class(element, pattern: Union[str, re.Pattern]):
     return next((c for c in element.get("class", []) if pattern.match(c)), None)
 
 
-def get_depth(element: PageElement):
-    depth = 0
-    while element.parent is not None:
-        element = element.parent
-        depth += 1
-    return depth
-
-
-def find_all_dfs(soup: Tag, *args, **kwargs):
-    items = []
-    for el in soup.find_all(*args, **kwargs):
-        level = get_depth(el)
-        items.append((level, el))
-    return [item for _, item in sorted(items, key=lambda x: x[0], reverse=True)]
+# Wikipedia links of the terms of the pages, from the working directory
+LINKS_FILE = Path("links.yml")
 
+# Labels generated for exercises and their solutions, see process_exercise.
+# Code blocks and inline code are matched as well to be left as is.
+RE_EXERCISE_LABEL = re.compile(
+    r"(?P<verbatim>\\begin\{(?P<env>code|Verbatim)\}.*?\\end\{(?P=env)\}"
+    r"|\\mintinline\{[^}]*\}(?P<delimiter>[^\w\s{]).*?(?P=delimiter))"
+    r"|(?P<command>\\label\{|\\hyperref\[)(?P<kind>ex|sol):(?P<number>\d+)",
+    re.S,
+)
 
+# Figures of the diagrams converted once all pages are rendered
+RE_PENDING = re.compile(r"\\mkbookpending\{(\d+)\}")
+
+HEADINGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+
+CRITICS = {"del": "deletion", "ins": "addition", "span": "comment", "mark": "highlight"}
+
+FORMATS = {
+    "del": "strikethrough",
+    "em": "italic",
+    "ins": "underline",
+    "mark": "highlight",
+    "strong": "strong",
+    "sub": "subscript",
+    "sup": "superscript",
+}
+
+# Handlers of the visitor engine, in order of priority. They follow the
+# passes of the multi-pass engine (see renderering_order, render_inlines
+# is the pass before render_format). A node is rendered by the first
+# handler matching its tag (None for text), its classes (any of them,
+# False for none) and attributes. Nodes inside a node are rendered first
+# by the handlers of lower priority, those of higher priority are left
+# to the handler of the node, as the passes would. Nested lists are
+# rendered from the innermost, see ElementIndex.find_all_dfs.
+VISITOR_HANDLERS = [
+    # (tags, classes, attributes, nested, handler)
+    (["a"], ["headerlink", "footnote-backref"], None, False, "discard_element"),
+    (["a"], ["glightbox"], None, False, "unwrap_element"),
+    (["div"], ["latex-ignore"], None, False, "discard_element"),
+    (["span"], ["exercise-title"], None, False, "unwrap_element"),
+    (["div"], ["exercise-checkbox"], None, False, "discard_element"),
+    (["figure"], ["mermaid-figure"], None, False, "discard_element"),
+    (["hr"], None, None, False, "discard_element"),
+    (["br"], None, None, False, "render_br_element"),
+    (["a"], ["ycr-regex"], None, False, "render_regex_element"),
+    (["div"], ["highlight"], None, False, "render_codeblock_element"),
+    (["code"], None, None, False, "render_codeinline_element"),
+    (["span"], ["arithmatex"], None, False, "render_math_element"),
+    (["div"], ["arithmatex"], None, False, "render_math_block_element"),
+    (["a"], ["ycr-unicode"], None, False, "render_unicode_element"),
+    ([None], None, None, False, "render_string_element"),
+    (["img", "span"], ["twemoji"], None, False, "render_emoji_element"),
+    (["span"], ["keys"], None, False, "render_keystrokes_element"),
+    (["div"], ["tabbed-set"], None, False, "render_tabbed_element"),
+    (HEADINGS, None, None, False, "render_heading_element"),
+    (["blockquote"], ["epigraph"], None, False, "render_epigraph_element"),
+    (["autoref"], None, "identifier", False, "render_autoref_element"),
+    (["span"], None, "data-autorefs-identifier", False, "render_autoref_element"),
+    (["div"], ["footnote"], None, False, "render_footnote_element"),
+    (["sup"], None, "id", False, "render_footnote_ref_element"),
+    (["a"], None, None, False, "render_link_element"),
+    (["abbr"], None, None, False, "render_abbreviation_element"),
+    (["blockquote"], None, None, False, "render_quote_element"),
+    (["div"], ["admonition"], None, False, "render_admonition_element"),
+    (["details"], None, None, False, "render_details_element"),
+    (["ol", "ul"], None, None, True, "render_list_element"),
+    (["dl"], None, None, False, "render_description_list_element"),
+    (["pre"], ["mermaid"], None, False, "render_mermaid_element"),
+    (["figure"], None, None, False, "render_figure_element"),
+    (["table"], None, None, False, "render_table_element"),
+    (["span"], ["ycr-hashtag"], None, False, "render_index_element"),
+    (["div"], ["two-column-list"], None, False, "render_columns_element"),
+    (["div"], ["three-column-list"], None, False, "render_columns_element"),
+    (["del"], ["critic"], None, False, "render_critic_element"),
+    (["ins"], ["critic"], None, False, "render_critic_element"),
+    (["span"], ["critic", "comment"], None, False, "render_critic_element"),
+    (["span"], ["subst"], None, False, "render_substitution_element"),
+    (["mark"], ["critic"], None, False, "render_critic_element"),
+    (list(FORMATS), False, None, False, "render_format_element"),
+    (["p"], False, None, False, "render_paragraph_element"),
+]
+
+
+def load_wikimap(path: Path = LINKS_FILE) -> dict:
+    """Wikipedia links of the links file, empty without links file."""
+    if not path.exists():
+        log.warning("No links file found yet, skipping wikipedia links")
+        return {}
+    with open(path, "r") as f:
+        links = yaml.load(f, Loader=yaml.FullLoader)
+    return dict(links.get("wikipedia", {}))
 
 
 class LaTeXRenderer:
-    def __init__(self, output_path=Path("build"), config={}):
+    def __init__(self, output_path=Path("build"), config={}, pool=None, wikimap=None):
         self.config = config
+        # Conversions of the assets, only needed to merge pages
+        self.pool = pool
+        # Templates compiled once per process, and again once edited
         self.formatter = LaTeXFormatter()
         self.output_path = Path(output_path) / "assets"
         self.output_path.mkdir(parents=True, exist_ok=True)
@@ -125,19 +216,30 @@ class LaTeXRenderer:
             self.render_paragraph,
         ]
 
-        # Wiki links
-        link_file = Path("links.yml")
-        if link_file.exists():
-            with open(link_file, "r") as f:
-                self.links = yaml.load(f, Loader=yaml.FullLoader)
-            self.wikimap = {}
-            for key, value in self.links.get("wikipedia", {}).items():
-                self.wikimap[key] = value
-        else:
-            log.warning("No links file found yet, skipping wikipedia links")
-            self.wikimap = {}
+        # Handlers of the visitor engine by tag, see VISITOR_HANDLERS
+        self.handlers = {}
+        for priority, handler in enumerate(VISITOR_HANDLERS):
+            tags, classes, attribute, nested, name = handler
+            for tag in tags:
+                self.handlers.setdefault(tag, []).append(
+                    (priority, classes, attribute, nested, getattr(self, name))
+                )
+
+        # Elements of the page being rendered, see render
+        self.elements = ElementIndex()
+        self.texts = {}
+        self.parser = get_parser(self.config.parser)
+
+        # Wiki links, workers are given those loaded by the parent
+        self.wikimap = load_wikimap() if wikimap is None else wikimap
 
         # Metadata
+        self.reset_state()
+
+        self.level = 0
+
+    def reset_state(self):
+        """Discard the metadata collected while rendering pages."""
         self.abbreviations = {}
         self.acronyms = {}
         self.glossary = {}
@@ -146,8 +248,71 @@ class LaTeXRenderer:
         self.exercise_counter = 0
 
         self.assets_map = {}
+        self.pending = []
+        self.drawings = []
+        self.conversions = []
+
+    def get_state(self):
+        """Metadata collected while rendering, it must be picklable
+        to be sent back from a worker process."""
+        return {
+            "acronyms": self.acronyms,
+            "glossary": self.glossary,
+            "snippets": self.snippets,
+            "solutions": self.solutions,
+            "exercise_counter": self.exercise_counter,
+            "assets_map": self.assets_map,
+            "pending": self.pending,
+            "drawings": self.drawings,
+            "conversions": self.conversions,
+        }
 
-        self.level = 0
+    def merge_state(self, state: dict, latex: str = ""):
+        """Merge the metadata of a page rendered on its own.
+
+        Exercises of a page are numbered from one, their labels are
+        shifted to follow the exercises already merged. The shifted
+        LaTeX of the page is returned, with its pending figures
+        written (see convert_pending).
+        """
+        offset = self.exercise_counter
+
+        def shift(match):
+            if match["verbatim"]:
+                return match[0]
+            return f"{match['command']}{match['kind']}:{int(match['number']) + offset}"
+
+        solutions = state["solutions"]
+        if offset and state["exercise_counter"]:
+            latex = RE_EXERCISE_LABEL.sub(shift, latex)
+            solutions = [
+                (
+                    counter + offset,
+                    title,
+                    f"ex:{counter + offset}",
+                    RE_EXERCISE_LABEL.sub(shift, solution),
+                )
+                for counter, title, _, solution in solutions
+            ]
+
+        if pending := state["pending"]:
+
+            def resolve(match):
+                return self.render_pending(state, pending[int(match.group(1))])
+
+            latex = RE_PENDING.sub(resolve, latex)
+            solutions = [
+                (counter, title, label, RE_PENDING.sub(resolve, solution))
+                for counter, title, label, solution in solutions
+            ]
+
+        self.acronyms.update(state["acronyms"])
+        self.glossary.update(state["glossary"])
+        self.snippets.update(state["snippets"])
+        self.solutions.extend(solutions)
+        self.exercise_counter += state["exercise_counter"]
+        self.assets_map.update(state["assets_map"])
+        return latex
 
     def discard_unwanted(self, soup: Tag, **kwargs):
         unwanted = [
@@ -160,14 +325,20 @@ class LaTeXRenderer:
         ]
 
         for tag, classes, mode in unwanted:
-            for el in soup.find_all(tag, class_=classes):
+            for el in self.elements.find_all(soup, [tag], classes):
                 if mode == "unwrap":
-                    el.unwrap()
+                    self.elements.unwrap(el)
                 elif mode == "extract":
-                    el.extract()
+                    self.elements.extract(el)
 
         return soup
 
+    def discard_element(self, el: Tag, **kwargs):
+        self.elements.extract(el)
+
+    def unwrap_element(self, el: Tag, **kwargs):
+        self.elements.unwrap(el)
+
     def get_safe_text(self, element: Union[PageElement, NavigableString]):
         """Extract text from a PageElement object.
         This is a recursive function that will extract text from
@@ -201,8 +372,12 @@ class LaTeXRenderer:
 
     def apply(self, element: PageElement, template, *args, **kwargs):
         latex = getattr(self.formatter, template)(*args, **kwargs)
+        return self.replace_latex(element, latex)
+
+    def replace_latex(self, element: PageElement, latex: str):
         node = NavigableString(latex)
         node.processed = True
+        self.elements.remove(element)
         element.replace_with(node)
         return node
 
@@ -211,59 +386,41 @@ class LaTeXRenderer:
         for litteral, they are not all supported in LaTeX. So they
         need to be replaced accordingly.
         """
-        mapping = {
-            "½": "\\nicefrac{1}{2}",
-            "¼": "\\nicefrac{1}{4}",
-            "¾": "\\nicefrac{3}{4}",
-            "⅓": "\\nicefrac{1}{3}",
-            "⅔": "\\nicefrac{2}{3}",
-            "⅛": "\\nicefrac{1}{8}",
-            "⅜": "\\nicefrac{3}{8}",
-            "⅝": "\\nicefrac{5}{8}",
-            "⅞": "\\nicefrac{7}{8}",
-            "⅕": "\\nicefrac{1}{5}",
-            "⅖": "\\nicefrac{2}{5}",
-            "⅗": "\\nicefrac{3}{5}",
-            "⅘": "\\nicefrac{4}{5}",
-            "⅙": "\\nicefrac{1}{6}",
-            "⅚": "\\nicefrac{5}{6}",
-        }
-        # Litteral chars
-        for key, value in mapping.items():
-            s = s.replace(key, value)
-
-        # Litteral fractions e.g. 23/43 -> \nicefrac{23}{43}
-        s = re.sub(r"\b(\d+)\/(\d+)\b", r"\\nicefrac{\1}{\2}", s)
-
-        return s
+        return replace_litterals(s)
 
     def render_navigable_string(self, soup: Tag, **kwargs):
         """Replace all NavigableString to escape LaTeX special characters.
         This should not be on code blocks, only on text elements.
         """
-        for el in soup.find_all(string=True):
-            if el.find_parent("code"):
-                continue  # Skip
+        for el in self.elements.find_all(soup, [None]):
+            self.render_string_element(el)
+        return soup
 
-            if getattr(el, "processed", False):
-                continue  # Skip
+    def render_string_element(self, el: NavigableString, **kwargs):
+        if self.elements.in_code(el):
+            return  # Skip
 
-            # Escape LaTeX string only once
-            text = el.get_text()
-            text = escape_latex_chars(text)
+        if getattr(el, "processed", False):
+            return  # Skip
 
-            text = self.monkeypatch_hyphenation(text)
+        # Escape LaTeX string only once, most were escaped in batch
+        text = self.texts.get(id(el))
+        if text is None:
+            text = escape_text(el.get_text())
 
-            el.replace_with(text)
-        return soup
+        self.elements.remove(el)
+        el.replace_with(text)
 
     def render_unicode(self, soup: Tag, **kwargs):
         """Display a unicode char code."""
-        for a in soup.find_all("a", class_=["ycr-unicode"]):
-            code = f"U+{self.get_safe_text(a)}"
-            self.apply(a, "href", code, url=safe_quote(a.get("href", "")))
+        for a in self.elements.find_all(soup, ["a"], ["ycr-unicode"]):
+            self.render_unicode_element(a)
         return soup
 
+    def render_unicode_element(self, a: Tag, **kwargs):
+        code = f"U+{self.get_safe_text(a)}"
+        self.apply(a, "href", code, url=safe_quote(a.get("href", "")))
+
     def render_regex(self, soup: Tag, **kwargs):
         """Replace all regex elements with LaTeX formatted strings.
         This is not markdown standard, YCR uses the syntax `:regex:...`
@@ -272,33 +429,44 @@ class LaTeXRenderer:
         <a href="https://regex101.com/?regex='...'&flags=...&flavor=pcre2"
             class="ycr-regex" target="_blank">/.../</a>
         """
-        for a in soup.find_all("a", class_=["ycr-regex"]):
-            if code_tag := a.find("code"):
-                code = self.get_safe_text(code_tag)
-            else:  # Fallback to text
-                code = self.get_safe_text(a)
-
-            code = code.replace("&", "\\&").replace("#", "\\#")
-            self.apply(a, "regex", code, url=safe_quote(a.get("href", "")))
+        for a in self.elements.find_all(soup, ["a"], ["ycr-regex"]):
+            self.render_regex_element(a)
         return soup
 
+    def render_regex_element(self, a: Tag, **kwargs):
+        if code_tag := a.find("code"):
+            code = self.get_safe_text(code_tag)
+        else:  # Fallback to text
+            code = self.get_safe_text(a)
+
+        code = code.replace("&", "\\&").replace("#", "\\#")
+        self.apply(a, "regex", code, url=safe_quote(a.get("href", "")))
+
     def render_codeinline(self, soup: Tag, **kwargs):
         """Extract code from a <code> object."""
-        for el in soup.find_all("code"):
-            # Skip mermaid
-            if el.find_parent("pre", class_="mermaid"):
-                continue
+        for el in self.elements.find_all(soup, ["code"]):
+            self.render_codeinline_element(el)
+        return soup
 
-            if get_class(el, "highlight"):
-                code = "".join([e.get_text() for e in el.find_all("span")])
-            else:
-                code = self.get_safe_text(el)
-            language = self.get_code_language(el)
+    def render_codeinline_element(self, el: Tag, **kwargs):
+        # Skip mermaid
+        if self.elements.in_mermaid(el):
+            return
+
+        if get_class(el, "highlight"):
+            code = "".join([e.get_text() for e in el.find_all("span")])
+        else:
+            code = self.get_safe_text(el)
+        language = self.get_code_language(el)
 
-            code = escape_latex_chars(code).replace(" ", "~")
+        if self.config.highlight == "pygments" and language not in (None, "text"):
+            code = highlight_code(el.get_text(), language, self.config.highlight_style)
+            code = code.rstrip("\n")
+        else:
+            code = escape_latex_chars(code)
+        code = code.replace(" ", "~")
 
-            self.apply(el, "codeinlinett", code)
-        return soup
+        self.apply(el, "codeinlinett", code)
 
     def render_codeinline_old(self, soup: Tag, **kwargs):
         """Extract code from a <code> object.
@@ -340,59 +508,140 @@ class LaTeXRenderer:
     def render_mermaid(self, soup: Tag, **kwargs):
         """Extract mermaid diagrams from a <code> object
         to be rendered as images."""
-        for el in soup.find_all("pre", class_=["mermaid"]):
-            code = el.find("code")
-            if not code:
-                code = el
+        for el in self.elements.find_all(soup, ["pre"], ["mermaid"]):
+            self.render_mermaid_element(el)
+        return soup
 
-            diagram = self.get_safe_text(code)
+    def render_mermaid_element(self, el: Tag, **kwargs):
+        code = el.find("code")
+        if not code:
+            code = el
 
-            caption = None
-            if match := re.search(r"^%%\s*(.*?)\n", diagram):
-                caption = match.group(1)
+        diagram = self.get_safe_text(code)
 
-            kwargs = {}
-            if mermaid_config := self.config.mermaid_config:
-                kwargs["config_filename"] = self.config.project_dir / mermaid_config
+        caption = None
+        if match := re.search(r"^%%\s*(.*?)\n", diagram):
+            caption = match.group(1)
 
-            filename = mermaid2pdf(diagram, self.output_path, **kwargs)
-            if not filename:
-                raise ValueError("Mermaid diagram not rendered")
+        kwargs = {}
+        if mermaid_config := self.config.mermaid_config:
+            kwargs["config_filename"] = self.config.project_dir / mermaid_config
 
-            self.assets_map[filename] = {
-                "type": "mermaid",
-                "inline": True,  # Inline content
-            }
-            template = (
-                "figure_tcolorbox" if kwargs.get("tcolorbox", False) else "figure"
+        job = get_mermaid_job(diagram, self.output_path, **kwargs)
+        filename = job["pdf"]
+
+        self.assets_map[filename] = {
+            "type": "mermaid",
+            "inline": True,  # Inline content
+            "config": kwargs.get("config_filename"),
+        }
+        job["template"] = (
+            "figure_tcolorbox" if kwargs.get("tcolorbox", False) else "figure"
+        )
+        job["caption"] = caption
+        job["type"] = "mermaid"
+
+        if filename.exists():
+            self.replace_latex(el, self.render_mermaid_figure(job))
+            return
+
+        # Diagrams are converted together once all pages are rendered
+        # and the figure is written when merging the page state
+        self.replace_latex(el, f"\\mkbookpending{{{len(self.pending)}}}")
+        self.pending.append(job)
+
+    def convert_later(self, converter: str, output: Path, *args) -> Path:
+        """Convert an asset once the page is rendered, see CONVERTERS.
+        The output of the converter is returned."""
+        if not output.exists():
+            self.conversions.append((converter, output, args))
+        return output
+
+    def fetch_later(self, element, url, asset, template, key="path", **kwargs):
+        """Replace an element by a placeholder, the image is fetched once
+        the page is rendered and the template is written when merging the
+        page state with its filename as `key`."""
+        self.replace_latex(element, f"\\mkbookpending{{{len(self.pending)}}}")
+        self.pending.append({
+            "type": "url",
+            "url": url,
+            "asset": asset,
+            "template": template,
+            "key": key,
+            "kwargs": kwargs,
+        })
+
+    def submit_conversions(self, state: dict):
+        """Start the conversions needed by a rendered page."""
+        for converter, output, args in state["conversions"]:
+            self.pool.submit(converter, *args, key=output)
+        for job in state["pending"]:
+            if job["type"] == "url":
+                self.pool.submit("fetch_image", job["url"], self.output_path)
+
+    def convert_pending(self, states: list):
+        """Wait for the conversions left pending by the rendered pages,
+        given their states. Diagrams and figures converted by containers
+        are converted together."""
+        with tracer.span("convert_pending", "render"):
+            for state in states:
+                self.submit_conversions(state)
+            batches = self.pool.submit_batches(
+                [job for state in states for job in state["pending"]
+                 if job["type"] == "mermaid"],
+                [job for state in states for job in state["drawings"]],
             )
+            for state in states:
+                for converter, output, args in state["conversions"]:
+                    self.pool.result(converter, *args, key=output)
+            batches.result()
+
+    def render_pending(self, state: dict, job: dict):
+        if job["type"] == "mermaid":
+            return self.render_mermaid_figure(job)
+
+        filename = self.pool.result("fetch_image", job["url"], self.output_path)
+        if filename is None:
+            return self.formatter.strong("Image not available offline")
+        state["assets_map"][filename] = job["asset"]
+        return getattr(self.formatter, job["template"])(
+            **{job["key"]: filename.name}, **job["kwargs"]
+        )
 
-            width, height = get_pdf_page_sizes(filename)
+    def render_mermaid_figure(self, job: dict):
+        filename = job["pdf"]
+        if not filename.exists():
+            return self.formatter.strong("Mermaid diagram not rendered")
 
-            # Naive scaling. Assume PDF page is 210mm x 297mm
-            # With 30 + 40 mm margins, linewidth is 140 mm.
-            if width > 140:
-                # ratio = round(140 / width, 2)
-                ratio = 1.0
-                width = f"{ratio*100}%"
-            else:
-                width = f"{width}mm"
+        width, height = get_pdf_page_sizes(filename)
 
-            self.apply(el, template, path=filename.name, caption=caption, width=width)
+        # Naive scaling. Assume PDF page is 210mm x 297mm
+        # With 30 + 40 mm margins, linewidth is 140 mm.
+        if width > 140:
+            # ratio = round(140 / width, 2)
+            ratio = 1.0
+            width = f"{ratio*100}%"
+        else:
+            width = f"{width}mm"
 
-        return soup
+        return getattr(self.formatter, job["template"])(
+            path=filename.name, caption=job["caption"], width=width
+        )
 
     def render_epigraph(self, soup: Tag, **kwargs):
-        for el in soup.find_all("blockquote", class_=["epigraph"]):
-            if footer := el.find("footer"):
-                self.render_inlines(footer)
-                source = self.get_safe_text(footer)
-                footer.extract()
-
-            text = el.get_text()
-            self.apply(el, "epigraph", text, source=source)
+        for el in self.elements.find_all(soup, ["blockquote"], ["epigraph"]):
+            self.render_epigraph_element(el)
         return soup
 
+    def render_epigraph_element(self, el: Tag, **kwargs):
+        if footer := el.find("footer"):
+            self.render_inlines(footer)
+            source = self.get_safe_text(footer)
+            self.elements.extract(footer)
+
+        text = el.get_text()
+        self.apply(el, "epigraph", text, source=source)
+
     def render_codeblock(self, soup: Tag, **kwargs):
         """Extract code block from a <div class="highlight"> object.
         Assumptions:
@@ -402,128 +651,151 @@ class LaTeXRenderer:
         - Other span elements: cp, w, cpf, kt, nf, p, mi
         are code elements, they can be merged.
         """
-        for el in soup.find_all("div", class_=["highlight"]):
-            language = self.get_code_language(el)
-            lineno = bool(el.find(class_="linenos"))
-
-            filename = None
-            if el_filename := el.find(class_="filename"):
-                self.render_inlines(el_filename)
-                filename = el_filename.get_text()
-
-            code = el.find("code")
-
-            if not code:
-                raise ValueError("No code block found in codeblock")
-
-            listing = []
-            highlight = []
-            spans = code.find_all("span", id=lambda x: x and x.startswith("__"))
-            for i, span_line in enumerate(spans):
-                if hl := span_line.find("span", class_="hll"):
-                    highlight.append(i + 1)
-                    span_line = hl
-                # tokens = span_line.find_all('span')
-                listing.append(span_line.get_text())
-
-            code = "".join(listing)
-
-            def is_ascii_art(s):
-                chars = "┌┬─┐"
-                for c in chars:
-                    if c in s:
-                        return True
-                return False
-
-            baselinestretch = 0.5 if is_ascii_art(code) else None
-
-            self.apply(
-                el,
-                "codeblock",
-                code=code,
-                language=language,
-                lineno=lineno,
-                filename=filename,
-                highlight=highlight,
-                baselinestretch=baselinestretch,
-            )
+        for el in self.elements.find_all(soup, ["div"], ["highlight"]):
+            self.render_codeblock_element(el)
         return soup
 
+    def render_codeblock_element(self, el: Tag, **kwargs):
+        language = self.get_code_language(el)
+        lineno = bool(el.find(class_="linenos"))
+
+        filename = None
+        if el_filename := el.find(class_="filename"):
+            self.render_inlines(el_filename)
+            filename = el_filename.get_text()
+
+        code = el.find("code")
+
+        if not code:
+            raise ValueError("No code block found in codeblock")
+
+        listing = []
+        highlight = []
+        spans = code.find_all("span", id=lambda x: x and x.startswith("__"))
+        for i, span_line in enumerate(spans):
+            if hl := span_line.find("span", class_="hll"):
+                highlight.append(i + 1)
+                span_line = hl
+            # tokens = span_line.find_all('span')
+            listing.append(span_line.get_text())
+
+        code = "".join(listing)
+
+        def is_ascii_art(s):
+            chars = "┌┬─┐"
+            for c in chars:
+                if c in s:
+                    return True
+            return False
+
+        baselinestretch = 0.5 if is_ascii_art(code) else None
+
+        template = "codeblock"
+        if self.config.highlight == "pygments":
+            template = "codeblock_pygments"
+            code = highlight_code(code, language, self.config.highlight_style)
+
+        self.apply(
+            el,
+            template,
+            code=code,
+            language=language,
+            lineno=lineno,
+            filename=filename,
+            highlight=optimize_list(highlight),  # e.g. 1,2,3 -> 1-3
+            baselinestretch=baselinestretch,
+        )
+
     def render_quote(self, soup: Tag, **kwargs):
-        for el in soup.find_all(["blockquote"]):
-            self.render_inlines(el)
-            text = self.get_safe_text(el)
-            self.apply(el, "blockquote", text)
+        for el in self.elements.find_all(soup, ["blockquote"]):
+            self.render_quote_element(el)
         return soup
 
+    def render_quote_element(self, el: Tag, **kwargs):
+        self.render_inlines(el)
+        text = self.get_safe_text(el)
+        self.apply(el, "blockquote", text)
+
     def render_heading(self, soup: Tag, **kwargs):
-        base_level = kwargs.get("base_level", 0)
-        for el in soup.find_all(["h1", "h2", "h3", "h4", "h5", "h6"]):
-            for a in el.find_all("a"):  # No links in headings
-                a.unwrap()
-            self.render_inlines(el)
-            title = self.get_safe_text(el)
-            level = int(el.name[1:]) + base_level - 1
-            ref = el.get("id", None)
-            if kwargs.get("drop_title", False):
-                kwargs["drop_title"] = False
-                self.apply(el, "pagestyle", "plain")
-                continue
-            self.apply(
-                el,
-                "heading",
-                title,
-                level=level,
-                ref=ref,
-                numbered=kwargs.get("numbered", True),
-            )
+        for el in self.elements.find_all(soup, HEADINGS):
+            self.render_heading_element(el, **kwargs)
         return soup
 
+    def render_heading_element(self, el: Tag, **kwargs):
+        for a in el.find_all("a"):  # No links in headings
+            self.elements.unwrap(a)
+        self.render_inlines(el)
+        title = self.get_safe_text(el)
+        level = int(el.name[1:]) + kwargs.get("base_level", 0) - 1
+        ref = el.get("id", None)
+        if self.drop_title:
+            self.drop_title = False
+            self.apply(el, "pagestyle", "plain")
+            return
+        self.apply(
+            el,
+            "heading",
+            title,
+            level=level,
+            ref=ref,
+            numbered=kwargs.get("numbered", True),
+        )
+
     def render_autoref(self, soup: Tag, **kwargs):
 
-        for el in soup.find_all("autoref", attrs={"identifier": True}):
-            tag = el.get("identifier")
-            text = self.get_safe_text(el)
-            self.apply(el, "ref", text, ref=tag)
+        for el in self.elements.find_all(soup, ["autoref"], attribute="identifier"):
+            self.render_autoref_element(el)
+
+        for el in self.elements.find_all(
+            soup, ["span"], attribute="data-autorefs-identifier"
+        ):
+            self.render_autoref_element(el)
+        return soup
 
-        for el in soup.find_all("span", attrs={"data-autorefs-identifier": True}):
+    def render_autoref_element(self, el: Tag, **kwargs):
+        if el.name == "autoref":
+            identifier = el.get("identifier")
+        else:
             identifier = el.get("data-autorefs-identifier")
             self.render_inlines(el)
-            text = self.get_safe_text(el)
-            self.apply(el, "ref", text, ref=identifier)
-        return soup
+        text = self.get_safe_text(el)
+        self.apply(el, "ref", text, ref=identifier)
 
     def render_math(self, soup: Tag, **kwargs):
         """Replace all math elements.
 
         <span class="arithmatex">...</span>
         """
-        for el in soup.find_all("span", class_=["arithmatex"]):
-            text = self.get_safe_text(el)
-            node = NavigableString(text)
-            node.processed = True
-            el.replace_with(node)
+        for el in self.elements.find_all(soup, ["span"], ["arithmatex"]):
+            self.render_math_element(el)
         return soup
 
+    def render_math_element(self, el: Tag, **kwargs):
+        self.replace_latex(el, self.get_safe_text(el))
+
     def render_math_block(self, soup: Tag, **kwargs):
-        for math_block in soup.find_all(["div"], class_="arithmatex"):
-            text = self.get_safe_text(math_block)
-            node = NavigableString(f"\n{text}\n")
-            node.processed = True
-            math_block.replace_with(node)
+        for math_block in self.elements.find_all(soup, ["div"], ["arithmatex"]):
+            self.render_math_block_element(math_block)
         return soup
 
+    def render_math_block_element(self, math_block: Tag, **kwargs):
+        text = self.get_safe_text(math_block)
+        self.replace_latex(math_block, f"\n{text}\n")
+
     def render_abbreviation(self, soup: Tag, **kwargs):
-        for abbr in soup.find_all("abbr"):
-            text = escape_latex_chars(abbr.get("title"))
-            short = self.get_safe_text(abbr)
+        for abbr in self.elements.find_all(soup, ["abbr"]):
+            self.render_abbreviation_element(abbr)
+        return soup
 
-            # Discard any special characters not allowed in glossary references
-            tag = "acr:" + re.sub(r"[^a-zA-Z0-9]", "", short).lower()
+    def render_abbreviation_element(self, abbr: Tag, **kwargs):
+        text = escape_latex_chars(abbr.get("title"))
+        short = self.get_safe_text(abbr)
 
-            self.acronyms[tag] = (short, text)
-            self.apply(abbr, "acronym", tag)
-        return soup
+        # Discard any special characters not allowed in glossary references
+        tag = "acr:" + re.sub(r"[^a-zA-Z0-9]", "", short).lower()
+
+        self.acronyms[tag] = (short, text)
+        self.apply(abbr, "acronym", tag)
 
     def render_emoji(self, soup: Tag, **kwargs):
         """Twemoji can be rendered as inline SVG or CDN link.
@@ -536,106 +808,124 @@ class LaTeXRenderer:
             </svg>
         </span>
         """
-        for img in soup.find_all("img", class_=["twemoji"]):
-            src = img.get("src")
+        for img in self.elements.find_all(soup, ["img"], ["twemoji"]):
+            self.render_emoji_element(img)
+
+        for span in self.elements.find_all(soup, ["span"], ["twemoji"]):
+            self.render_emoji_element(span)
+        return soup
+
+    def render_emoji_element(self, el: Tag, **kwargs):
+        if el.name == "img":
+            src = el.get("src")
             if not src.startswith("http"):
                 raise ValueError(f"Expected URL, got {src}")
-            filename = fetch_image(src, self.output_path)
-            self.assets_map[filename] = {"type": "twemoji", "url": src}
-            self.apply(img, "icon", filename)
-
-        for span in soup.find_all("span", class_=["twemoji"]):
-            svg = span.find("svg")
-            if not svg:
-                raise ValueError("Expected SVG element in twemoji")
-            svgdata = str(svg)
-            filename = svg2pdf(svgdata, self.output_path)
-            filename = filename.name
-            self.assets_map[filename] = {"type": "twemoji", "inline": True}
-            self.apply(span, "icon", filename)
-        return soup
+            self.fetch_later(el, src, {"type": "twemoji", "url": src}, "icon", "text")
+            return
+
+        svg = el.find("svg")
+        if not svg:
+            raise ValueError("Expected SVG element in twemoji")
+        svgdata = str(svg)
+        filename = self.convert_later(
+            "svg2pdf",
+            get_svg_pdf_name(svgdata, self.output_path),
+            svgdata,
+            self.output_path,
+        )
+        self.assets_map[filename] = {"type": "twemoji", "inline": True}
+        self.apply(el, "icon", filename.name)
 
     def render_critics(self, soup: Tag, **kwargs):
         """Critics from CriticMarkup are rendered as follows"""
 
         # Strikethrough with red background
-        for el in soup.find_all("del", class_=["critic"]):
-            self.render_inlines(el)
-            self.apply(el, "deletion", self.get_safe_text(el))
+        for el in self.elements.find_all(soup, ["del"], ["critic"]):
+            self.render_critic_element(el)
 
         # Underline with green background
-        for el in soup.find_all("ins", class_=["critic"]):
-            self.render_inlines(el)
-            self.apply(el, "addition", self.get_safe_text(el))
+        for el in self.elements.find_all(soup, ["ins"], ["critic"]):
+            self.render_critic_element(el)
 
         # Gray with /* */ comment
-        for el in soup.find_all("span", class_=["critic", "comment"]):
-            self.render_inlines(el)
-            self.apply(el, "comment", self.get_safe_text(el))
+        for el in self.elements.find_all(soup, ["span"], ["critic", "comment"]):
+            self.render_critic_element(el)
 
         # Substitution
-        for el in soup.find_all("span", class_=["critic", "subst"]):
-            raise NotImplementedError("Substitution not implemented")
+        for el in self.elements.find_all(soup, ["span"], ["critic", "subst"]):
+            self.render_substitution_element(el)
 
         # Highlight
-        for el in soup.find_all("mark", class_=["critic"]):
-            self.render_inlines(el)
-            self.apply(el, "highlight", self.get_safe_text(el))
+        for el in self.elements.find_all(soup, ["mark"], ["critic"]):
+            self.render_critic_element(el)
         return soup
 
+    def render_critic_element(self, el: Tag, **kwargs):
+        self.render_inlines(el)
+        self.apply(el, CRITICS[el.name], self.get_safe_text(el))
+
+    def render_substitution_element(self, el: Tag, **kwargs):
+        raise NotImplementedError("Substitution not implemented")
+
     def render_keystrokes(self, soup: Tag, **kwargs):
-        for span in soup.find_all("span", class_="keys"):
-            keys = []
-            for key in span.find_all(["kbd"]):
-                key_class = get_class(key, re.compile(r"^key-(.*)$"))
-                if key_class:
-                    keys.append(key_class[4:])
-                else:
-                    keys.append(self.get_safe_text(key))
-            self.apply(span, "keystroke", keys)
+        for span in self.elements.find_all(soup, ["span"], ["keys"]):
+            self.render_keystrokes_element(span)
         return soup
 
+    def render_keystrokes_element(self, span: Tag, **kwargs):
+        keys = []
+        for key in span.find_all(["kbd"]):
+            key_class = get_class(key, re.compile(r"^key-(.*)$"))
+            if key_class:
+                keys.append(key_class[4:])
+            else:
+                keys.append(self.get_safe_text(key))
+        self.apply(span, "keystroke", keys)
+
     def render_format(self, soup: Tag, **kwargs):
-        mapper = {
-            "del": "strikethrough",
-            "em": "italic",
-            "ins": "underline",
-            "mark": "highlight",
-            "strong": "strong",
-            "sub": "subscript",
-            "sup": "superscript",
-        }
+        for el in self.elements.find_all(soup, list(FORMATS), False):
+            self.render_format_element(el)
+        return soup
 
-        for el in soup.find_all(mapper.keys(), class_=False):
-            if not el.parent:
-                continue
+    def render_format_element(self, el: Tag, **kwargs):
+        if not el.parent:
+            return
 
-            if el.name == "sup" and el.get("id"):
-                # This is a footnote, we will handle it later
-                continue
+        if el.name == "sup" and el.get("id"):
+            # This is a footnote, we will handle it later
+            return
 
-            el = self.render_inlines(el)
-            text = self.get_safe_text(el)
-            self.apply(el, mapper[el.name], text)
-        return soup
+        el = self.render_inlines(el)
+        text = self.get_safe_text(el)
+        self.apply(el, FORMATS[el.name], text)
 
     def render_footnotes(self, soup: Tag, **kwargs):
-        footnotes = {}
-        for el in soup.find_all(["div"], class_="footnote"):
-            for li in el.find_all("li"):
-                footnote_id = re.sub(r"^fn:(\d+)", r"\1", li.get("id", ""))
-                if not footnote_id:
-                    raise ValueError(f"Missing id in footnote: {li}")
-                self.render_inlines(li)
-                footnotes[footnote_id] = self.get_safe_text(li)
-            el.extract()
-
-        for el in soup.find_all("sup", id=True):
-            footnote_id = re.sub(r"^fnref:(\d+)", r"\1", el.get("id", ""))
-            self.apply(el, "footnote", footnotes[footnote_id])
+        for el in self.elements.find_all(soup, ["div"], ["footnote"]):
+            self.render_footnote_element(el)
+
+        for el in self.elements.find_all(soup, ["sup"], attribute="id"):
+            self.render_footnote_ref_element(el)
         return soup
 
+    def render_footnote_element(self, el: Tag, **kwargs):
+        for li in el.find_all("li"):
+            footnote_id = re.sub(r"^fn:(\d+)", r"\1", li.get("id", ""))
+            if not footnote_id:
+                raise ValueError(f"Missing id in footnote: {li}")
+            self.render_inlines(li)
+            self.footnotes[footnote_id] = self.get_safe_text(li)
+        self.elements.extract(el)
+
+    def render_footnote_ref_element(self, el: Tag, **kwargs):
+        footnote_id = re.sub(r"^fnref:(\d+)", r"\1", el.get("id", ""))
+        self.apply(el, "footnote", self.footnotes[footnote_id])
+
     def render_list(self, soup: Tag, **kwargs):
+        for el in self.elements.find_all_dfs(soup, ["ol", "ul"]):
+            self.render_list_element(el)
+        return soup
+
+    def render_list_element(self, el: Tag, **kwargs):
         def is_checkbox(item):
             if item.startswith("[ ]"):
                 return -1
@@ -643,59 +933,63 @@ class LaTeXRenderer:
                 return 1
             return 0
 
-        for el in find_all_dfs(soup, ["ol", "ul"]):
-            items = []
-            checkboxes = []
-            for li in el.find_all("li"):
-                self.render_inlines(li)
-                text = self.get_safe_text(li)
-                checkboxes.append(is_checkbox(text))
-                items.append(text)
-
-            has_checkbox = any(checkboxes)
-            if has_checkbox:
-                # Strip the checkbox litterals
-                items = [item[4:] for item in items]
-
-            checkboxes = [c > 0 for c in checkboxes]
-
-            match el.name:
-                case "ol":
-                    self.apply(el, "ordered_list", items=items)
-                case "ul":
-                    if has_checkbox:
-                        self.apply(el, "choices", items=zip(checkboxes, items))
-                    else:
-                        self.apply(el, "unordered_list", items=items)
-        return soup
+        items = []
+        checkboxes = []
+        for li in el.find_all("li"):
+            self.render_inlines(li)
+            text = self.get_safe_text(li)
+            checkboxes.append(is_checkbox(text))
+            items.append(text)
+
+        has_checkbox = any(checkboxes)
+        if has_checkbox:
+            # Strip the checkbox litterals
+            items = [item[4:] for item in items]
+
+        checkboxes = [c > 0 for c in checkboxes]
+
+        match el.name:
+            case "ol":
+                self.apply(el, "ordered_list", items=items)
+            case "ul":
+                if has_checkbox:
+                    self.apply(el, "choices", items=zip(checkboxes, items))
+                else:
+                    self.apply(el, "unordered_list", items=items)
 
     def render_description_list(self, soup: Tag, **kwargs):
-        for dl in soup.find_all(["dl"]):
-            items = []
-            title = None
-            for el in dl.find_all(["dt", "dd"]):
-                self.render_inlines(el)
-                if el.name == "dt":
-                    title = self.get_safe_text(el)
-                elif el.name == "dd":
-                    content = self.get_safe_text(el)
-                    items.append((title, content))
-
-            self.apply(dl, "description_list", items=items)
+        for dl in self.elements.find_all(soup, ["dl"]):
+            self.render_description_list_element(dl)
         return soup
 
+    def render_description_list_element(self, dl: Tag, **kwargs):
+        items = []
+        title = None
+        for el in dl.find_all(["dt", "dd"]):
+            self.render_inlines(el)
+            if el.name == "dt":
+                title = self.get_safe_text(el)
+            elif el.name == "dd":
+                content = self.get_safe_text(el)
+                items.append((title, content))
+
+        self.apply(dl, "description_list", items=items)
+
     def get_heading_level(self, soup: Tag):
         """Iterate parents and ancestors to get current <h> level."""
+        if level := self.elements.get_heading_level(soup):
+            return level
+
         current = soup
         while current is not None:
             # Check current element
-            if current.name in ["h1", "h2", "h3", "h4", "h5", "h6"]:
+            if current.name in HEADINGS:
                 return int(current.name[1:])
 
             # Check previous siblings
             sibling = current.previous_sibling
             while sibling is not None:
-                if sibling.name in ["h1", "h2", "h3", "h4", "h5", "h6"]:
+                if sibling.name in HEADINGS:
                     return int(sibling.name[1:])
                 sibling = sibling.previous_sibling
 
@@ -705,102 +999,125 @@ class LaTeXRenderer:
         return None
 
     def render_tabbed(self, soup: Tag, **kwargs):
-        for div in soup.find_all(["div"], class_="tabbed-set"):
-            level = self.get_heading_level(div)
-            # Get titles
-            titles = []
-            if tabbed_labels := div.find("div", class_="tabbed-labels"):
-                for label in tabbed_labels.find_all(["label"]):
-                    self.render_inlines(label)
-                    titles.append(self.get_safe_text(label))
-                tabbed_labels.extract()
-            else:
-                raise ValueError("Missing tabbed-labels")
-
-            # Remove checkbox
-            for el in div.find_all(["input"], recursive=False):
-                el.extract()
-
-            # Get content
-            tabbed_content = div.find("div", class_="tabbed-content")
-            for i, tab in enumerate(
-                tabbed_content.find_all(["div"], class_="tabbed-block")
-            ):
-                heading = soup.new_tag(f"h{min(level + 1, 6)}")
-                heading.string = titles[i]
-                tab.insert_before(f"\n\\textbf{{{titles[i]}}}\\par\n")
-                tab.unwrap()
-
-            tabbed_content.unwrap()
-            div.unwrap()
+        for div in self.elements.find_all(soup, ["div"], ["tabbed-set"]):
+            self.render_tabbed_element(div)
         return soup
 
+    def render_tabbed_element(self, div: Tag, **kwargs):
+        level = self.get_heading_level(div)
+        # Get titles
+        titles = []
+        if tabbed_labels := div.find("div", class_="tabbed-labels"):
+            for label in tabbed_labels.find_all(["label"]):
+                self.render_inlines(label)
+                titles.append(self.get_safe_text(label))
+            self.elements.extract(tabbed_labels)
+        else:
+            raise ValueError("Missing tabbed-labels")
+
+        # Remove checkbox
+        for el in div.find_all(["input"], recursive=False):
+            self.elements.extract(el)
+
+        # Get content
+        tabbed_content = div.find("div", class_="tabbed-content")
+        for i, tab in enumerate(
+            tabbed_content.find_all(["div"], class_="tabbed-block")
+        ):
+            heading = Tag(name=f"h{min(level + 1, 6)}")
+            heading.string = titles[i]
+            tab.insert_before(f"\n\\textbf{{{titles[i]}}}\\par\n")
+            self.elements.unwrap(tab)
+
+        self.elements.unwrap(tabbed_content)
+        self.elements.unwrap(div)
+
     def render_figure(self, soup: Tag, **kwargs):
-        for figure in soup.find_all(["figure"]):
-            if get_class(figure, "mermaid-figure"):
-                continue
-            image = figure.find("img")
-            if not image:
-                raise ValueError(f"Missing image in figure {figure}")
-            image_src = image.get("src")
-            if not image_src:
-                raise ValueError(f"Missing src in image {image}")
-            if is_valid_url(image_src):
-                filename = fetch_image(image_src, self.output_path)
-                self.assets_map[filename] = {
-                    "type": "image",
-                    "source": image_src,
-                }
-            else:
-                filepath = resolve_asset_path(
-                    kwargs.get("file_path", Path()), image_src
-                )
-                if not filepath:
-                    raise ValueError(f"Image not found: {image_src}")
-                match filepath.suffix:
-                    case ".svg":
-                        filename = svg2pdf(filepath, self.output_path)
-                        self.assets_map[filename] = {"type": "svg", "source": filepath}
-                    case ".drawio":
-                        filename = drawio2pdf(filepath, self.output_path)
-                        self.assets_map[filename] = {
-                            "type": "drawio",
-                            "source": filepath,
-                        }
-                    case _:
-                        filename = image2pdf(filepath, self.output_path)
-                        self.assets_map[filename] = {
-                            "type": "image",
-                            "source": filepath,
-                        }
-            caption = figure.find("figcaption")
-            short_caption = image.get("alt", "")
-            self.render_inlines(caption)
-            caption_text = self.get_safe_text(caption) if caption else short_caption
-
-            if short_caption and len(caption) > len(short_caption):
-                short_caption = None
-
-            width = image.get("width", None)
-
-            label = None
-            if label_id := figure.get("id"):
-                label = f"{label_id}"
-
-            template = (
-                "figure_tcolorbox" if kwargs.get("tcolorbox", False) else "figure"
-            )
-            self.apply(
-                figure,
-                template,
-                caption=caption_text,
-                shortcaption=short_caption,
-                path=filename.name,
-                label=label,
-                width=width,
-            )
+        for figure in self.elements.find_all(soup, ["figure"]):
+            self.render_figure_element(figure, **kwargs)
         return soup
 
+    def render_figure_element(self, figure: Tag, **kwargs):
+        if get_class(figure, "mermaid-figure"):
+            return
+        image = figure.find("img")
+        if not image:
+            raise ValueError(f"Missing image in figure {figure}")
+        image_src = image.get("src")
+        if not image_src:
+            raise ValueError(f"Missing src in image {image}")
+        if is_valid_url(image_src):
+            # Fetched once the page is rendered
+            filename = None
+        else:
+            filepath = resolve_asset_path(
+                kwargs.get("file_path", Path()), image_src
+            )
+            if not filepath:
+                raise ValueError(f"Image not found: {image_src}")
+            match filepath.suffix:
+                case ".svg":
+                    filename = self.convert_later(
+                        "svg2pdf",
+                        get_svg_pdf_name(filepath, self.output_path),
+                        filepath,
+                        self.output_path,
+                    )
+                    self.assets_map[filename] = {"type": "svg", "source": filepath}
+                case ".drawio":
+                    # Figures are exported together once all pages
+                    # are rendered, see convert_pending
+                    job = get_drawio_job(filepath, self.output_path)
+                    filename = job["pdf"]
+                    if not filename.exists():
+                        self.drawings.append(job)
+                    self.assets_map[filename] = {
+                        "type": "drawio",
+                        "source": filepath,
+                    }
+                case _:
+                    output, pixels = get_raster_job(
+                        filepath,
+                        self.output_path,
+                        get_printed_width(image.get("width")),
+                        self.config.image_dpi,
+                    )
+                    filename = self.convert_later(
+                        "image2raster", output, filepath, output, pixels
+                    )
+                    self.assets_map[filename] = {
+                        "type": "image",
+                        "source": filepath,
+                    }
+        caption = figure.find("figcaption")
+        short_caption = image.get("alt", "")
+        self.render_inlines(caption)
+        caption_text = self.get_safe_text(caption) if caption else short_caption
+
+        if short_caption and len(caption) > len(short_caption):
+            short_caption = None
+
+        width = image.get("width", None)
+
+        label = None
+        if label_id := figure.get("id"):
+            label = f"{label_id}"
+
+        template = (
+            "figure_tcolorbox" if kwargs.get("tcolorbox", False) else "figure"
+        )
+        options = {
+            "caption": caption_text,
+            "shortcaption": short_caption,
+            "label": label,
+            "width": width,
+        }
+        if filename is None:
+            asset = {"type": "image", "source": image_src}
+            self.fetch_later(figure, image_src, asset, template, **options)
+        else:
+            self.apply(figure, template, path=filename.name, **options)
+
     def get_table_styles(self, cell):
         if not cell:
             return ""
@@ -822,58 +1139,61 @@ class LaTeXRenderer:
             ]
         }
         """
-        for table in soup.find_all(["table"]):
-            if caption_element := table.find("caption"):
-                caption_element = self.render_inlines(caption_element, **kwargs)
-                caption = self.get_safe_text(caption_element)
-                caption_element.extract()
-            else:
-                caption = None
-
-            label = None
-            if label_id := table.get("id"):
-                label = f"{label_id}"
-
-            table_data = []
-            styles = []
-            is_large = False
-            for row in table.find_all("tr"):
-                row_data = []
-                row_styles = []
-                cells = row.find_all(["td", "th"])
-                for cell in cells:
-                    self.render_inlines(cell)
-                    row_data.append(self.get_safe_text(cell).strip())
-                    row_styles.append(self.get_table_styles(cell))
-
-                # We already have rendered some LaTeX, so to have an idea of the table width
-                # we simply strip the LaTeX commands and count the characters...
-                # Ugly? yes.
-                is_large |= (
-                    len(
-                        "".join(
-                            [
-                                re.sub(r"\\href\{[^\}]+?\}|\\\w{3,}|[\{\}|]", "", col)
-                                for col in row_data
-                            ]
-                        )
+        for table in self.elements.find_all(soup, ["table"]):
+            self.render_table_element(table, **kwargs)
+
+    def render_table_element(self, table: Tag, **kwargs):
+        if caption_element := table.find("caption"):
+            caption_element = self.render_inlines(caption_element, **kwargs)
+            caption = self.get_safe_text(caption_element)
+            self.elements.extract(caption_element)
+        else:
+            caption = None
+
+        label = None
+        if label_id := table.get("id"):
+            label = f"{label_id}"
+
+        table_data = []
+        styles = []
+        is_large = False
+        for row in table.find_all("tr"):
+            row_data = []
+            row_styles = []
+            cells = row.find_all(["td", "th"])
+            for cell in cells:
+                self.render_inlines(cell)
+                row_data.append(self.get_safe_text(cell).strip())
+                row_styles.append(self.get_table_styles(cell))
+
+            # We already have rendered some LaTeX, so to have an idea of the table width
+            # we simply strip the LaTeX commands and count the characters...
+            # Ugly? yes.
+            is_large |= (
+                len(
+                    "".join(
+                        [
+                            re.sub(r"\\href\{[^\}]+?\}|\\\w{3,}|[\{\}|]", "", col)
+                            for col in row_data
+                        ]
                     )
-                    > 50
                 )
-
-                table_data.append(row_data)
-                styles.append(row_styles)
-
-            self.apply(
-                table,
-                "table",
-                columns=styles[0],
-                rows=table_data,
-                caption=caption,
-                label=label,
-                is_large=is_large,
+                > 50
             )
 
+            table_data.append(row_data)
+            styles.append(row_styles)
+
+        self.apply(
+            table,
+            "table",
+            columns=styles[0],
+            rows=table_data,
+            caption=caption,
+            label=label,
+            is_large=is_large,
+        )
+
     def process_exercise(self, soup: Tag, title, **kwargs):
         """Extract solution from exercise if found, to render later as a solution."""
         if not get_class(soup, "exercise"):
@@ -900,10 +1220,11 @@ class LaTeXRenderer:
             for el in gaps:
                 correct_value = el.get("answer")
                 answers.append(correct_value)
+                self.elements.remove(el)
                 el.replace_with(f"\\rule{{{len(correct_value)}ex}}{{0.4pt}}")
             answer = f"Réponse{'' if len(answers) == 1 else 's'}: {', '.join(answers)}"
         if el := soup.find("p", "align--right"):
-            el.extract()
+            self.elements.extract(el)
 
         # Extract solution if found
         solution_label = f"sol:{self.exercise_counter}"
@@ -912,7 +1233,7 @@ class LaTeXRenderer:
         solution = ""
         if solution_el := soup.find("details", class_=["solution"]):
             if solution_el.find("summary"):
-                solution_el.find("summary").extract()
+                self.elements.extract(solution_el.find("summary"))
             solution_el = self.render_after(
                 self.render_admonition, solution_el, **kwargs
             )
@@ -932,177 +1253,195 @@ class LaTeXRenderer:
 
     def render_admonition(self, soup: Tag, **kwargs):
         # Admonitions with callout
-        for admonition in soup.find_all(["div"], class_="admonition"):
-            if not admonition.parent:
-                continue
+        for admonition in self.elements.find_all(soup, ["div"], ["admonition"]):
+            if admonition.parent:
+                self.render_admonition_element(admonition, **kwargs)
+
+        # Foldable admonitions are implemented with details/summary
+        for admonition in self.elements.find_all(soup, ["details"]):
+            if admonition.parent:
+                self.render_details_element(admonition, **kwargs)
+        return soup
 
-            classes = admonition.get("class", [])
-            filtered_classes = [
-                cls
-                for cls in classes
-                if cls
-                not in [
-                    "admonition",
-                    "annotate",
-                    "inline",
-                    "end",
-                    "left",
-                    "right",
-                    "checkbox",
-                    "fill-in-the-blank",
-                ]
+    def render_admonition_element(self, admonition: Tag, **kwargs):
+        classes = admonition.get("class", [])
+        filtered_classes = [
+            cls
+            for cls in classes
+            if cls
+            not in [
+                "admonition",
+                "annotate",
+                "inline",
+                "end",
+                "left",
+                "right",
+                "checkbox",
+                "fill-in-the-blank",
             ]
-            if len(filtered_classes) > 1:
-                raise ValueError(f"Multiple classes in admonition: {filtered_classes}")
-            admonition_type = filtered_classes[0]
-            if title_node := admonition.find("p", class_="admonition-title"):
-                if label := title_node.find("span", class_="exercise-label"):
-                    # label_text = self.get_safe_text(label)
-                    label.extract()
+        ]
+        if len(filtered_classes) > 1:
+            raise ValueError(f"Multiple classes in admonition: {filtered_classes}")
+        admonition_type = filtered_classes[0]
+        if title_node := admonition.find("p", class_="admonition-title"):
+            if label := title_node.find("span", class_="exercise-label"):
+                # label_text = self.get_safe_text(label)
+                self.elements.extract(label)
 
-                title = self.get_safe_text(title_node)
-                title_node.extract()
+            title = self.get_safe_text(title_node)
+            self.elements.extract(title_node)
 
-            # Treat figures in admonitions differently
-            # Tcolorbox does not support figure environments
-            admonition = self.render_figure(admonition, tcolorbox=True, **kwargs)
-            admonition = self.render_mermaid(admonition, tcolorbox=True, **kwargs)
+        # Treat figures in admonitions differently
+        # Tcolorbox does not support figure environments
+        admonition = self.render_figure(admonition, tcolorbox=True, **kwargs)
+        admonition = self.render_mermaid(admonition, tcolorbox=True, **kwargs)
 
-            admonition, title = self.process_exercise(admonition, title, **kwargs)
+        admonition, title = self.process_exercise(admonition, title, **kwargs)
 
-            admonition = self.render_after(self.render_admonition, admonition, **kwargs)
-            content = self.get_safe_text(admonition)
+        admonition = self.render_after(self.render_admonition, admonition, **kwargs)
+        content = self.get_safe_text(admonition)
 
-            self.apply(
-                admonition, "callout", content, title=title, type=admonition_type
-            )
+        self.apply(admonition, "callout", content, title=title, type=admonition_type)
 
-        # Foldable admonitions are implemented with details/summary
-        for admonition in soup.find_all(["details"]):
-            if not admonition.parent:
-                continue
-            classes = admonition.get("class", [])
-            if len(classes) > 1:
-                raise ValueError(f"Multiple classes in details: {classes}")
-            admonition_type = classes[0]
+    def render_details_element(self, admonition: Tag, **kwargs):
+        classes = admonition.get("class", [])
+        if len(classes) > 1:
+            raise ValueError(f"Multiple classes in details: {classes}")
+        admonition_type = classes[0]
 
-            if summary := admonition.find("summary"):
-                title = self.get_safe_text(summary)
-                summary.extract()
+        if summary := admonition.find("summary"):
+            title = self.get_safe_text(summary)
+            self.elements.extract(summary)
 
-            # Treat figures in admonitions differently
-            # Tcolorbox does not support figure environments
-            admonition = self.render_figure(admonition, tcolorbox=True, **kwargs)
-            admonition = self.render_mermaid(admonition, tcolorbox=True, **kwargs)
+        # Treat figures in admonitions differently
+        # Tcolorbox does not support figure environments
+        admonition = self.render_figure(admonition, tcolorbox=True, **kwargs)
+        admonition = self.render_mermaid(admonition, tcolorbox=True, **kwargs)
 
-            admonition = self.render_after(self.render_admonition, admonition, **kwargs)
-            content = self.get_safe_text(admonition)
+        admonition = self.render_after(self.render_admonition, admonition, **kwargs)
+        content = self.get_safe_text(admonition)
 
-            self.apply(
-                admonition, "callout", content, title=title, type=admonition_type
-            )
-        return soup
+        self.apply(admonition, "callout", content, title=title, type=admonition_type)
 
     def render_links(self, soup: Tag, **kwargs):
-        for el in soup.find_all("a"):
-            self.render_inlines(el)
-            self.render_abbreviation(el)
-            text = self.get_safe_text(el)
-            href = el.get("href", "")
-            if href.startswith("http"):
-                if href in self.wikimap:
-                    data = self.wikimap[href]
-                    key = f"wiki:{data['key']}"
-                    self.glossary[key] = {
-                        "name": escape_latex_chars(data["title"]),
-                        "description": (
-                            f'{escape_latex_chars(data["extract"])} '
-                            f'\\newline(\\url{{{escape_latex_chars(data["plainlink"])}}})'
-                        ),
-                    }
-                    self.apply(el, "glossary", key=key)
-                    continue
+        for el in self.elements.find_all(soup, ["a"]):
+            self.render_link_element(el, **kwargs)
+        return soup
 
-                href = escape_latex_chars(safe_quote(el.get("href")))
-                self.apply(el, "href", text=text, url=href)
-            elif href.startswith("#"):
-                self.apply(el, "ref", text, ref=href[1:])
-            elif href == "" and el.get("id"):
-                self.apply(el, "label", el.get("id"))
-            elif path := resolve_asset_path(kwargs.get("file_path", Path()), href):
-                with open(path, "rb") as f:
-                    content = f.read()
-                    digest = sha256().hexdigest()
-                reference = f"snippet:{digest}"
-                self.snippets[reference] = {
-                    "path": path,
-                    "content": content,
-                    "format": path.suffix[1:],
+    def render_link_element(self, el: Tag, **kwargs):
+        self.render_inlines(el)
+        self.render_abbreviation(el)
+        text = self.get_safe_text(el)
+        href = el.get("href", "")
+        if href.startswith("http"):
+            if href in self.wikimap:
+                data = self.wikimap[href]
+                key = f"wiki:{data['key']}"
+                self.glossary[key] = {
+                    "name": escape_latex_chars(data["title"]),
+                    "description": (
+                        f'{escape_latex_chars(data["extract"])} '
+                        f'\\newline(\\url{{{escape_latex_chars(data["plainlink"])}}})'
+                    ),
                 }
-                self.apply(el, "ref", text="extrait", ref=reference)
-            else:
-                raise NotImplementedError("Local links not implemented")
-        return soup
+                self.apply(el, "glossary", key=key)
+                return
+
+            href = escape_latex_chars(safe_quote(el.get("href")))
+            self.apply(el, "href", text=text, url=href)
+        elif href.startswith("#"):
+            self.apply(el, "ref", text, ref=href[1:])
+        elif href == "" and el.get("id"):
+            self.apply(el, "label", el.get("id"))
+        elif path := resolve_asset_path(kwargs.get("file_path", Path()), href):
+            with open(path, "rb") as f:
+                content = f.read()
+                digest = sha256().hexdigest()
+            reference = f"snippet:{digest}"
+            self.snippets[reference] = {
+                "path": path,
+                "content": content,
+                "format": path.suffix[1:],
+            }
+            self.apply(el, "ref", text="extrait", ref=reference)
+        else:
+            raise NotImplementedError("Local links not implemented")
 
     def render_columns(self, soup: Tag, **kwargs):
-        for div in soup.find_all(["div"], class_="two-column-list"):
-            div = self.render_after(self.render_columns, div, **kwargs)
-            self.apply(div, "multicolumn", self.get_safe_text(div), columns=2)
+        for div in self.elements.find_all(soup, ["div"], ["two-column-list"]):
+            self.render_columns_element(div, **kwargs)
+
+        for div in self.elements.find_all(soup, ["div"], ["three-column-list"]):
+            self.render_columns_element(div, **kwargs)
 
-        for div in soup.find_all(["div"], class_="three-column-list"):
-            div = self.render_after(self.render_columns, div, **kwargs)
-            self.apply(div, "multicolumn", self.get_safe_text(div), columns=3)
+    def render_columns_element(self, div: Tag, **kwargs):
+        columns = 2 if "two-column-list" in div.get("class", []) else 3
+        div = self.render_after(self.render_columns, div, **kwargs)
+        self.apply(div, "multicolumn", self.get_safe_text(div), columns=columns)
 
     def render_inlines(self, soup: Tag, **kwargs):
         """Replace all inline elements."""
-
-        self.render_autoref(soup)
-        self.render_links(soup)
-        self.render_index(soup)
-        self.render_columns(soup)
-        self.render_table(soup)
-        self.render_abbreviation(soup)
-        self.render_critics(soup)
-        self.render_format(soup)
-        self.render_paragraph(soup)
+        if all(isinstance(c, NavigableString) for c in soup.children):
+            return soup  # Already rendered
+
+        with tracer.span("render_inlines", "pass"):
+            self.render_autoref(soup)
+            self.render_links(soup)
+            self.render_index(soup)
+            self.render_columns(soup)
+            self.render_table(soup)
+            self.render_abbreviation(soup)
+            self.render_critics(soup)
+            self.render_format(soup)
+            self.render_paragraph(soup)
         return soup
 
     def render_index(self, soup: Tag, **kwargs):
         """Render index entries"""
-        for el in soup.find_all("span", class_="ycr-hashtag"):
-            text = self.get_safe_text(el)
-            tag = el.get("data-tag")
-            entry = el.get("data-index-entry", text if text else tag)
-            entry = escape_latex_chars(entry)
-            self.apply(el, "index", text, tag=tag, entry=entry)
+        for el in self.elements.find_all(soup, ["span"], ["ycr-hashtag"]):
+            self.render_index_element(el)
         return soup
 
+    def render_index_element(self, el: Tag, **kwargs):
+        text = self.get_safe_text(el)
+        tag = el.get("data-tag")
+        entry = el.get("data-index-entry", text if text else tag)
+        entry = escape_latex_chars(entry)
+        self.apply(el, "index", text, tag=tag, entry=entry)
+
     def render_paragraph(self, soup: Tag, **kwargs):
-        for p in soup.find_all("p", class_=False):
-            p = self.render_inlines(p)
-            text = self.get_safe_text(p)
-            p.replace_with(text + "\n")
+        for p in self.elements.find_all(soup, ["p"], False):
+            self.render_paragraph_element(p)
+
+    def render_paragraph_element(self, p: Tag, **kwargs):
+        p = self.render_inlines(p)
+        text = self.get_safe_text(p)
+        self.elements.remove(p)
+        p.replace_with(text + "\n")
 
     def render_grid_cards(self, soup: Tag, **kwargs):
-        for div in soup.find_all(["div"], class_="grid-cards"):
-            div.unwrap()
+        for div in self.elements.find_all(soup, ["div"], ["grid-cards"]):
+            self.elements.unwrap(div)
 
     def render_hr(self, soup: Tag, **kwargs):
-        for el in soup.find_all("hr"):
-            el.extract()
+        for el in self.elements.find_all(soup, ["hr"]):
+            self.elements.extract(el)
         return soup
 
     def render_br(self, soup: Tag, **kwargs):
-        for el in soup.find_all("br"):
-            node = NavigableString("\\")
-            node.processed = True
-            el.replace_with(node)
+        for el in self.elements.find_all(soup, ["br"]):
+            self.render_br_element(el)
         return soup
 
+    def render_br_element(self, el: Tag, **kwargs):
+        self.replace_latex(el, "\\")
+
     def render_after(self, function, soup: Tag, **kwargs):
         index = self.renderering_order.index(function)
-        for render in self.renderering_order[index:]:
-            render(soup, **kwargs)
+        with tracer.span("render_after", "pass", after=function.__name__):
+            for render in self.renderering_order[index:]:
+                with tracer.span(render.__name__, "pass"):
+                    render(soup, **kwargs)
         return soup
 
     def get_list_acronyms(self):
@@ -1125,48 +1464,78 @@ class LaTeXRenderer:
             tex += self.formatter.codeblock(data["content"], language=data["format"])
         return tex
 
-    def monkeypatch_item(self, latex: str):
-        """Verbatim material should not go in the argument to other commands.
-        In some cases mintinline works, but you cannot expect it always does.
-
-        Solution: reduce to a case where mintinline works inside arguments,
-        because the code has already been absorbed verbatim.
-        """
-        latex = re.sub(
-            r"(\\item\[\\mintinline)(\{[^\}]+\}|.*?|)(\])", r"\\minteditem\2", latex
-        )
-        return latex
-
-    def monkeypatch_caption(self, latex: str):
-        """Caption plugin defines labels for each figures, they are note
-        meant to be cross-documents and we don't really use them in LaTeX.
-        """
-        return re.sub(r"\\label\{_(?:figure|table)-\d+\}", "", latex)
-
-    def monkeypatch_hyphenation(self, latex: str):
-        """TeX will not hyphenate past an explicit hyphen, unless you
-        explicitly tell it to.
-
-        This has to be applied only in plain text and not in code blocks.
-
-        https://tex.stackexchange.com/a/723596/85416
-
-        This patch is very naive and will not work in all cases.
-        """
-        if len(latex) < 50:
-            return latex
-
-        return re.sub(
-            r"(\b[^\W\d_]{2,}-)([^\W\d_]{7,})\b", r"\1\\allowhyphens \2", latex
-        )
-
     def render_elements(self, soup: Tag, **kwargs):
         start = kwargs.get("ordered_item", 0)
 
         for i, render in enumerate(self.renderering_order[start:]):
-            render(soup, **kwargs)
+            with tracer.span(render.__name__, "pass"):
+                render(soup, **kwargs)
+        return soup
+
+    def render_visitor(self, soup: Tag, **kwargs):
+        """Render the elements in a single traversal of the tree, each
+        node with its handler of VISITOR_HANDLERS."""
+        end = len(VISITOR_HANDLERS)
+        with tracer.span("render_visitor", "pass"):
+            # Footnotes are referred to before they are defined
+            for el in self.elements.find_all(soup, ["div"], ["footnote"]):
+                self.visit(el, 0, end, kwargs)
+            self.visit(soup, 0, end, kwargs)
         return soup
 
+    def get_handler(self, node: PageElement, low: int):
+        """First handler of priority `low` or above matching a node."""
+        for handler in self.handlers.get(node.name, ()):
+            priority, classes, attribute, nested, method = handler
+            if priority < low:
+                continue
+            if classes is False:
+                if "class" in node.attrs:
+                    continue
+            elif classes and not any(c in classes for c in node.get("class", ())):
+                continue
+            if attribute and not node.has_attr(attribute):
+                continue
+            return handler
+        return None
+
+    def visit(self, node: PageElement, low: int, high: int, kwargs: dict):
+        """Render a node and its descendants with the handlers of priority
+        `low` to `high` (excluded). Descendants are rendered first, up to
+        the priority of the handler of the node."""
+        handler = self.get_handler(node, low)
+        limit = high
+        if handler and handler[0] < high:
+            limit = handler[0] + handler[3]
+        else:
+            handler = None
+
+        if isinstance(node, Tag) and limit > low:
+            for child in list(node.children):
+                if child.parent is node:
+                    self.visit(child, low, limit, kwargs)
+
+        if handler is None:
+            return
+        priority, _, _, _, method = handler
+        parent = node.parent
+        previous, following = node.previous_sibling, node.next_sibling
+        method(node, **kwargs)
+
+        # Content unwrapped into the parent is left to the next handlers
+        if node.parent is not None or not isinstance(node, Tag) or node.contents:
+            return
+        if previous is not None:
+            child = previous.next_sibling
+        else:
+            child = next(iter(parent), None)
+        exposed = []
+        while child is not None and child is not following:
+            exposed.append(child)
+            child = child.next_sibling
+        for child in exposed:
+            self.visit(child, priority, high, kwargs)
+
     def render(
         self,
         html,
@@ -1176,24 +1545,38 @@ class LaTeXRenderer:
         numbered=True,
         drop_title=False,
     ):
-        soup = BeautifulSoup(html, "html.parser")
+        soup = parse_html(html, self.parser)
+        self.elements = ElementIndex(soup)
+
+        # Text nodes outside code are escaped in a single pass
+        strings = [
+            el
+            for el in self.elements.find_all(soup, [None])
+            if not self.elements.in_code(el)
+        ]
+        texts = escape_texts([el.get_text() for el in strings])
+        self.texts = dict(zip(map(id, strings), texts))
 
         kwargs = {
             "file_path": file_path,
             "output_path": output_path,
             "base_level": base_level,
             "numbered": numbered,
-            "drop_title": drop_title,
         }
 
-        self.render_elements(soup, **kwargs)
+        # The first heading is dropped, footnotes are collected
+        # before their references are rendered
+        self.drop_title = drop_title
+        self.footnotes = {}
+
+        if self.config.render_engine == "passes":
+            self.render_elements(soup, **kwargs)
+        else:
+            self.render_visitor(soup, **kwargs)
 
         # Unwrap remaining div
         for div in soup.find_all(["div"]):
             div.unwrap()
 
-        latex = unescape(str(soup).replace(" ", "~"))
-
-        latex = self.monkeypatch_item(latex)
-        latex = self.monkeypatch_caption(latex)
-        return latex
+        # Strings are output as they are, they need no unescaping
+        return postprocess_latex(soup.decode(formatter=None))
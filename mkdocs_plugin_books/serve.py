@@ -0,0 +1,64 @@
+""" Background generation of the books during mkdocs serve. """
+
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+log = logging.getLogger("mkdocs")
+
+
+class BackgroundBuilder:
+    """Run the latest submitted build in a background thread.
+
+    Live reload triggers a rebuild on each save, builds submitted
+    while waiting for the debounce delay replace the pending one so
+    only the most recent state of the documentation is rendered.
+    """
+
+    def __init__(self, debounce: float = 1.0):
+        self.debounce = debounce
+        self.condition = threading.Condition()
+        self.task: Optional[Callable] = None
+        self.submitted = 0.0
+        self.running = True
+        self.thread = threading.Thread(
+            target=self._run, name="mkdocs-books", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, task: Callable):
+        with self.condition:
+            self.task = task
+            self.submitted = time.monotonic()
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def _next_task(self):
+        with self.condition:
+            while self.running:
+                if self.task is None:
+                    self.condition.wait()
+                    continue
+                delay = self.submitted + self.debounce - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                task, self.task = self.task, None
+                return task
+        return None
+
+    def _run(self):
+        while task := self._next_task():
+            start = time.monotonic()
+            try:
+                task()
+            except Exception:
+                log.exception("LaTeX generation failed")
+            else:
+                log.info("LaTeX books generated in %.2f seconds", time.monotonic() - start)
@@ -0,0 +1,106 @@
+""" Snapshot of the page HTML and nav of the books.
+
+A snapshot holds everything needed to render the books again without
+running MkDocs and its Markdown extensions: the configuration of each
+book, its nav and the HTML of its pages. Pages shared by several books
+are stored once. The archive is a gzipped JSON file.
+"""
+
+import fnmatch
+import gzip
+import json
+from pathlib import Path
+from typing import List
+
+from mkdocs.config.base import Config
+
+VERSION = 1
+
+
+def config_to_dict(config):
+    """Convert a configuration to plain JSON-serializable values."""
+    if isinstance(config, (Config, dict)):
+        return {key: config_to_dict(value) for key, value in config.items()}
+    if isinstance(config, (list, tuple)):
+        return [config_to_dict(value) for value in config]
+    if isinstance(config, Path):
+        return str(config)
+    return config
+
+
+def dump_nav(item, pages: dict):
+    """Serialize a nav item, HTML of pages is collected in `pages`."""
+    node = {"title": item.title, "is_page": item.is_page}
+    if item.is_page:
+        pages[item.file.src_path] = {
+            "abs_src_path": item.file.abs_src_path,
+            "html": item.content,
+        }
+        node["src_path"] = item.file.src_path
+    else:
+        node["children"] = [dump_nav(child, pages) for child in item.children or []]
+    return node
+
+
+def write_snapshot(path: Path, project_dir: Path, books: list, pages: dict):
+    data = {
+        "version": VERSION,
+        "project_dir": str(project_dir),
+        "books": books,
+        "pages": pages,
+    }
+    with gzip.open(path, "wt", encoding="utf-8") as fp:
+        json.dump(data, fp)
+
+
+def read_snapshot(path: Path) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as fp:
+        data = json.load(fp)
+    if data.get("version") != VERSION:
+        raise ValueError(f"Unsupported snapshot version {data.get('version')}")
+    return data
+
+
+class SnapshotFile:
+    """Stand-in for mkdocs.structure.files.File"""
+
+    def __init__(self, src_path: str, abs_src_path: str, page):
+        self.src_path = src_path
+        self.abs_src_path = abs_src_path
+        self.name = Path(src_path).stem
+        self.page = page
+
+
+class SnapshotItem:
+    """Stand-in for the nav items (Section, Page) of MkDocs"""
+
+    def __init__(self, title: str, parent=None):
+        self.title = title
+        self.parent = parent
+        self.is_page = False
+        self.children = None
+        self.file = None
+        self.content = None
+        self.markdown = None
+
+
+def load_nav(node: dict, pages: dict, patterns: List[str] = (), parent=None):
+    """Rebuild a nav item from a snapshot. If patterns are given only
+    pages matching one of them are kept, empty sections are dropped."""
+    item = SnapshotItem(node["title"], parent)
+    if node["is_page"]:
+        src_path = node["src_path"]
+        if patterns and not any(fnmatch.fnmatch(src_path, p) for p in patterns):
+            return None
+        page = pages[src_path]
+        item.is_page = True
+        item.content = page["html"]
+        item.file = SnapshotFile(src_path, page["abs_src_path"], item)
+        return item
+
+    children = [load_nav(child, pages, patterns, item) for child in node["children"]]
+    item.children = [child for child in children if child is not None]
+    if patterns and not item.children:
+        return None
+    return item
+
@@ -0,0 +1,149 @@
+""" Processing of the text of the pages.
+
+Text nodes are escaped for LaTeX with one precompiled regex matching
+every special character, and get hyphenation hints from another. The
+text nodes of a page are processed in batch: they are joined, escaped
+and split again, which costs one pass over the text of the page instead
+of a few Python calls per node. A regex is faster than str.translate
+here, which is slow with replacements longer than a character.
+
+The LaTeX of a page is post-processed in one pass as well, the regexes
+only run on pages where their literal prefix appears.
+"""
+
+import re
+
+LATEX_ESCAPES = {
+    "&": r"\&",
+    "%": r"\%",
+    "#": r"\#",
+    "$": r"\$",
+    "_": r"\_",
+    "^": r"\^",
+    "{": r"\{",
+    "}": r"\}",
+    "~": r"\textasciitilde{}",
+    "\\": r"\textbackslash{}",
+}
+RE_LATEX_CHARS = re.compile("|".join(map(re.escape, LATEX_ESCAPES)))
+
+# Fractions of the SmartSymbols extension, see replace_litterals
+LITTERALS = str.maketrans({
+    "½": "\\nicefrac{1}{2}",
+    "¼": "\\nicefrac{1}{4}",
+    "¾": "\\nicefrac{3}{4}",
+    "⅓": "\\nicefrac{1}{3}",
+    "⅔": "\\nicefrac{2}{3}",
+    "⅛": "\\nicefrac{1}{8}",
+    "⅜": "\\nicefrac{3}{8}",
+    "⅝": "\\nicefrac{5}{8}",
+    "⅞": "\\nicefrac{7}{8}",
+    "⅕": "\\nicefrac{1}{5}",
+    "⅖": "\\nicefrac{2}{5}",
+    "⅗": "\\nicefrac{3}{5}",
+    "⅘": "\\nicefrac{4}{5}",
+    "⅙": "\\nicefrac{1}{6}",
+    "⅚": "\\nicefrac{5}{6}",
+})
+RE_FRACTION = re.compile(r"\b(\d+)\/(\d+)\b")
+
+# TeX will not hyphenate past an explicit hyphen, unless you explicitly
+# tell it to: https://tex.stackexchange.com/a/723596/85416
+# Very naive, only applied to the text nodes long enough.
+RE_HYPHENATION = re.compile(r"(\b[^\W\d_]{2,}-)([^\W\d_]{7,})\b")
+HYPHENATION_MIN_LENGTH = 50
+
+# Text nodes are joined with a character HTML parsers never produce
+SEPARATOR = "\x00"
+
+THIN_SPACE = "\u2009"
+
+# Verbatim material should not go in the argument of other commands,
+# mintinline works inside arguments once absorbed by \minteditem
+RE_MINTED_ITEM = re.compile(r"(\\item\[\\mintinline)(\{[^\}]+\}|.*?|)(\])")
+
+# Labels of the caption extension are not meant to be cross-documents
+RE_CAPTION_LABEL = re.compile(r"\\label\{_(?:figure|table)-\d+\}")
+
+
+def escape_latex_chars(text: str) -> str:
+    r"""Escape LaTeX special characters.
+
+    >>> escape_latex_chars("Hello & {World}")
+    'Hello \\& \\{World\\}'
+    >>> print(escape_latex_chars(r"~\o/"))
+    \textasciitilde{}\textbackslash{}o/
+    """
+    return RE_LATEX_CHARS.sub(_escape_latex_char, text)
+
+
+def _escape_latex_char(match: re.Match) -> str:
+    return LATEX_ESCAPES[match[0]]
+
+
+def allow_hyphenation(text: str) -> str:
+    """Let TeX hyphenate the words following a hyphen.
+
+    >>> allow_hyphenation("Une analyse du comportement des systèmes "
+    ...                   "semi-conducteurs")[-30:]
+    'semi-\\\\allowhyphens conducteurs'
+    """
+    if len(text) < HYPHENATION_MIN_LENGTH:
+        return text
+    return RE_HYPHENATION.sub(r"\1\\allowhyphens \2", text)
+
+
+def escape_text(text: str) -> str:
+    """LaTeX of a text node."""
+    return allow_hyphenation(escape_latex_chars(text))
+
+
+def escape_texts(texts: list) -> list:
+    """LaTeX of text nodes, same as escape_text on each of them.
+
+    >>> escape_texts(["50%", "", "a_b"])
+    ['50\\\\%', '', 'a\\\\_b']
+    """
+    if not texts:
+        return []
+    joined = SEPARATOR.join(texts)
+    if joined.count(SEPARATOR) != len(texts) - 1:
+        return [escape_text(text) for text in texts]
+
+    escaped = escape_latex_chars(joined).split(SEPARATOR)
+
+    long = [
+        i
+        for i, text in enumerate(escaped)
+        if len(text) >= HYPHENATION_MIN_LENGTH and "-" in text
+    ]
+    if long:
+        joined = SEPARATOR.join(escaped[i] for i in long)
+        hyphenated = RE_HYPHENATION.sub(r"\1\\allowhyphens \2", joined)
+        for i, text in zip(long, hyphenated.split(SEPARATOR)):
+            escaped[i] = text
+    return escaped
+
+
+def replace_litterals(text: str) -> str:
+    r"""Replace the litterals of the SmartSymbols extension unsupported
+    by LaTeX.
+
+    >>> print(replace_litterals("½ cup, 3/4 hour"))
+    \nicefrac{1}{2} cup, \nicefrac{3}{4} hour
+    """
+    return RE_FRACTION.sub(r"\\nicefrac{\1}{\2}", text.translate(LITTERALS))
+
+
+def postprocess_latex(latex: str) -> str:
+    r"""Last fixes on the LaTeX of a page.
+
+    >>> print(postprocess_latex("\\item[\\mintinline{c}{x}] a\u2009b"))
+    \minteditem{c}{x} a~b
+    """
+    latex = latex.replace(THIN_SPACE, "~")
+    if "\\item[\\mintinline" in latex:
+        latex = RE_MINTED_ITEM.sub(r"\\minteditem\2", latex)
+    if "\\label{_" in latex:
+        latex = RE_CAPTION_LABEL.sub("", latex)
+    return latex
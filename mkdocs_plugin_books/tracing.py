@@ -0,0 +1,116 @@
+""" Timing trace of the LaTeX generation.
+
+Spans are recorded in the Chrome trace-event format, the exported
+file can be opened in Perfetto (https://ui.perfetto.dev) or in
+chrome://tracing.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        event = {
+            "name": self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": self.start / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if self.args:
+            event["args"] = self.args
+        self.tracer.events.append(event)
+        return False
+
+
+class Tracer:
+    """Record spans when enabled, otherwise spans cost a method call."""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+
+    def span(self, name: str, category: str, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def traced(self, category: str):
+        """Decorator recording a span for each call of a function."""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(function.__name__, category):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def pop_events(self):
+        events, self.events = self.events, []
+        return events
+
+    def export(self, path: Path):
+        data = {"traceEvents": self.events, "displayTimeUnit": "ms"}
+        Path(path).write_text(json.dumps(data))
+
+    def summary(self, count: int = 20) -> str:
+        """Plain text report of the slowest pages and render passes.
+        Passes are nested (render_inlines, render_after...), their
+        times are inclusive."""
+        pages = sorted(
+            (e for e in self.events if e["cat"] == "page"),
+            key=lambda e: e["dur"],
+            reverse=True,
+        )
+        passes = defaultdict(lambda: [0.0, 0])
+        for event in self.events:
+            if event["cat"] in ("pass", "asset", "template"):
+                passes[(event["cat"], event["name"])][0] += event["dur"]
+                passes[(event["cat"], event["name"])][1] += 1
+        passes = sorted(passes.items(), key=lambda item: item[1][0], reverse=True)
+
+        lines = [f"Slowest pages (top {count}):"]
+        for event in pages[:count]:
+            lines.append(f"  {event['dur'] / 1000:10.2f} ms  {event['name']}")
+        lines.append(f"Slowest passes (top {count}):")
+        for (category, name), (duration, calls) in passes[:count]:
+            lines.append(
+                f"  {duration / 1000:10.2f} ms  {calls:6d} calls  {category}:{name}"
+            )
+        return "\n".join(lines)
+
+
+tracer = Tracer()
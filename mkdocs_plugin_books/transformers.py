@@ -1,27 +1,46 @@
-""" This module contains functions to convert various formats to PDF. """
+""" This module contains functions to convert various formats to PDF.
+
+Converters import their libraries (cairosvg, Pillow, pypdf) on their
+first call, importing the plugin does not pay for them.
+"""
 
 import logging
-import mimetypes
 import os
 import re
+import shutil
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
-from io import BytesIO
 from math import ceil
 from pathlib import Path
-from typing import Union
+from functools import lru_cache
+from typing import TYPE_CHECKING, Union
+
+from .digests import get_asset_filename, get_digest, get_file_digest
+from .tracing import tracer
 
-import cairosvg
-import pillow_avif  # noqa
-import pypdf
-import requests
-import unidecode
-from PIL import Image
+if TYPE_CHECKING:
+    import pypdf
 
 log = logging.getLogger("mkdocs")
 
-pillow_supported_types = Image.registered_extensions().keys()
+
+def open_image(filename):
+    """Open an image with Pillow, AVIF images are supported."""
+    import pillow_avif  # noqa
+    from PIL import Image
+
+    return Image.open(filename)
+
+
+@lru_cache(maxsize=None)
+def get_pillow_extensions() -> frozenset:
+    """Extensions of the image formats Pillow can open."""
+    import pillow_avif  # noqa
+    from PIL import Image
+
+    return frozenset(Image.registered_extensions())
 
 
 def get_filename_from_content(content: Union[str, bytes], output_path: Path) -> Path:
@@ -36,71 +55,116 @@ def get_filename_from_content(content: Union[str, bytes], output_path: Path) ->
     return output_path / digest
 
 
-def up_to_date(source: Path, destination: Path) -> bool:
-    """Check if a file is up to date.
-    Does not work well with GitHub Actions cache.
-    """
-    return (
-        destination.exists() and destination.stat().st_mtime >= source.stat().st_mtime
-    )
-
-
 def points_to_mm(points):
     return points * 25.4 / 72
 
 
-def fetch_image(url: str, output_path: Path) -> Path:
-    """Fetch an image from an URL and store it in the output path.
-    If the image already exists, it will not be fetched again.
-    """
-    response = requests.head(url, timeout=10)
-    if response.status_code != 200:
-        raise ValueError(f"Failed to fetch image: {response.status_code}")
-
-    mime_type = response.headers["Content-Type"]
-    etag = response.headers.get("ETag")
-    extension = mimetypes.guess_extension(mime_type)
-    if not extension:
-        raise ValueError(f"Unknown mime type: {mime_type}")
-
-    filename = get_filename_from_content(
-        f"ETag:{etag}\0{url}", output_path
-    ).with_suffix(extension + ".pdf")
-
-    if filename.exists():
-        return filename
-
-    # Fetch file
-    response = requests.get(url, timeout=10)
-    if response.status_code != 200:
-        raise ValueError(f"Failed to fetch image: {response.status_code}")
-
-    # SVG case
-    if extension == ".svg":
-        filename = svg2pdf(response.content, output_path)
-        return filename
-    elif extension in pillow_supported_types:
-        image = Image.open(BytesIO(response.content))
-        image.convert("RGB").save(filename, "PDF")
-    else:
-        raise ValueError(
-            f"Unsupported image type: {extension}, cannot be converted to PDF"
-        )
-
-    return filename
+def get_image_pdf_name(filename: Path, output_path=Path()) -> Path:
+    digest = get_file_digest(filename)
+    return get_asset_filename("image2pdf", digest, output_path, ".pdf")
 
 
+@tracer.traced("asset")
 def image2pdf(filename, output_path=Path()):
-    pdfpath = get_filename_from_content(filename, output_path).with_suffix(".pdf")
+    pdfpath = get_image_pdf_name(filename, output_path)
 
     if not pdfpath.exists():
         log.info("Converting %s to PDF...", filename)
-        image = Image.open(filename)
+        image = open_image(filename)
         image.save(pdfpath, "PDF")
 
     return pdfpath
 
 
+# Width of the text block, see render_mermaid_figure
+LINEWIDTH_MM = 140
+
+RE_LENGTH = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(%|mm|cm|in|pt|px)?\s*$")
+
+# Plain widths of HTML images are CSS pixels
+MM_PER_UNIT = {"mm": 1, "cm": 10, "in": 25.4, "pt": 25.4 / 72.27, "px": 25.4 / 96}
+
+# Raster formats included as is by the LaTeX engines
+PASSTHROUGH_FORMATS = {"JPEG": ".jpg", "PNG": ".png"}
+
+
+def get_printed_width(width: str = None) -> float:
+    """Printed width in mm of a figure given its width attribute, the
+    width of the text block if unknown.
+
+    >>> get_printed_width("50%")
+    70.0
+    >>> get_printed_width("96")
+    25.4
+    >>> get_printed_width(None)
+    140
+    """
+    match = RE_LENGTH.match(width or "")
+    if not match:
+        return LINEWIDTH_MM
+    value, unit = float(match.group(1)), match.group(2) or "px"
+    if unit == "%":
+        return LINEWIDTH_MM * value / 100
+    return value * MM_PER_UNIT[unit]
+
+
+def get_raster_job(filename: Path, output_path: Path, width_mm: float, dpi: int):
+    """Output of a raster image printed `width_mm` wide, and the width in
+    pixels it must be downsampled to (0 to keep it). JPEG and PNG images
+    with no more pixels than needed at `dpi` are included as is, other
+    formats are converted to PNG if they are transparent, to JPEG
+    otherwise."""
+    with open_image(filename) as image:
+        size, image_format = image.size, image.format
+        transparent = image.mode in ("RGBA", "LA", "P") or "transparency" in image.info
+
+    width = ceil(width_mm / 25.4 * dpi) if dpi else 0
+    if width >= size[0]:
+        width = 0
+
+    if image_format in PASSTHROUGH_FORMATS:
+        suffix = PASSTHROUGH_FORMATS[image_format]
+    else:
+        suffix = ".png" if transparent else ".jpg"
+
+    digest = get_file_digest(filename)
+    output = get_asset_filename("image2raster", digest, output_path, suffix, width=width)
+    return output, width
+
+
+@tracer.traced("asset")
+def image2raster(filename: Path, output: Path, width: int = 0) -> Path:
+    """Write a raster image as JPEG or PNG, downsampled to `width`
+    pixels if given, see get_raster_job."""
+    if output.exists():
+        return output
+
+    from PIL import Image, ImageOps
+
+    with open_image(filename) as image:
+        if not width and PASSTHROUGH_FORMATS.get(image.format) == output.suffix:
+            shutil.copyfile(filename, output)
+            return output
+
+        log.info("Converting %s to %s...", filename, output.suffix)
+        image = ImageOps.exif_transpose(image)
+        if width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+        temporary = output.with_suffix(".part" + output.suffix)
+        if output.suffix == ".jpg":
+            if image.mode not in ("RGB", "L", "CMYK"):
+                image = image.convert("RGB")
+            image.save(temporary, "JPEG", quality=90, optimize=True)
+        else:
+            if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                image = image.convert("RGBA")
+            image.save(temporary, "PNG", optimize=True)
+        os.replace(temporary, output)
+    return output
+
+
 def get_docker_command(wdir: Path) -> list:
     return [
         "docker",
@@ -118,22 +182,11 @@ def get_docker_command(wdir: Path) -> list:
     ]
 
 
-def mermaid2pdf(
-    content: Union[str, Path], output_path: Path = Path(), **kwargs
-) -> Path:
-    """Converts Mermaid content to PDF using the
-    mermaid-cli docker image."""
-
-    options = []
-
-    if "config_filename" in kwargs:
-        config = Path(kwargs["config_filename"]).read_text("utf-8")
-        config_filename = get_filename_from_content(config, output_path).with_suffix(
-            ".json"
-        )
-        config_filename.write_text(config)
-        options += ["-c", f"{config_filename.name}"]
-
+def get_mermaid_job(
+    content: Union[str, Path], output_path: Path = Path(), config_filename=None
+) -> dict:
+    """Files involved in the conversion of a Mermaid diagram, they
+    are named after the content of the diagram and of its config."""
     if isinstance(content, str) and "\n" not in content:
         log.warning("Assuming content is a filename")
         content = Path(content)
@@ -141,54 +194,248 @@ def mermaid2pdf(
     if isinstance(content, Path):
         content = content.read_text("utf-8")
 
-    mmd_filename = get_filename_from_content(
-        content + "".join(options), output_path
-    ).with_suffix(".mmd")
-
-    if "output" in kwargs:
-        pdf_filename = Path(kwargs["output"])
-    else:
-        pdf_filename = mmd_filename.with_suffix(".mmd.pdf")
-
-        if pdf_filename.exists():
-            return pdf_filename
-
-    # Docker is chrooted, file must be in the working directory
-    mmd_filename.write_text(content)
-
-    log.info("Converting mermaid diagram to PDF...")
+    config = None
+    options = ""
+    if config_filename:
+        config_content = Path(config_filename).read_text("utf-8")
+        config = get_filename_from_content(config_content, output_path).with_suffix(
+            ".json"
+        )
+        options = f"-c{config.name}"
 
-    command = get_docker_command(mmd_filename.parent) + [
+    mmd_filename = get_filename_from_content(content + options, output_path).with_suffix(
+        ".mmd"
+    )
+    return {
+        "content": content,
+        "mmd": mmd_filename,
+        "pdf": mmd_filename.with_suffix(".mmd.pdf"),
+        "config": config,
+        "config_filename": config_filename,
+    }
+
+
+def _write_mermaid_config(job: dict) -> list:
+    """Write the config of a job in the working directory, return
+    the options of mermaid-cli using it."""
+    if not job["config"]:
+        return []
+    config = Path(job["config_filename"]).read_text("utf-8")
+    if not job["config"].exists() or job["config"].read_text("utf-8") != config:
+        job["config"].write_text(config)
+    return ["-c", job["config"].name]
+
+
+def _run_mermaid(wdir: Path, arguments: list) -> bool:
+    # Docker is chrooted, files must be in the working directory
+    command = get_docker_command(wdir) + [
         "minlag/mermaid-cli",
-        "-i",
-        f"{mmd_filename.name}",
+        *arguments,
         "-f",
         "-t",
         "neutral",
-        "-o",
-        f"{pdf_filename.name}",
-        *options,
     ]
-
-    print(" ".join(str(e) for e in command))
-
+    log.debug("Executing: %s", " ".join(str(e) for e in command))
     completed_process = subprocess.run(command, check=False, stderr=subprocess.PIPE)
 
     if completed_process.returncode != 0:
         log.error("Executing: %s", " ".join(str(e) for e in command))
         log.error("Return code %s", completed_process.returncode)
+        for line in completed_process.stderr.splitlines():
+            log.error("mermaid: %s", line.decode(errors="replace"))
+        return False
+    return True
 
-    for line in completed_process.stderr.splitlines():
-        log.error("mermaid: %s", {line.decode()})
 
-    if completed_process.returncode != 0:
+@tracer.traced("asset")
+def mermaid2pdf(
+    content: Union[str, Path], output_path: Path = Path(), **kwargs
+) -> Path:
+    """Converts Mermaid content to PDF using the
+    mermaid-cli docker image."""
+    job = get_mermaid_job(content, output_path, kwargs.get("config_filename"))
+    options = _write_mermaid_config(job)
+
+    if "output" in kwargs:
+        pdf_filename = Path(kwargs["output"])
+    else:
+        pdf_filename = job["pdf"]
+
+        if pdf_filename.exists():
+            return pdf_filename
+
+    job["mmd"].write_text(job["content"])
+
+    log.info("Converting mermaid diagram to PDF...")
+    arguments = ["-i", job["mmd"].name, "-o", pdf_filename.name, *options]
+    if not _run_mermaid(job["mmd"].parent, arguments):
         return None
 
     return pdf_filename
 
 
-def pdf2pdf15(filename: Path, output_path: Path) -> Path:
-    """Convert a PDF to PDF 1.5 format."""
+@tracer.traced("asset")
+def _mermaid2pdf_session(jobs: list) -> list:
+    """Convert diagrams sharing the same config in a single mermaid-cli
+    session. Diagrams are gathered in a Markdown file, mermaid-cli then
+    writes the n-th diagram to <output>-<n>.pdf. Return the failed jobs."""
+    wdir = jobs[0]["pdf"].parent
+    options = _write_mermaid_config(jobs[0])
+    batch = get_filename_from_content(
+        "".join(job["mmd"].name for job in jobs), wdir
+    ).with_suffix(".batch.md")
+    batch.write_text(
+        "".join(f"```mermaid\n{job['content'].rstrip()}\n```\n\n" for job in jobs)
+    )
+
+    log.info("Converting %d mermaid diagrams to PDF...", len(jobs))
+    output = batch.with_suffix(".out.md")
+    arguments = ["-i", batch.name, "-o", output.name, "-e", "pdf", *options]
+    converted = _run_mermaid(wdir, arguments)
+
+    failed = []
+    for i, job in enumerate(jobs, 1):
+        artefact = wdir / f"{output.stem}-{i}.pdf"
+        if converted and artefact.exists():
+            artefact.replace(job["pdf"])
+        else:
+            failed.append(job)
+    for file in (batch, output):
+        file.unlink(missing_ok=True)
+    return failed
+
+
+def mermaid2pdf_batch(jobs: list, sessions: int = 1) -> list:
+    """Convert Mermaid diagrams not converted yet, in at most `sessions`
+    concurrent mermaid-cli sessions, instead of one container and browser
+    per diagram. If a session fails, its diagrams are converted one by
+    one so a faulty diagram does not prevent the others from being
+    converted. Return the jobs that could not be converted."""
+    unique = {}
+    for job in jobs:
+        if not job["pdf"].exists():
+            unique.setdefault(job["pdf"], job)
+    if not unique:
+        return []
+
+    groups = {}
+    for job in unique.values():
+        groups.setdefault(job["config"], []).append(job)
+
+    shards = []
+    for group in groups.values():
+        size = ceil(len(group) / max(1, sessions // len(groups)))
+        shards += [group[i : i + size] for i in range(0, len(group), size)]
+
+    with ThreadPoolExecutor(max(1, sessions)) as pool:
+        retry = [job for failed in pool.map(_mermaid2pdf_session, shards) for job in failed]
+
+        def convert(job):
+            kwargs = {}
+            if job["config"]:
+                kwargs["config_filename"] = job["config_filename"]
+            return mermaid2pdf(job["content"], job["pdf"].parent, **kwargs)
+
+        if retry:
+            log.warning("Converting %d mermaid diagrams one by one", len(retry))
+        failed = [job for job, pdf in zip(retry, pool.map(convert, retry)) if not pdf]
+
+    for job in failed:
+        log.error("Mermaid diagram not rendered:\n%s", job["content"])
+    return failed
+
+
+RE_PDF_HEADER = re.compile(rb"%PDF-(\d+)\.(\d+)")
+
+# Highest PDF version included by the LaTeX engines without a warning
+PDF_VERSION = (1, 5)
+
+# Names of the features introduced after PDF 1.5 (ISO 32000-1, annex H):
+# OpenType fonts, AES encryption, NChannel color spaces, document parts,
+# measures, 3D and watermark annotations, portable collections...
+LATER_PDF_NAMES = frozenset({
+    "/OpenType",
+    "/AESV2",
+    "/AESV3",
+    "/NChannel",
+    "/DPartRoot",
+    "/Measure",
+    "/3D",
+    "/Watermark",
+    "/Collection",
+    "/Requirements",
+    "/RichMedia",
+})
+
+
+def get_pdf_version(filename: Path) -> tuple:
+    """Version of a PDF from its header, None if it is not a PDF."""
+    with open(filename, "rb") as fp:
+        header = fp.read(1024)
+    if match := RE_PDF_HEADER.search(header):
+        return int(match.group(1)), int(match.group(2))
+    return None
+
+
+def _uses_later_pdf_features(reader: "pypdf.PdfReader") -> bool:
+    """Whether the objects of a PDF use a feature of LATER_PDF_NAMES."""
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+
+    seen = set()
+    stack = [reader.trailer]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            if obj.idnum in seen:
+                continue
+            seen.add(obj.idnum)
+            obj = obj.get_object()
+        if isinstance(obj, DictionaryObject):
+            if not LATER_PDF_NAMES.isdisjoint(obj.keys()):
+                return True
+            stack.extend(obj.values())
+        elif isinstance(obj, ArrayObject):
+            stack.extend(obj)
+        elif isinstance(obj, NameObject) and obj in LATER_PDF_NAMES:
+            return True
+    return False
+
+
+def _pdf2pdf15_pypdf(filename: Path, output_path: Path) -> bool:
+    """Relabel a PDF as PDF 1.5 with pypdf, False if it cannot.
+
+    Only the header is changed, the content is not downgraded. This is
+    only done for files whose objects are already valid in PDF 1.5, those
+    using a later feature are converted by Ghostscript."""
+    import pypdf
+
+    try:
+        reader = pypdf.PdfReader(filename)
+        if reader.is_encrypted or _uses_later_pdf_features(reader):
+            return False
+        writer = pypdf.PdfWriter(clone_from=reader)
+        writer.pdf_header = "%PDF-{}.{}".format(*PDF_VERSION)
+        writer.write(output_path)
+    except (pypdf.errors.PyPdfError, OSError, ValueError, KeyError) as e:
+        log.debug("pypdf cannot rewrite %s: %s", filename, e)
+        Path(output_path).unlink(missing_ok=True)
+        return False
+    return True
+
+
+def _ps_string(path: Path) -> str:
+    path = str(path).replace("\\", "\\\\")
+    return "(" + path.replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+@tracer.traced("asset")
+def pdf2pdf15_gs(files: list) -> list:
+    """Convert PDFs to PDF 1.5 with a single Ghostscript process, given
+    (source, destination) pairs. The output file is switched before each
+    source is read, which -dSAFER (the default since Ghostscript 9.50)
+    only allows in the directories permitted for writing. If the batch
+    fails, files are converted with one Ghostscript process each. Return
+    the pairs which could not be converted."""
     command = [
         "gs",
         "-sDEVICE=pdfwrite",
@@ -196,79 +443,187 @@ def pdf2pdf15(filename: Path, output_path: Path) -> Path:
         "-dNOPAUSE",
         "-dQUIET",
         "-dBATCH",
-        "-sOutputFile=" + str(output_path),
-        str(filename),
     ]
+    directories = sorted({Path(output_path).resolve().parent for _, output_path in files})
+    command += [f"--permit-file-write={directory}/" for directory in directories]
+    for filename, output_path in files:
+        command += [
+            "-c",
+            f"<< /OutputFile {_ps_string(output_path)} >> setpagedevice",
+            "-f",
+            str(filename),
+        ]
 
     log.debug("Running command: %s", " ".join(str(e) for e in command))
     completed_process = subprocess.run(command, check=False)
     if completed_process.returncode != 0:
-        log.error("Return code %s", completed_process.returncode)
-        return None
-    return output_path
-
+        # Outputs may be truncated, they are converted again one by one
+        log.warning("Ghostscript batch failed, converting files one by one")
+        for _, output_path in files:
+            Path(output_path).unlink(missing_ok=True)
+
+    failed = []
+    for filename, output_path in files:
+        if Path(output_path).exists():
+            continue
+        completed_process = subprocess.run(
+            [*command[:6], f"-sOutputFile={output_path}", str(filename)], check=False
+        )
+        if completed_process.returncode != 0:
+            log.error("Return code %s", completed_process.returncode)
+        if not Path(output_path).exists():
+            failed.append((filename, output_path))
+    return failed
+
+
+def normalize_pdfs(files: list) -> list:
+    """Make PDFs includable by the LaTeX engines, given (source,
+    destination) pairs. Files up to PDF 1.5 are moved as is, others are
+    relabelled in-process by pypdf if they use no later feature, the
+    remaining ones are converted by Ghostscript. Sources are consumed.
+    Return the pairs which could not be converted."""
+    fallback = []
+    for filename, output_path in files:
+        version = get_pdf_version(filename)
+        if version and version <= PDF_VERSION:
+            os.replace(filename, output_path)
+        elif version and _pdf2pdf15_pypdf(filename, output_path):
+            Path(filename).unlink()
+        else:
+            fallback.append((filename, output_path))
 
-def drawio2pdf(filename: Path, output_path: Path) -> Path:
+    failed = []
+    if fallback:
+        log.info("Converting %d files to PDF 1.5 with Ghostscript", len(fallback))
+        failed = pdf2pdf15_gs(fallback)
+        for filename, _ in fallback:
+            Path(filename).unlink(missing_ok=True)
+    return failed
 
-    pdfpath = get_filename_from_content(filename.read_bytes(), output_path).with_suffix(
-        ".drawio.pdf"
-    )
 
-    intermediate = output_path / filename.with_suffix(".pdf").name
+def pdf2pdf15(filename: Path, output_path: Path) -> Path:
+    """Convert a PDF to PDF 1.5 format."""
+    if pdf2pdf15_gs([(filename, output_path)]):
+        return None
+    return output_path
 
-    if not pdfpath.exists():
-        log.info("Converting %s to PDF...", filename)
 
-        pwd = Path().absolute()
-        command = get_docker_command(pwd) + [
+# Messages of the headless Electron app which are not errors
+DRAWIO_IGNORED = [
+    "Could not create a backing OpenGL context",
+    "failed with error EGL_NOT_INITIALIZED",
+    "Initialization of all EGL display types failed",
+    "GLDisplayEGL::Initialize failed",
+    "Exiting GPU process due to errors during initialization",
+    "'font-feature-settings' is not a valid property name",
+    "ContextResult::kTransientFailure: Failed to send",
+    "libGL error: failed to load driver: swrast",
+    "libGL error: MESA-LOADER: failed to open swrast",
+    "Failed to connect to the bus",
+]
+
+
+def get_drawio_job(filename: Path, output_path: Path) -> dict:
+    """Files involved in the export of a draw.io figure, the PDF is
+    named after the content of the figure."""
+    digest = get_file_digest(filename)
+    return {
+        "source": filename,
+        "pdf": get_asset_filename("drawio2pdf", digest, output_path, ".drawio.pdf"),
+    }
+
+
+@tracer.traced("asset")
+def _drawio2pdf_session(jobs: list) -> list:
+    """Export draw.io figures in a single draw.io session. Figures are
+    staged under their content-addressed names in a folder which is
+    exported at once, the PDF of each figure is then normalized to its
+    final name. Return the failed jobs."""
+    wdir = Path(tempfile.mkdtemp(prefix="drawio-", dir=jobs[0]["pdf"].parent))
+    try:
+        (wdir / "in").mkdir()
+        for job in jobs:
+            shutil.copyfile(job["source"], wdir / "in" / job["pdf"].stem)
+
+        log.info("Converting %d draw.io figures to PDF...", len(jobs))
+
+        # Docker is chrooted, files must be in the working directory
+        command = get_docker_command(wdir) + [
             "rlespinasse/drawio-desktop-headless",
             "--export",
             "--format",
             "pdf",
             #'--crop',
             "--output",
-            f"{output_path.relative_to(pwd)}",
-            f"{filename.relative_to(pwd)}",
+            "out",
+            "in",
         ]
-
-        log.info("Running %s", " ".join(str(e) for e in command))
-
-        # Recompile the svg file
+        log.debug("Running %s", " ".join(str(e) for e in command))
         completed_process = subprocess.run(command, stderr=subprocess.PIPE, check=False)
         for line in completed_process.stderr.splitlines():
-            ignore = [
-                "Could not create a backing OpenGL context",
-                "failed with error EGL_NOT_INITIALIZED",
-                "Initialization of all EGL display types failed",
-                "GLDisplayEGL::Initialize failed",
-                "Exiting GPU process due to errors during initialization",
-                "'font-feature-settings' is not a valid property name",
-                "ContextResult::kTransientFailure: Failed to send",
-                "libGL error: failed to load driver: swrast",
-                "libGL error: MESA-LOADER: failed to open swrast",
-                "Failed to connect to the bus",
-            ]
-            if not any([i in line.decode() for i in ignore]) and len(line.decode()) > 3:
-                log.error("drawio: %s", line.decode())
+            line = line.decode(errors="replace")
+            if not any(i in line for i in DRAWIO_IGNORED) and len(line) > 3:
+                log.error("drawio: %s", line)
 
         if completed_process.returncode != 0:
             log.error(
-                "Could not process %s, return code %s",
-                filename,
+                "Could not export %s, return code %s",
+                ", ".join(str(job["source"]) for job in jobs),
                 completed_process.returncode,
             )
+            return jobs
+
+        # Exports are normalized to PDF 1.5 under their final names
+        exported = {
+            job["pdf"]: (wdir / "out" / job["pdf"].stem).with_suffix(".pdf")
+            for job in jobs
+        }
+        normalize_pdfs(
+            [(src, dst) for dst, src in exported.items() if src.exists()]
+        )
+        return [job for job in jobs if not job["pdf"].exists()]
+    finally:
+        shutil.rmtree(wdir, ignore_errors=True)
+
+
+def drawio2pdf_batch(jobs: list, sessions: int = 1) -> list:
+    """Export draw.io figures not exported yet, sharded across at most
+    `sessions` concurrent draw.io sessions. If a session fails its
+    figures are exported one by one so a faulty figure does not prevent
+    the others from being exported. Return the jobs that failed."""
+    unique = {}
+    for job in jobs:
+        if not job["pdf"].exists():
+            unique.setdefault(job["pdf"], job)
+    if not unique:
+        return []
+
+    pending = list(unique.values())
+    size = ceil(len(pending) / max(1, sessions))
+    shards = [pending[i : i + size] for i in range(0, len(pending), size)]
+
+    with ThreadPoolExecutor(max(1, sessions)) as pool:
+        retry = [job for failed in pool.map(_drawio2pdf_session, shards) for job in failed]
+        if len(shards) == len(pending):
+            failed = retry
         else:
-            # Drawio cannot output to a specific file,
-            # so we need to move it manually :(
-            # shutil.move(intermediate, pdfpath)
+            if retry:
+                log.warning("Converting %d draw.io figures one by one", len(retry))
+            failed = [
+                job
+                for result in pool.map(_drawio2pdf_session, [[job] for job in retry])
+                for job in result
+            ]
 
-            # Instead of moving, we convert the file to PDF 1.5
-            log.info(f"Converting {intermediate} to PDF 1.5 -> {pdfpath}")
-            pdfpath = pdf2pdf15(intermediate, pdfpath)
-            intermediate.unlink()
-            log.debug("Command succeeded")
+    for job in failed:
+        log.error("Could not process %s", job["source"])
+    return failed
 
-    return pdfpath
+
+def drawio2pdf(filename: Path, output_path: Path) -> Path:
+    job = get_drawio_job(filename, output_path)
+    drawio2pdf_batch([job])
+    return job["pdf"]
 
 
 RE_VIEWBOX = re.compile(
@@ -300,21 +655,32 @@ def add_size_to_svg(svg: str) -> tuple:
     return svg
 
 
-def svg2pdf_cairo(svg: Union[str, Path], output_path=Path()) -> Path:
+def get_svg_pdf_name(svg: Union[str, Path], output_path=Path()) -> Path:
     if isinstance(svg, Path):
-        svg = svg.read_text()
+        digest = get_file_digest(svg)
+    else:
+        digest = get_digest(svg.encode() if isinstance(svg, str) else svg)
+    return get_asset_filename("svg2pdf", digest, output_path, ".pdf")
 
-    pdfpath = get_filename_from_content(svg, output_path).with_suffix(".pdf")
 
-    svg = add_size_to_svg(svg)
+@tracer.traced("asset")
+def svg2pdf_cairo(svg: Union[str, Path], output_path=Path()) -> Path:
+    pdfpath = get_svg_pdf_name(svg, output_path)
 
     if not pdfpath.exists():
+        import cairosvg
+
+        if isinstance(svg, Path):
+            svg = svg.read_text()
+        svg = add_size_to_svg(svg)
         cairosvg.svg2pdf(bytestring=svg, write_to=str(pdfpath.with_suffix(".temp.pdf")))
-        pdf2pdf15(pdfpath.with_suffix(".temp.pdf"), pdfpath)
-        os.remove(pdfpath.with_suffix(".temp.pdf"))
+        if normalize_pdfs([(pdfpath.with_suffix(".temp.pdf"), pdfpath)]):
+            log.error("SVG not converted to PDF 1.5: %s", pdfpath.name)
+            return None
     return pdfpath
 
 
+@tracer.traced("asset")
 def svg2pdf_inkscape(svg, output_path=Path()):
     log.info("Converting SVG to PDF...")
     # Create temporary svg file
@@ -382,6 +748,8 @@ svg2pdf = svg2pdf_cairo
 
 
 def get_pdf_page_sizes(pdf_path):
+    import pypdf
+
     reader = pypdf.PdfReader(pdf_path)
     for page in reader.pages:
         media_box = page.mediabox
@@ -0,0 +1,73 @@
+import pypdf
+import pytest
+
+from mkdocs_plugin_books.assets import AssetIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    assets = tmp_path / "assets"
+    assets.mkdir()
+    for name in ("logo.png", "plot.png", "stale.png"):
+        (assets / name).write_bytes(name.encode())
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(72, 144)
+    writer.write(assets / "figure.pdf")
+
+    index = AssetIndex(tmp_path / "assets.db", assets)
+    yield index
+    index.close()
+
+
+def names(files):
+    return sorted(file.name for file in files)
+
+
+def test_update_records_assets(index):
+    index.update_page(
+        "intro.md",
+        {
+            index.assets_path / "figure.pdf": {"type": "svg", "source": "figure.svg"},
+            "logo.png": {"type": "twemoji", "url": "https://example.org/logo.png"},
+        },
+    )
+
+    figure = index.get("figure.pdf")
+    assert figure["source"] == "figure.svg"
+    assert figure["converter"] == "svg"
+    assert round(figure["width"]) == 25 and round(figure["height"]) == 51
+    assert index.get(index.assets_path / "logo.png")["source"].endswith("logo.png")
+    assert index.get("plot.png") is None
+
+
+def test_collect_keeps_assets_still_referenced(index):
+    index.update_page("intro.md", {"figure.pdf": {}, "logo.png": {}})
+    index.update_page("usage.md", {"figure.pdf": {}, "plot.png": {}})
+
+    # The figure is no longer used by one page but still by the other
+    index.update_page("usage.md", {"plot.png": {}})
+    assert names(index.collect_garbage()) == ["stale.png"]
+    assert index.get("figure.pdf") is not None
+    assert (index.assets_path / "figure.pdf").exists()
+
+
+def test_collect_removes_assets_of_removed_pages(index):
+    index.update_page("intro.md", {"figure.pdf": {}, "logo.png": {}})
+    index.update_page("usage.md", {"figure.pdf": {}, "plot.png": {}})
+
+    index.retain_pages(["intro.md"])
+    assert names(index.collect_garbage()) == ["plot.png", "stale.png"]
+    assert index.get("plot.png") is None
+    assert names(index.assets_path.iterdir()) == ["figure.pdf", "logo.png"]
+
+
+def test_references_survive_reopening(tmp_path, index):
+    index.update_page("intro.md", {"logo.png": {}})
+    index.db.commit()
+
+    reopened = AssetIndex(tmp_path / "assets.db", index.assets_path)
+    try:
+        reopened.retain_pages(["intro.md"])
+        assert "logo.png" not in names(reopened.collect_garbage())
+    finally:
+        reopened.close()
@@ -0,0 +1,30 @@
+import shutil
+from pathlib import Path
+
+from click.testing import CliRunner
+from mkdocs.commands.build import build
+from mkdocs.config import load_config
+
+from mkdocs_plugin_books.cli import main
+
+DOCS = Path(__file__).parent.parent / "docs"
+
+
+def test_render_snapshot_of_docs(tmp_path, monkeypatch):
+    """Books of the documentation, default book included, are rendered
+    again from the snapshot saved by their build."""
+    shutil.copytree(DOCS, tmp_path / "docs")
+    monkeypatch.chdir(tmp_path)
+
+    config = load_config(
+        str(tmp_path / "docs" / "mkdocs.yml"), site_dir=str(tmp_path / "site")
+    )
+    config.plugins["books"].config.snapshot = "snapshot.json.gz"
+    build(config)
+
+    book = tmp_path / "docs" / config.site_name
+    shutil.rmtree(book)
+    result = CliRunner().invoke(main, ["render", str(tmp_path / "docs" / "snapshot.json.gz")])
+    assert result.exit_code == 0, result.output
+    assert (book / "main.tex").exists()
+    assert (book / "index.tex").exists()
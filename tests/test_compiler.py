@@ -0,0 +1,126 @@
+import json
+
+import pypdf
+
+from mkdocs_plugin_books.compiler import (
+    PARTS_FILE,
+    PartCompiler,
+    SplitCompiler,
+    get_page_labels,
+)
+
+PARTS = ["main-front", "main-01", "main-02", "main-back"]
+
+AUX = {
+    "main-front": "\\relax\n",
+    "main-01": (
+        "\\relax\n"
+        "\\@writefile{toc}{\\contentsline {chapter}{\\numberline {1}Intro}{1}{chapter.1}}\n"
+        "\\@writefile{lof}{\\contentsline {figure}{\\numberline {1.1}Plot}{2}{figure.1.1}}\n"
+        "\\newlabel{intro}{{1}{1}}\n"
+    ),
+    "main-02": (
+        "\\relax\n"
+        "\\@writefile{toc}{\\contentsline {chapter}{\\numberline {2}Usage}{5}{chapter.2}}\n"
+        "\\@writefile{lot}{\\contentsline {table}{\\numberline {2.1}Options}{6}{table.2.1}}\n"
+    ),
+    "main-back": (
+        "\\relax\n"
+        "\\@writefile{toc}{\\contentsline {chapter}{Glossary}{9}{chapter*.3}}\n"
+    ),
+}
+
+
+def split_build(tmp_path):
+    """Auxiliary files of a split build after a first run of the
+    chapters: only the front and back parts open their lists."""
+    for part, aux in AUX.items():
+        (tmp_path / f"{part}.aux").write_text(aux)
+    (tmp_path / "main-front.toc").write_text(
+        "\\contentsline {chapter}{Preface}{i}{chapter*.1}\n"
+    )
+    (tmp_path / "main-01.glo").write_text("\\glossaryentry{api}{1}\n")
+    return {part: PartCompiler(tmp_path, part, PARTS) for part in PARTS}
+
+
+def test_contents_of_the_chapters(tmp_path):
+    compilers = split_build(tmp_path)
+
+    assert compilers["main-front"].merge_inputs()
+    toc = (tmp_path / "main-front.toc").read_text().splitlines()
+    assert [line.split("}{")[1] for line in toc] == [
+        "Preface",
+        "\\numberline {1}Intro",
+        "\\numberline {2}Usage",
+        "Glossary",
+    ]
+    # Stable once merged
+    assert not compilers["main-front"].merge_inputs()
+
+
+def test_lists_of_the_chapters(tmp_path):
+    compilers = split_build(tmp_path)
+
+    compilers["main-back"].merge_inputs()
+    assert "{figure.1.1}" in (tmp_path / "main-back.lof").read_text()
+    assert "{table.2.1}" in (tmp_path / "main-back.lot").read_text()
+    assert "\\glossaryentry{api}" in (tmp_path / "main-back.glo").read_text()
+
+
+# Pages, page label style and first page number of the PDF of each part
+PDFS = {
+    "main-front": (2, "/r", 1),
+    "main-01": (3, "/D", 1),
+    "main-02": (2, "/D", 4),
+    "main-back": (1, "/D", 6),
+}
+
+
+def compiled_parts(tmp_path):
+    """PDF and counters of the parts of a split build once compiled."""
+    (tmp_path / PARTS_FILE).write_text(json.dumps(PARTS))
+    for chapter, (part, (pages, style, start)) in enumerate(PDFS.items()):
+        writer = pypdf.PdfWriter()
+        for _ in range(pages):
+            writer.add_blank_page(100, 100)
+        writer.set_page_label(0, pages - 1, style, None, start)
+        writer.add_outline_item(part, 0)
+        writer.write(tmp_path / f"{part}.pdf")
+        (tmp_path / f"{part}.aux").write_text(
+            f"\\newlabel{{{part}}}{{{{{chapter}}}{{{start}}}}}\n"
+            f"%mkbook-counters part=0 chapter={chapter} exercisecounter=0\n"
+        )
+    return SplitCompiler(tmp_path)
+
+
+def test_seeds_of_the_parts(tmp_path):
+    compiler = compiled_parts(tmp_path)
+
+    assert len(compiler.write_seeds(compiler.compilers)) == len(PARTS)
+    seed = (tmp_path / "main-02-seed.tex").read_text()
+    # Main matter restarts at page 1 after the front part
+    assert "\\setcounter{page}{4}\\setcounter{part}{0}\\setcounter{chapter}{1}" in seed
+    assert "\\newlabel{main-01}" in seed
+    assert "\\newlabel{main-02}" not in seed
+    # Stable until the parts are compiled again
+    assert not compiler.write_seeds(compiler.compilers)
+
+
+def test_page_labels(tmp_path):
+    compiled_parts(tmp_path)
+
+    labels = get_page_labels(pypdf.PdfReader(tmp_path / "main-02.pdf"))
+    assert [(index, label["/S"], label["/St"]) for index, label in labels] == [
+        (0, "/D", 4)
+    ]
+
+
+def test_merge(tmp_path):
+    compiler = compiled_parts(tmp_path)
+    compiler.merge()
+
+    reader = pypdf.PdfReader(tmp_path / "main.pdf")
+    assert len(reader.pages) == 8
+    assert reader.page_labels == ["i", "ii", "1", "2", "3", "4", "5", "6"]
+    assert [index for index, _ in get_page_labels(reader)] == [0, 2, 5, 7]
+    assert [item.title for item in reader.outline] == PARTS
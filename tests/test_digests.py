@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from mkdocs_plugin_books import digests
+from mkdocs_plugin_books.digests import DigestIndex, get_digest
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = DigestIndex(tmp_path / "digests.db")
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Paths hashed by the index, others were served from the index."""
+    paths = []
+    file_digest = digests._file_digest
+
+    def record(path, size):
+        paths.append(path.name)
+        return file_digest(path, size)
+
+    monkeypatch.setattr(digests, "_file_digest", record)
+    return paths
+
+
+def test_unchanged_file_is_not_hashed_again(tmp_path, index, hashed):
+    source = tmp_path / "figure.svg"
+    source.write_bytes(b"<svg/>")
+    assert index.get(source) == get_digest(b"<svg/>")
+    assert index.get(source) == get_digest(b"<svg/>")
+    assert hashed == ["figure.svg"]
+
+
+def test_size_change_is_hashed_again(tmp_path, index, hashed):
+    source = tmp_path / "figure.svg"
+    source.write_bytes(b"<svg/>")
+    stat = source.stat()
+    index.get(source)
+
+    source.write_bytes(b"<svg></svg>")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert index.get(source) == get_digest(b"<svg></svg>")
+    assert len(hashed) == 2
+
+
+def test_mtime_change_is_hashed_again(tmp_path, index, hashed):
+    source = tmp_path / "figure.svg"
+    source.write_bytes(b"<svg/>")
+    stat = source.stat()
+    index.get(source)
+
+    source.write_bytes(b"<SVG/>")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert index.get(source) == get_digest(b"<SVG/>")
+    assert len(hashed) == 2
+
+
+def test_replaced_file_is_hashed_again(tmp_path, index, hashed):
+    source = tmp_path / "figure.svg"
+    source.write_bytes(b"<svg/>")
+    stat = source.stat()
+    index.get(source)
+
+    # Same size and mtime, another inode as after a checkout
+    replacement = tmp_path / "replacement.svg"
+    replacement.write_bytes(b"<SVG/>")
+    os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(replacement, source)
+    assert source.stat().st_ino != stat.st_ino
+    assert index.get(source) == get_digest(b"<SVG/>")
+    assert len(hashed) == 2
+
+
+def test_digest_does_not_depend_on_the_index(tmp_path, index):
+    source = tmp_path / "large.bin"
+    content = bytes(digests.FAST_HASH_SIZE)
+    source.write_bytes(content)
+    assert index.get(source) == get_digest(content)
@@ -0,0 +1,20 @@
+import shutil
+
+from mkdocs_plugin_books.formatters import TEMPLATE_DIR, LaTeXFormatter
+
+
+def test_templates_are_shared(tmp_path):
+    shutil.copytree(TEMPLATE_DIR, tmp_path / "templates")
+    first = LaTeXFormatter(tmp_path / "templates")
+    second = LaTeXFormatter(tmp_path / "templates")
+    assert first.templates is second.templates
+
+
+def test_edited_templates_are_reloaded(tmp_path):
+    shutil.copytree(TEMPLATE_DIR, tmp_path / "templates")
+    formatter = LaTeXFormatter(tmp_path / "templates")
+    assert formatter.url("Site", url="https://example.org").startswith("\\href")
+
+    (tmp_path / "templates" / "url.tex").write_text(r"\url{\VAR{url}}")
+    formatter = LaTeXFormatter(tmp_path / "templates")
+    assert formatter.url("Site", url="https://example.org") == r"\url{https://example.org}"
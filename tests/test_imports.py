@@ -0,0 +1,40 @@
+import json
+import subprocess
+import sys
+
+from mkdocs_plugin_books.cli import IMPORT_SCRIPT, LAZY_MODULES
+
+# Milliseconds, well above the budget of `mkdocs-books bench imports`
+# so slow or loaded test machines do not fail
+IMPORT_BUDGET = 1000
+
+
+def imported_modules(statement: str) -> set:
+    """Top-level packages imported by a statement in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {
+        line.rsplit("|", 1)[-1].strip().split(".")[0]
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+def test_plugin_import_is_lazy():
+    modules = imported_modules("import mkdocs_plugin_books.plugin")
+    assert "mkdocs_plugin_books" in modules
+    assert not modules & set(LAZY_MODULES)
+
+
+def test_plugin_import_time():
+    timings = []
+    for _ in range(3):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, check=True
+        ).stdout
+        timings.append(json.loads(output)[0])
+    assert min(timings) * 1000 < IMPORT_BUDGET